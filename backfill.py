@@ -0,0 +1,451 @@
+#!/usr/bin/python
+"""
+Backfill of the FloodScan COGs and admin zonal stats for any date range.
+
+Produces, for every day with a daily SFED blob between --start and --end,
+the merged SFED + SFED_BASELINE COG published in the 90 day zip and the
+admin zonal means of both bands, e.g. to reprocess history after a new
+FloodScan version:
+
+    python backfill.py --start 2024-01-01 --end 2024-12-31 --output backfill
+
+The days are split into shards of consecutive days run on a pool of worker
+processes. Each worker opens the baseline and loads the zonal stats engines
+once, for every shard it runs. Completed days are recorded in a ledger in
+the output folder, with the fingerprint of their inputs, so an interrupted
+backfill resumes from where it stopped when run again, and only days whose
+blobs have changed since are processed again.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+from src.utils.blob_catalogue import BlobCatalogue, month_starts
+from src.utils.checkpoints import fingerprint
+from src.utils.ledger import DATE_FORMAT, DateLedger
+from src.utils.preflight import CONFIG_FILE, read_configuration
+from src.utils.storage import storage_credentials, storage_from_configuration
+
+logger = logging.getLogger(__name__)
+
+# State of a worker process, set up once by init_worker
+_worker = {}
+
+
+def list_blobs(storage, container, prefix, suffix, start, end):
+    """Daily blobs between `start` and `end` inclusive, by date."""
+    catalogue = BlobCatalogue(storage, container, prefix=prefix, suffix=suffix)
+    for month in month_starts(start, end):
+        catalogue.list_month(month)
+    return {
+        date: catalogue.blob_name(date)
+        for date in catalogue.dates_in_range(start, end)
+    }
+
+
+def blob_etags(storage, container, blobs):
+    """ETags of blobs in the container, fetched in parallel."""
+    with ThreadPoolExecutor(storage.max_workers) as executor:
+        infos = executor.map(lambda blob: storage.stat(container, blob), blobs)
+        return {blob: info.etag for blob, info in zip(blobs, infos)}
+
+
+def cog_name(date):
+    return f"{date.strftime('%Y%m%d')}_aer_floodscan_sfed.tif"
+
+
+def stats_path(output, admin_level, date):
+    return (
+        Path(output)
+        / "zonal_stats"
+        / f"adm{admin_level}"
+        / f"{date.strftime('%Y%m%d')}.parquet"
+    )
+
+
+def init_worker(configuration, baseline_file, boundaries_files, output):
+    """Set up a worker process: its own storage client, the lazily opened
+    baseline and the zonal stats engines, reused by every shard it runs."""
+    import dask
+
+    from floodscan import (
+        load_rp_raster,
+        load_zonal_stats_engine,
+        open_historical_baseline,
+    )
+    from src.utils.quantize import load_quantizer
+
+    logging.basicConfig(level=logging.INFO)
+    # The pool gives the parallelism, so days are computed on one thread
+    dask.config.set(scheduler="synchronous")
+    _, container, _ = storage_credentials(configuration)
+    _worker.update(
+        {
+            "storage": storage_from_configuration(configuration),
+            "container": container,
+            "baseline": open_historical_baseline(baseline_file),
+            "rp_raster": load_rp_raster(configuration),
+            "quantizer": load_quantizer(configuration),
+            "engines": {
+                admin_level: load_zonal_stats_engine(
+                    configuration["zonal_stats"], path, admin_level
+                )
+                for admin_level, path in boundaries_files.items()
+            },
+            "output": Path(output),
+        }
+    )
+
+
+def process_date(date, blob):
+    """Write the COG and the admin zonal stats of one day."""
+    import rioxarray as rxr
+
+    from floodscan import merge_with_baseline
+    from src.utils import cog_utils
+    from src.utils.grid import FLOODSCAN_GRID
+    from src.utils.zonal_stats import stats_frame
+
+    output = _worker["output"]
+    part = f"{date.strftime('%Y%m%d')}.{os.getpid()}.part"
+    geotiff_file = output / "downloads" / f"{part}.tif"
+    _worker["storage"].download(_worker["container"], blob, geotiff_file)
+    try:
+        with rxr.open_rasterio(geotiff_file, chunks="auto") as da_in:
+            da_sfed = da_in.sel({"band": 1}, drop=True).load()
+        da_sfed = FLOODSCAN_GRID.snap(da_sfed, full=True)
+    finally:
+        geotiff_file.unlink(missing_ok=True)
+    da_baseline = _worker["baseline"]["SFED_BASELINE"].sel(
+        {"dayofyear": int(date.strftime("%j"))}, drop=True
+    )
+
+    merged = merge_with_baseline(
+        da_sfed,
+        _worker["baseline"],
+        date,
+        rp_raster=_worker["rp_raster"],
+        quantizer=_worker["quantizer"],
+    ).load()
+    cog_file = output / "cogs" / cog_name(date)
+    cog_part = cog_file.with_name(f"{part}.tif")
+    cog_utils.write_cog(merged, cog_part)
+    os.replace(cog_part, cog_file)
+
+    # Zonal means of the float bands, snapped north up like the label grids
+    # of the engines
+    sfed = da_sfed.values
+    baseline = da_baseline.values
+    for admin_level, engine in _worker["engines"].items():
+        df = stats_frame(engine.units, [date], [engine.means(sfed)])
+        df = df.rename(columns={"value": "SFED"})
+        df["SFED_BASELINE"] = engine.means(baseline)
+        path = stats_path(output, admin_level, date)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path_part = path.with_name(f"{part}.parquet")
+        df.to_parquet(path_part, index=False)
+        os.replace(path_part, path)
+
+
+def process_shard(shard):
+    """
+    Process the days of a shard in order. A day that fails is logged and
+    skipped so the other days of the shard still get done.
+
+    Returns:
+        list: (date, error message or None) of each day
+    """
+    results = []
+    for date, blob in shard:
+        start = time.perf_counter()
+        try:
+            process_date(date, blob)
+        except Exception as err:
+            logger.exception(f"Backfill of {date:%Y-%m-%d} failed")
+            results.append((date, f"{type(err).__name__}: {err}"))
+            continue
+        logger.info(
+            f"Backfilled {date:%Y-%m-%d} in {time.perf_counter() - start:.1f}s"
+        )
+        results.append((date, None))
+    return results
+
+
+def plan_shards(blobs, fingerprints, ledger, shard_days):
+    """
+    Split the days not done yet into shards of consecutive days.
+
+    Args:
+        blobs (dict): Daily blob by date
+        fingerprints (dict): Fingerprint of the inputs of each date
+        ledger (DateLedger): Dates already done
+        shard_days (int): Days per shard
+
+    Returns:
+        tuple: (dates to process, shards of (date, blob) lists)
+    """
+    todo = [
+        date
+        for date in sorted(blobs)
+        if not ledger.done(date, fingerprints[date])
+    ]
+    shards = [
+        [(date, blobs[date]) for date in todo[i : i + shard_days]]
+        for i in range(0, len(todo), shard_days)
+    ]
+    return todo, shards
+
+
+def run_shards(executor, shards, ledger, fingerprints, blobs):
+    """
+    Run the shards on `executor`, recording each day that succeeds in the
+    ledger as soon as its shard is done.
+
+    Returns:
+        dict: Error of each failed day, by date string
+    """
+    failed = {}
+    futures = [executor.submit(process_shard, shard) for shard in shards]
+    for future in as_completed(futures):
+        for date, error in future.result():
+            if error is None:
+                ledger.record(
+                    date,
+                    fingerprints[date],
+                    blob=blobs[date],
+                    cog=cog_name(date),
+                )
+            else:
+                failed[date.strftime(DATE_FORMAT)] = error
+        logger.info(f"{len(ledger)} of {len(blobs)} days done")
+    return failed
+
+
+def combine_stats(output, admin_level, dates):
+    """Concatenate the daily zonal stats of an admin level into one Parquet
+    file for the whole range."""
+    import pandas as pd
+
+    paths = [stats_path(output, admin_level, date) for date in dates]
+    paths = [path for path in paths if path.exists()]
+    if not paths:
+        return None
+    df = pd.concat(
+        (pd.read_parquet(path) for path in paths), ignore_index=True
+    )
+    combined = (
+        Path(output)
+        / f"zonal_stats_adm{admin_level}_{min(dates):%Y%m%d}_{max(dates):%Y%m%d}.parquet"  # noqa: E501
+    )
+    df.to_parquet(combined, index=False)
+    logger.info(f"Wrote {len(df)} admin {admin_level} rows to {combined}")
+    return combined
+
+
+def backfill(
+    configuration,
+    start,
+    end,
+    output,
+    workers=None,
+    shard_days=7,
+    admin_levels=(1, 2),
+):
+    """
+    Backfill the COGs and admin zonal stats of the days from `start` to
+    `end` inclusive.
+
+    Args:
+        configuration (dict): Project configuration
+        start (datetime): First day
+        end (datetime): Last day
+        output (str or Path): Folder for the COGs, zonal stats and ledger
+        workers (int): Worker processes. Defaults to None, one per CPU.
+        shard_days (int): Consecutive days run by a worker at a time
+        admin_levels (Iterable[int]): Admin levels of the zonal stats
+
+    Returns:
+        dict: Numbers of days found, already done, processed and failed,
+        with the error of each failed day
+    """
+    # Imported here so that --help stays fast
+    from floodscan import (
+        cog_fingerprint_inputs,
+        load_rp_raster,
+        load_zonal_stats_engine,
+    )
+    from run import AzureBlobDownload, get_download_cache
+    from src.utils.quantize import load_quantizer
+
+    output = Path(output)
+    for folder in ("cogs", "downloads", "inputs"):
+        (output / folder).mkdir(parents=True, exist_ok=True)
+    account, container, key = storage_credentials(configuration)
+    baseline_blob = configuration["baseline_filename"]
+    zonal_stats_config = configuration["zonal_stats"]
+
+    with storage_from_configuration(
+        configuration
+    ) as storage, AzureBlobDownload(
+        cache=get_download_cache(configuration),
+        storage=storage,
+        user_agent="hdx-floodscan-backfill",
+    ) as downloader:
+        blobs = list_blobs(
+            storage,
+            container,
+            configuration["daily_blob_prefix"],
+            configuration["daily_blob_suffix"],
+            start,
+            end,
+        )
+        logger.info(f"{len(blobs)} days with a blob from {start} to {end}")
+
+        def download(blob_container, blob):
+            path = output / "inputs" / blob_container / blob
+            path.parent.mkdir(parents=True, exist_ok=True)
+            return downloader.download_file(
+                url=blob,
+                account=account,
+                container=blob_container,
+                key=key,
+                blob=blob,
+                path=str(path),
+            )
+
+        # Inputs shared by every day are fetched once, and the zonal stats
+        # engines are built (and cached) here so the workers only load them
+        baseline_file = download(container, baseline_blob)
+        boundaries_files = {}
+        engine_versions = {}
+        for admin_level in admin_levels:
+            boundaries_files[admin_level] = download(
+                zonal_stats_config["boundaries_container"],
+                zonal_stats_config["boundaries_blob"].format(
+                    admin_level=admin_level
+                ),
+            )
+            engine_versions[admin_level] = load_zonal_stats_engine(
+                zonal_stats_config, boundaries_files[admin_level], admin_level
+            ).version
+
+        etags = blob_etags(
+            storage, container, [baseline_blob, *blobs.values()]
+        )
+
+    cog_settings = cog_fingerprint_inputs(
+        load_rp_raster(configuration), load_quantizer(configuration)
+    )
+    fingerprints = {
+        date: fingerprint(
+            blob,
+            etags[blob],
+            baseline_blob,
+            etags[baseline_blob],
+            zonal_stats_config.get("method"),
+            engine_versions,
+            *cog_settings,
+        )
+        for date, blob in blobs.items()
+    }
+    ledger = DateLedger(output / "ledger.jsonl")
+    todo, shards = plan_shards(blobs, fingerprints, ledger, shard_days)
+    logger.info(
+        f"{len(blobs) - len(todo)} days already done, {len(todo)} to "
+        f"backfill in {len(shards)} shards"
+    )
+
+    failed = {}
+    if shards:
+        # Spawned rather than forked: the parent holds connection pools and
+        # GDAL state that should not be copied into the workers
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+            initargs=(configuration, baseline_file, boundaries_files, output),
+        ) as executor:
+            failed = run_shards(executor, shards, ledger, fingerprints, blobs)
+
+    for admin_level in admin_levels:
+        combine_stats(output, admin_level, list(blobs))
+    if failed:
+        logger.error(f"{len(failed)} days failed: {sorted(failed)}")
+    return {
+        "days": len(blobs),
+        "already_done": len(blobs) - len(todo),
+        "processed": len(todo) - len(failed),
+        "failed": failed,
+    }
+
+
+def parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--start", type=parse_date, required=True, help="First day"
+    )
+    parser.add_argument(
+        "--end", type=parse_date, required=True, help="Last day"
+    )
+    parser.add_argument(
+        "--output", help="Output folder. Defaults to the configured one."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Worker processes. Defaults to the configured number.",
+    )
+    parser.add_argument(
+        "--shard-days",
+        type=int,
+        help="Consecutive days per shard. Defaults to the configured number.",
+    )
+    parser.add_argument(
+        "--admin-levels",
+        type=int,
+        nargs="+",
+        help="Admin levels of the zonal stats. Defaults to the configured.",
+    )
+    parser.add_argument("--config", default=CONFIG_FILE)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.end < args.start:
+        raise SystemExit("--end is before --start")
+    configuration = read_configuration(args.config)
+    backfill_config = configuration.get("backfill") or {}
+    start = time.perf_counter()
+    summary = backfill(
+        configuration,
+        args.start,
+        args.end,
+        args.output or backfill_config.get("output", "backfill"),
+        workers=args.workers or backfill_config.get("workers"),
+        shard_days=args.shard_days or backfill_config.get("shard_days", 7),
+        admin_levels=args.admin_levels
+        or backfill_config.get("admin_levels", [1, 2]),
+    )
+    logger.info(f"Backfill took {time.perf_counter() - start:.1f}s: {summary}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Import time profile of the pipeline's entry points.
+
+Imports each module in a fresh interpreter with `python -X importtime` and
+reports its total import time and the imports that take longest, with their
+own time and the time including the modules they import. Heavy dependencies
+should only show up under the modules of the stages using them.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.import_time --modules run src.utils.preflight
+
+Each module is imported `--repeat` times and the fastest run is kept, as the
+first import after a change also compiles the bytecode.
+"""
+
+import argparse
+import json
+import logging
+import subprocess
+import sys
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_MODULES = ["run", "src.utils.preflight", "floodscan"]
+
+
+def parse_importtime(stderr):
+    """
+    Parse the `-X importtime` output of an interpreter.
+
+    Returns:
+        list: One dict per imported module with its name, self_us (time
+        spent in the module itself), cumulative_us (including the modules
+        it imported) and depth in the import tree
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append(
+            {
+                "module": name.strip(),
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+                "depth": (len(name) - len(name.lstrip())) // 2,
+            }
+        )
+    return imports
+
+
+def profile_import(module, repeat=3):
+    """Import `module` in fresh interpreters and return the imports of the
+    fastest run, as parsed by parse_importtime."""
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"Importing {module} failed:\n{result.stderr[-2000:]}"
+            )
+        imports = parse_importtime(result.stderr)
+        total = next(i for i in imports if i["module"] == module)
+        if best is None or total["cumulative_us"] < best[0]:
+            best = (total["cumulative_us"], imports)
+    return best[1]
+
+
+def summarise(module, imports, top=15):
+    """Total import time of `module` and its `top` slowest imports."""
+    total = next(i for i in imports if i["module"] == module)
+    # Time spent in the modules of each top level package
+    packages = {}
+    for entry in imports:
+        package = entry["module"].split(".")[0]
+        packages[package] = packages.get(package, 0) + entry["self_us"]
+    return {
+        "module": module,
+        "total_s": total["cumulative_us"] / 1e6,
+        "modules_imported": len(imports),
+        "slowest": sorted(
+            imports, key=lambda i: i["cumulative_us"], reverse=True
+        )[1 : top + 1],
+        "packages_s": {
+            package: us / 1e6
+            for package, us in sorted(
+                packages.items(), key=lambda item: item[1], reverse=True
+            )[:top]
+        },
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--modules",
+        nargs="+",
+        default=DEFAULT_MODULES,
+        help="Modules to import",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Imports per module, the fastest is kept",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=15,
+        help="Number of slowest imports and packages to report",
+    )
+    parser.add_argument(
+        "--output",
+        default="import_time_results.json",
+        help="JSON file for the full results",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = []
+    for module in args.modules:
+        imports = profile_import(module, args.repeat)
+        summary = summarise(module, imports, args.top)
+        results.append(summary)
+
+        print(
+            f"\n{module}: {summary['total_s']:.3f}s, "
+            f"{summary['modules_imported']} modules"
+        )
+        print("  by top level package (self time):")
+        for package, seconds in summary["packages_s"].items():
+            print(f"    {package:<40} {seconds:8.3f}s")
+        print("  slowest imports (including their imports):")
+        for entry in summary["slowest"]:
+            print(
+                f"    {entry['module']:<40} "
+                f"{entry['cumulative_us'] / 1e6:8.3f}s"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,242 @@
+"""
+Accuracy and size report of the quantized SFED and SFED_BASELINE bands.
+
+Merges daily SFED rasters with the DOY baseline as floats and with each
+quantization, writes both as COGs and reports, per dtype, the error of the
+values read back from the COG against the floats, the size of the merged
+bands in memory and of the COGs on disk (which is also what is downloaded),
+and the time taken to merge and write them.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.quantize --days 5 --dtypes uint8 uint16
+
+Synthetic inputs are generated in the work folder unless real ones are
+given with --cogs and --baseline.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from tempfile import gettempdir
+
+import numpy as np
+
+from benchmarks import synthetic
+from src.utils import date_utils
+from src.utils.preflight import read_configuration
+from src.utils.quantize import Quantizer
+
+logger = logging.getLogger(__name__)
+
+BANDS = ["SFED", "SFED_BASELINE"]
+
+
+def cog_date(path):
+    """Date in the name of a daily GeoTIFF, as YYYY-MM-DD like the blobs or
+    YYYYMMDD like the COGs."""
+    match = re.search(r"\d{4}-\d{2}-\d{2}", Path(path).name)
+    if match:
+        return datetime.strptime(match.group(), "%Y-%m-%d")
+    return date_utils.extract_date(Path(path).name)
+
+
+def merge_and_write(cog, ds_baseline, out_file, quantizer=None):
+    """Merge a daily COG with the baseline and write the bands as a COG.
+
+    Returns:
+        tuple: (merged dataset, wall time in seconds)
+    """
+    import rioxarray as rxr
+
+    from floodscan import merge_with_baseline
+
+    start = time.perf_counter()
+    da = rxr.open_rasterio(cog, chunks="auto").sel(band=1, drop=True)
+    merged = merge_with_baseline(
+        da,
+        ds_baseline,
+        cog_date(cog),
+        quantizer=quantizer,
+    ).load()
+    merged.rio.to_raster(out_file, driver="COG")
+    return merged, time.perf_counter() - start
+
+
+def band_errors(values, expected):
+    """Errors of decoded values against the floats, over the cells with a
+    value in both."""
+    valid = ~np.isnan(expected) & ~np.isnan(values)
+    diff = values[valid].astype(np.float64) - expected[valid]
+    return {
+        "cells": int(valid.sum()),
+        "nodata_mismatches": int(
+            (np.isnan(values) != np.isnan(expected)).sum()
+        ),
+        "max_abs_error": float(np.abs(diff).max()),
+        "rmse": float(np.sqrt(np.mean(diff**2))),
+        "mean_error": float(diff.mean()),
+        "exact_zero_share": float(
+            (values[valid][expected[valid] == 0] == 0).mean()
+        ),
+    }
+
+
+def report(cogs, baseline, work_dir, dtypes, max_value):
+    """Accuracy and sizes of each dtype against float32, summed over the
+    days of `cogs`."""
+    import rioxarray as rxr
+
+    from floodscan import open_historical_baseline
+
+    ds_baseline = open_historical_baseline(baseline)
+    out_dir = Path(work_dir) / "quantize"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for dtype in [None, *dtypes]:
+        quantizer = Quantizer(dtype, max_value=max_value) if dtype else None
+        name = dtype or "float32"
+        result = {
+            "memory_bytes": 0,
+            "cog_bytes": 0,
+            "wall_s": 0.0,
+            "bands": {band: [] for band in BANDS},
+        }
+        for cog in cogs:
+            out_file = out_dir / f"{Path(cog).stem}_{name}.tif"
+            merged, wall = merge_and_write(
+                cog, ds_baseline, out_file, quantizer
+            )
+            result["memory_bytes"] += merged.nbytes
+            result["cog_bytes"] += os.path.getsize(out_file)
+            result["wall_s"] += wall
+            if quantizer is None:
+                continue
+            float_file = out_dir / f"{Path(cog).stem}_float32.tif"
+            with rxr.open_rasterio(
+                out_file, mask_and_scale=True
+            ) as decoded, rxr.open_rasterio(float_file) as expected:
+                for i, band in enumerate(BANDS):
+                    result["bands"][band].append(
+                        band_errors(
+                            decoded.isel(band=i).values,
+                            expected.isel(band=i).values,
+                        )
+                    )
+        results[name] = summarise(result, results.get("float32"))
+    return results
+
+
+def summarise(result, reference):
+    """Combine the per day errors of a dtype and compare its sizes with
+    float32."""
+    summary = {
+        "memory_mb": round(result["memory_bytes"] / 1e6, 2),
+        "cog_mb": round(result["cog_bytes"] / 1e6, 2),
+        "wall_s": round(result["wall_s"], 3),
+    }
+    if reference is None:
+        return summary
+    summary["memory_ratio"] = round(
+        reference["memory_mb"] / summary["memory_mb"], 2
+    )
+    summary["cog_ratio"] = round(reference["cog_mb"] / summary["cog_mb"], 2)
+    for band, days in result["bands"].items():
+        cells = sum(day["cells"] for day in days)
+        summary[band] = {
+            "max_abs_error": max(day["max_abs_error"] for day in days),
+            "rmse": float(
+                np.sqrt(
+                    sum(day["rmse"] ** 2 * day["cells"] for day in days)
+                    / cells
+                )
+            ),
+            "mean_error": sum(day["mean_error"] * day["cells"] for day in days)
+            / cells,
+            "nodata_mismatches": sum(day["nodata_mismatches"] for day in days),
+            "exact_zero_share": min(day["exact_zero_share"] for day in days),
+        }
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--dtypes",
+        nargs="+",
+        default=["uint8", "uint16"],
+        help="Quantized dtypes to compare with float32",
+    )
+    parser.add_argument(
+        "--max-value",
+        type=float,
+        default=1.0,
+        help="Largest SFED value, as in the quantize configuration",
+    )
+    parser.add_argument(
+        "--days", type=int, default=5, help="Synthetic days to generate"
+    )
+    parser.add_argument("--cogs", nargs="+", help="Daily SFED GeoTIFFs")
+    parser.add_argument("--baseline", help="DOY baseline NetCDF")
+    parser.add_argument(
+        "--work-dir",
+        default=os.path.join(gettempdir(), "hdx-floodscan-benchmark"),
+        help="Folder for the synthetic data and the COGs written",
+    )
+    parser.add_argument(
+        "--output",
+        default="quantize_results.json",
+        help="JSON file for the results",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    data_dir = Path(args.work_dir) / "data" / "source"
+    # Same layout as run_benchmark, so the synthetic inputs are shared
+    cogs = args.cogs or synthetic.write_sfed_cogs(
+        data_dir,
+        "cogs",
+        read_configuration()["daily_blob_prefix"],
+        synthetic.daily_dates(datetime.today() - timedelta(days=1), args.days),
+    )
+    baseline = args.baseline or synthetic.write_baseline(
+        data_dir / "baseline.nc4"
+    )
+    results = report(
+        cogs, baseline, args.work_dir, args.dtypes, args.max_value
+    )
+
+    for name, summary in results.items():
+        print(
+            f"\n{name}: {summary['memory_mb']} MB in memory, "
+            f"{summary['cog_mb']} MB of COGs, {summary['wall_s']}s"
+        )
+        if name == "float32":
+            continue
+        print(
+            f"  {summary['memory_ratio']}x smaller in memory, "
+            f"{summary['cog_ratio']}x smaller on disk"
+        )
+        for band in BANDS:
+            errors = summary[band]
+            print(
+                f"  {band:<14} max error {errors['max_abs_error']:.2e}, "
+                f"RMSE {errors['rmse']:.2e}, bias {errors['mean_error']:.1e},"
+                f" {errors['nodata_mismatches']} nodata mismatches"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
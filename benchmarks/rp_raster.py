@@ -0,0 +1,173 @@
+"""
+Full globe throughput of the per-pixel return period classification.
+
+Writes a synthetic cube of yearly maxima on the 300 arcsecond global grid
+and classifies a synthetic daily SFED raster against it with
+ReturnPeriodRaster, for each number of rows per tile. Reports the wall time,
+pixels per second and the peak memory allocated while classifying, which
+grows with the tile size rather than the grid.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.rp_raster --tile-rows 64 256 1024 --check 2000
+
+With --check, the return periods of a sample of pixels are compared with
+return_periods.empirical_rp and the interpolation of fs_add_rp.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+import tracemalloc
+from pathlib import Path
+from tempfile import gettempdir
+
+import numpy as np
+
+from benchmarks import synthetic
+from src.utils.rp_raster import ReturnPeriodRaster, empirical_rp_grid
+
+logger = logging.getLogger(__name__)
+
+
+def check_sample(engine, values, n_pixels, seed=0):
+    """
+    Compare the return periods of `n_pixels` random pixels with the
+    tabular implementation.
+
+    Returns:
+        dict: Numbers of pixels compared, whose return periods differ, and
+        left out because the tabular return period is undefined (interp1d
+        gives NaN for a value equal to tied maxima)
+    """
+    import pandas as pd
+    from scipy.interpolate import interp1d
+
+    from src.utils.return_periods import empirical_rp
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, values.shape[0], n_pixels)
+    cols = rng.integers(0, values.shape[1], n_pixels)
+    maxima = np.asarray(engine.cube[:, rows, cols])
+    rp = empirical_rp_grid(maxima, values[rows, cols])
+    counts = {"compared": 0, "mismatches": 0, "undefined": 0}
+    for i in range(n_pixels):
+        df = empirical_rp(pd.DataFrame({"value": maxima[:, i]}))
+        # Tied maxima give empty interpolation segments
+        with np.errstate(invalid="ignore"):
+            expected = interp1d(
+                df["value"],
+                df["RP"],
+                bounds_error=False,
+                fill_value=(1, np.inf),
+            )(values[rows[i], cols[i]])
+        if np.isnan(expected) and not np.isnan(values[rows[i], cols[i]]):
+            counts["undefined"] += 1
+            continue
+        counts["compared"] += 1
+        if not np.isclose(rp[i], expected, equal_nan=True):
+            counts["mismatches"] += 1
+    return counts
+
+
+def run(engine, values, tile_rows, repeat):
+    """Best wall time of `repeat` classifications of the whole grid with
+    `tile_rows` rows per tile, and the peak memory of one of them."""
+    engine.tile_rows = tile_rows
+    walls = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        classes = engine.classify(values)
+        walls.append(time.perf_counter() - start)
+    tracemalloc.start()
+    engine.classify(values)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    wall = min(walls)
+    return {
+        "tile_rows": tile_rows,
+        "wall_s": round(wall, 3),
+        "mpixels_per_s": round(values.size / wall / 1e6, 2),
+        "peak_alloc_mb": round(peak / 1e6, 1),
+        "class_counts": np.bincount(classes.ravel(), minlength=9).tolist(),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--tile-rows",
+        type=int,
+        nargs="+",
+        default=[64, 128, 256, 512, 1080],
+        help="Rows per tile to run with",
+    )
+    parser.add_argument(
+        "--years", type=int, default=26, help="Years of maxima in the cube"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs per tile size, the fastest is kept",
+    )
+    parser.add_argument(
+        "--check",
+        type=int,
+        default=0,
+        help="Pixels compared with the tabular implementation",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=os.path.join(gettempdir(), "hdx-floodscan-benchmark"),
+        help="Folder for the synthetic cube",
+    )
+    parser.add_argument(
+        "--output",
+        default="rp_raster_results.json",
+        help="JSON file for the results",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cube_file = synthetic.write_rp_cube(
+        Path(args.work_dir) / f"rp_cube_{args.years}y.npy", args.years
+    )
+    engine = ReturnPeriodRaster(cube_file)
+    values = synthetic.flood_field(
+        np.random.default_rng(args.years), wet_fraction=0.2
+    )
+    logger.info(
+        f"Classifying {values.size / 1e6:.1f}M pixels against "
+        f"{len(engine.years)} years of maxima"
+    )
+
+    results = {"years": len(engine.years), "runs": []}
+    if args.check:
+        results["check"] = check_sample(engine, values, args.check)
+        logger.info(
+            f"{results['check']['mismatches']} of "
+            f"{results['check']['compared']} pixels differ from the tabular "
+            f"return periods, {results['check']['undefined']} undefined there"
+        )
+    for tile_rows in args.tile_rows:
+        result = run(engine, values, tile_rows, args.repeat)
+        results["runs"].append(result)
+        print(
+            f"tile_rows {tile_rows:>5}: {result['wall_s']:7.3f}s "
+            f"{result['mpixels_per_s']:8.2f} Mpixels/s "
+            f"{result['peak_alloc_mb']:8.1f} MB peak"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,329 @@
+"""
+Offline end-to-end benchmark of Floodscan.get_data.
+
+Generates synthetic FloodScan inputs, serves them from a local blob storage
+stand-in (or straight from a local folder) and a SQLite copy of the zonal
+stats tables, runs the pipeline at each scale (days of COGs x number of
+admin 2 units) and reports the wall time and throughput of every stage
+recorded by the Instrumentation.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.run_benchmark --days 10 90 --units 250 2000
+
+The first run generates the synthetic data (a few minutes for the baseline),
+which is kept in the work folder and reused by later runs.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from tempfile import gettempdir
+
+import pandas as pd
+import yaml
+from hdx.location.country import Country
+from hdx.utilities.retriever import Retrieve
+
+import floodscan as floodscan_module
+from benchmarks import synthetic
+from benchmarks.stand_ins import BlobServer, SQLiteStats
+from floodscan import Floodscan
+from run import AzureBlobDownload
+from src.utils.checkpoints import CheckpointStore
+from src.utils.download_cache import DownloadCache
+from src.utils.instrumentation import Instrumentation
+from src.utils.storage import AzureBlobStorage, LocalStorage
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CONFIG_FILE = REPO_ROOT / "config" / "project_configuration.yaml"
+README_FILE = REPO_ROOT / "files" / "floodscan_readme.xlsx"
+ACCOUNT = "benchmark"
+KEY = base64.b64encode(b"benchmark").decode()
+
+
+@contextmanager
+def blob_storage(kind, blob_root, configuration):
+    """
+    Storage serving the blob folder: "http" goes through AzureBlobStorage
+    and the HTTP stand-in of the blob service, "local" reads the files
+    directly.
+    """
+    if kind == "local":
+        with LocalStorage(blob_root) as storage:
+            yield storage
+        return
+    with BlobServer(blob_root) as server, AzureBlobStorage(
+        ACCOUNT,
+        KEY,
+        **{**configuration.get("blob_download", {}), "endpoint": server.url},
+    ) as storage:
+        yield storage
+
+
+@contextmanager
+def stats_db(path):
+    """Point the pipeline's zonal stats queries at the SQLite stand-in."""
+    pg = floodscan_module.pg
+    floodscan_module.pg = SQLiteStats(path)
+    try:
+        yield
+    finally:
+        floodscan_module.pg = pg
+
+
+@contextmanager
+def working_directory(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def prepare_data(data_dir, configuration, days, units, latest_date):
+    """
+    Generate (or reuse) the synthetic inputs for one scale and lay them out
+    as blob containers.
+
+    Returns:
+        tuple: (blob root folder, container, SQLite database path)
+    """
+    data_dir = Path(data_dir)
+    prefix = configuration["daily_blob_prefix"]
+    baseline_blob = configuration["baseline_filename"]
+
+    # COGs and the baseline are generated once and hard linked into one
+    # container per number of days
+    cog_paths = synthetic.write_sfed_cogs(
+        data_dir / "source",
+        "cogs",
+        prefix,
+        synthetic.daily_dates(latest_date, days),
+    )
+    baseline_path = synthetic.write_baseline(
+        data_dir / "source" / "baseline.nc4"
+    )
+    blob_root = data_dir / f"blobs_{days}d_{units}u"
+    container = "floodscan"
+    if blob_root.exists():
+        shutil.rmtree(blob_root)
+    links = {
+        blob_root / container / baseline_blob: baseline_path,
+        **{
+            blob_root
+            / container
+            / path.relative_to(data_dir / "source" / "cogs"): path
+            for path in cog_paths
+        },
+    }
+    for link, target in links.items():
+        link.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(target, link)
+        except OSError:
+            shutil.copyfile(target, link)
+
+    admin = synthetic.admin_units(units)
+    polygon_folder = (
+        blob_root / configuration["zonal_stats"]["boundaries_container"]
+    )
+    synthetic.write_admin_boundaries(polygon_folder, admin)
+    synthetic.write_admin_lookup(
+        blob_root / "polygon" / "admin_lookup.parquet", admin
+    )
+
+    db_path = data_dir / f"stats_{units}u_{latest_date:%Y%m%d}.sqlite"
+    if not db_path.exists():
+        synthetic.write_stats_db(
+            db_path,
+            admin,
+            datetime(latest_date.year - 10, 1, 1),
+            latest_date,
+        )
+    return blob_root, container, db_path
+
+
+def run_scale(args, configuration, days, units, latest_date):
+    """Run get_data once at a scale and return the instrumentation summary."""
+    work_dir = Path(args.work_dir)
+    blob_root, container, db_path = prepare_data(
+        work_dir / "data", configuration, days, units, latest_date
+    )
+    run_dir = work_dir / f"run_{days}d_{units}u"
+    if run_dir.exists():
+        shutil.rmtree(run_dir)
+    (run_dir / "files").mkdir(parents=True)
+    shutil.copyfile(README_FILE, run_dir / "files" / README_FILE.name)
+
+    configuration = {
+        **configuration,
+        "download_cache": {},
+        "blob_catalogue": {"lookback_months": 4, "file": None},
+        "zonal_stats": {
+            **configuration["zonal_stats"],
+            "source": args.zonal_source,
+            "cache_folder": str(run_dir / "zonal_stats"),
+        },
+        "baseline_stats_source": "sql",
+    }
+    os.environ.update(
+        {"STORAGE_ACCOUNT": ACCOUNT, "CONTAINER": container, "KEY": KEY}
+    )
+    cache = None
+    if args.cache:
+        cache = DownloadCache(work_dir / "cache")
+    checkpoints = None
+    if args.checkpoints:
+        checkpoints = CheckpointStore(
+            work_dir / f"checkpoints_{days}d_{units}u"
+        )
+
+    instrumentation = Instrumentation()
+    with blob_storage(
+        args.storage, blob_root, configuration
+    ) as storage, working_directory(run_dir), stats_db(
+        db_path
+    ), AzureBlobDownload(
+        cache=cache, storage=storage, user_agent="hdx-floodscan-benchmark"
+    ) as downloader:
+        retriever = Retrieve(
+            downloader,
+            run_dir,
+            run_dir / "saved_data",
+            run_dir / "downloads",
+            False,
+            False,
+        )
+        floodscan = Floodscan(
+            configuration,
+            retriever,
+            str(run_dir),
+            None,
+            instrumentation,
+            storage=storage,
+            checkpoints=checkpoints,
+        )
+        with instrumentation.stage("get_data"):
+            floodscan.get_data()
+    if not args.keep_runs:
+        shutil.rmtree(run_dir)
+        shutil.rmtree(blob_root)
+    return instrumentation.summary()
+
+
+def throughput(summary, days, units):
+    """One row per stage with its wall time and throughput."""
+    rows = []
+    for stage in summary["stages"]:
+        wall = stage["wall_s"] or float("nan")
+        rows.append(
+            {
+                "days": days,
+                "units": units,
+                "stage": stage["stage"],
+                "wall_s": stage["wall_s"],
+                "cpu_s": stage["cpu_s"],
+                "peak_rss_mb": stage["peak_rss_bytes"] / 1e6,
+                "files_per_s": stage.get("files", float("nan")) / wall,
+                "rows_per_s": stage.get("rows", float("nan")) / wall,
+                "read_mb_per_s": stage.get("bytes_read", 0) / 1e6 / wall,
+                "written_mb_per_s": stage.get("bytes_written", 0) / 1e6 / wall,
+            }
+        )
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--days",
+        type=int,
+        nargs="+",
+        default=[10, 30, 90],
+        help="Numbers of days of COGs to run with",
+    )
+    parser.add_argument(
+        "--units",
+        type=int,
+        nargs="+",
+        default=[250, 1000],
+        help="Numbers of admin 2 units to run with",
+    )
+    parser.add_argument(
+        "--zonal-source",
+        choices=["db", "raster"],
+        default="db",
+        help="zonal_stats source: the SQLite stand-in or the rasters",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=["http", "local"],
+        default="http",
+        help="Read blobs through the HTTP blob service stand-in or directly",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Download through a download cache kept between runs",
+    )
+    parser.add_argument(
+        "--checkpoints",
+        action="store_true",
+        help="Resume from stage checkpoints kept between runs",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=os.path.join(gettempdir(), "hdx-floodscan-benchmark"),
+        help="Folder for the synthetic data and the runs",
+    )
+    parser.add_argument(
+        "--keep-runs",
+        action="store_true",
+        help="Keep the outputs of each run",
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark_results.json",
+        help="JSON file for the full results",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(CONFIG_FILE) as f:
+        configuration = yaml.safe_load(f)
+    Country.set_use_live_default(False)
+    latest_date = datetime.combine(
+        datetime.today().date() - timedelta(days=1), datetime.min.time()
+    )
+
+    results = []
+    rows = []
+    for units in args.units:
+        for days in args.days:
+            logger.info(f"Benchmarking {days} days, {units} admin 2 units")
+            summary = run_scale(args, configuration, days, units, latest_date)
+            results.append({"days": days, "units": units, **summary})
+            rows.extend(throughput(summary, days, units))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    df = pd.DataFrame(rows).set_index(["units", "days", "stage"])
+    print(df.round(3).to_string())
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
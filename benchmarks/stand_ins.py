@@ -0,0 +1,266 @@
+"""
+Local stand-ins for the blob storage and the zonal stats database, so the
+pipeline can be run end to end without credentials.
+"""
+
+import base64
+import hashlib
+import logging
+import sqlite3
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+from src.utils.storage import LocalStorage
+
+logger = logging.getLogger(__name__)
+
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+
+class _BlobHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _blob_path(self):
+        path = self.server.root / unquote(self.path.split("?")[0]).lstrip("/")
+        return path if path.is_file() else None
+
+    def _headers(self, path):
+        stat = path.stat()
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+        }
+        if self.server.content_md5:
+            headers["Content-MD5"] = self.server.md5(path, etag)
+        return headers, stat.st_size
+
+    def _send(self, status, headers, length):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def _respond(self, send_body):
+        path = self._blob_path()
+        if path is None:
+            self._send(404, {}, 0)
+            return
+        headers, size = self._headers(path)
+        if self.headers.get("If-None-Match") == headers["ETag"]:
+            self._send(304, headers, 0)
+            return
+        if_match = self.headers.get("If-Match")
+        if if_match and if_match != headers["ETag"]:
+            self._send(412, {}, 0)
+            return
+
+        byte_range = self.headers.get("x-ms-range") or self.headers.get(
+            "Range"
+        )
+        start, end, status = 0, size - 1, 200
+        if byte_range:
+            first, last = byte_range.split("=")[1].split("-")
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            # Content-MD5 is of the whole blob
+            headers.pop("Content-MD5", None)
+        self._send(status, headers, end - start + 1)
+        if not send_body:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(STREAM_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                self.wfile.write(block)
+                remaining -= len(block)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _list(self, container, prefix):
+        blobs = "".join(
+            f"<Blob><Name>{escape(info.name)}</Name><Properties>"
+            f"<Last-Modified>{info.last_modified}</Last-Modified>"
+            f"<Etag>{escape(info.etag)}</Etag>"
+            f"<Content-Length>{info.size}</Content-Length>"
+            "<BlobType>BlockBlob</BlobType></Properties></Blob>"
+            for info in self.server.storage.list(container, prefix)
+        )
+        body = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f'<EnumerationResults ServiceEndpoint="{self.server.url}/" '
+            f'ContainerName="{escape(container)}">'
+            f"<Prefix>{escape(prefix)}</Prefix><Blobs>{blobs}</Blobs>"
+            "<NextMarker /></EnumerationResults>"
+        ).encode()
+        self._send(200, {"Content-Type": "application/xml"}, len(body))
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if query.get("comp") == ["list"]:
+            container = unquote(url.path).strip("/")
+            self._list(container, query.get("prefix", [""])[0])
+            return
+        self._respond(send_body=True)
+
+
+class BlobServer(ThreadingHTTPServer):
+    """
+    HTTP stand-in for the Blob Storage service, serving `root/<container>/
+    <blob>` with the headers BlobDownloadClient relies on: ETag,
+    Last-Modified, Content-MD5, x-ms-range and Range requests, and
+    If-None-Match / If-Match conditions. Containers can be listed with the
+    List Blobs operation used by the Azure SDK (without paging). Requests
+    are not authenticated.
+
+    Args:
+        root (str or Path): Folder with one subfolder per container
+        port (int): Port to listen on. Defaults to any free port.
+        content_md5 (bool): Whether to send Content-MD5 for whole blobs
+    """
+
+    daemon_threads = True
+
+    def __init__(self, root, port=0, content_md5=True):
+        super().__init__(("127.0.0.1", port), _BlobHandler)
+        self.root = Path(root)
+        self.storage = LocalStorage(root)
+        self.content_md5 = content_md5
+        self._md5s = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def md5(self, path, etag):
+        key = (path, etag)
+        with self._lock:
+            if key in self._md5s:
+                return self._md5s[key]
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(STREAM_BLOCK_SIZE), b""):
+                md5.update(block)
+        value = base64.b64encode(md5.digest()).decode()
+        with self._lock:
+            self._md5s[key] = value
+        return value
+
+    def __enter__(self):
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="blob-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class SQLiteStats:
+    """
+    The zonal stats queries of src.utils.pg run against a SQLite copy of the
+    `floodscan` and `iso3` tables. The functions have the signatures of the
+    pg ones and return the same columns, so this can be used in place of the
+    pg module. `mode` is ignored.
+
+    Args:
+        path (str or Path): SQLite database written by write_stats_db
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def _read(self, query, params):
+        with sqlite3.connect(self.path) as con:
+            return pd.read_sql(query, con, params=params)
+
+    @staticmethod
+    def _hrp_clause(only_HRP):
+        if not only_HRP:
+            return ""
+        return " AND iso3 IN (SELECT iso3 FROM iso3 WHERE has_active_hrp)"
+
+    def fs_year_max(self, mode, admin_level, band="SFED"):
+        df = self._read(
+            """
+            SELECT iso3, pcode, strftime('%Y-01-01', valid_date) AS year_date,
+                   MAX(mean) AS value
+            FROM floodscan
+            WHERE adm_level = ? AND band = ? AND valid_date <= '2023-12-31'
+            GROUP BY iso3, pcode, year_date
+            """,
+            (admin_level, band),
+        )
+        df["year_date"] = pd.to_datetime(df["year_date"])
+        return df
+
+    def fs_rolling_11_day_mean(
+        self, mode, admin_level, band="SFED", only_HRP=False
+    ):
+        return self._read(
+            f"""
+            WITH filtered_data AS (
+                SELECT iso3, pcode, valid_date, mean
+                FROM floodscan
+                WHERE adm_level = ? AND band = ?
+                    AND valid_date >= date('now', 'start of year', '-10 years')
+                    AND valid_date < date('now', 'start of year')
+                    {self._hrp_clause(only_HRP)}
+            ),
+            rolling_mean AS (
+                SELECT iso3, pcode, valid_date,
+                       AVG(mean) OVER (
+                           PARTITION BY iso3, pcode ORDER BY valid_date
+                           ROWS BETWEEN 5 PRECEDING AND 5 FOLLOWING
+                       ) AS rolling_mean
+                FROM filtered_data
+            )
+            SELECT iso3, pcode,
+                   CAST(strftime('%j', valid_date) AS INTEGER) AS doy,
+                   AVG(rolling_mean) AS sfed_baseline
+            FROM rolling_mean
+            GROUP BY iso3, pcode, doy
+            """,
+            (admin_level, band),
+        )
+
+    def fs_last_90_days(self, mode, admin_level, band="SFED", only_HRP=False):
+        df = self._read(
+            f"""
+            SELECT iso3, pcode, valid_date, mean AS value
+            FROM floodscan
+            WHERE adm_level = ? AND band = ?
+              AND valid_date >= date('now', '-90 days')
+              {self._hrp_clause(only_HRP)}
+            """,
+            (admin_level, band),
+        )
+        df["valid_date"] = pd.to_datetime(df["valid_date"]).dt.date
+        return df
+
+    def fs_hrp_iso3(self, mode):
+        df = self._read("SELECT iso3 FROM iso3 WHERE has_active_hrp", ())
+        return df["iso3"].tolist()
@@ -0,0 +1,326 @@
+"""
+Synthetic FloodScan inputs for the offline benchmarks.
+
+Everything is written in the layout the pipeline reads in production:
+
+- daily SFED COGs on the 300 arcsecond global grid, named like the blobs
+  under `daily_blob_prefix`
+- the DOY baseline NetCDF, with a `__xarray_dataarray_variable__` variable
+  over (dayofyear, y, x) on the same grid as the COGs
+- the yearly maxima cube of the SFED_RP band
+- admin boundaries GeoJSON per admin level and `admin_lookup.parquet`
+- a SQLite database with the `floodscan` zonal stats and `iso3` tables
+
+Files that already exist are kept, so one data folder can be shared by
+several benchmark runs.
+"""
+
+import json
+import logging
+import sqlite3
+from datetime import timedelta
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import rasterio
+
+from src.utils.grid import FLOODSCAN_SHAPE, FLOODSCAN_TRANSFORM
+
+logger = logging.getLogger(__name__)
+
+# Real ISO3 codes so that the country names can be looked up when labelling
+# fmt: off
+ISO3_CODES = [
+    "AFG", "BFA", "CAF", "CMR", "COD", "ETH", "HTI", "KEN", "MLI", "MOZ",
+    "MWI", "NER", "NGA", "SDN", "SOM", "SSD", "TCD", "UGA", "YEM", "ZWE",
+]
+# fmt: on
+
+# Area the synthetic admin units are laid out over (minx, miny, maxx, maxy)
+ADMIN_EXTENT = (-20.0, -35.0, 50.0, 35.0)
+
+
+def grid_coords(shape=FLOODSCAN_SHAPE, transform=FLOODSCAN_TRANSFORM):
+    """Pixel centre coordinates of the grid, as rioxarray computes them."""
+    x = transform.c + transform.a * (np.arange(shape[1]) + 0.5)
+    y = transform.f + transform.e * (np.arange(shape[0]) + 0.5)
+    return y, x
+
+
+def flood_field(rng, shape=FLOODSCAN_SHAPE, block=40, wet_fraction=0.05):
+    """
+    Random flooded fraction (0-1) field, mostly dry with patches of water.
+
+    A coarse noise field is thresholded and upsampled in blocks, which gives
+    compressible patches similar in size to real flood extents.
+    """
+    coarse_shape = (-(-shape[0] // block), -(-shape[1] // block))
+    coarse = rng.random(coarse_shape, dtype=np.float32)
+    coarse = np.where(
+        coarse > 1 - wet_fraction, (coarse - (1 - wet_fraction)) * 20, 0
+    ).astype(np.float32)
+    field = np.kron(coarse, np.ones((block, block), dtype=np.float32))
+    return np.clip(field[: shape[0], : shape[1]], 0, 1)
+
+
+def blob_date_name(prefix, date):
+    return f"{prefix}{date.strftime('%Y-%m-%d')}_v05r01.tif"
+
+
+def write_sfed_cogs(blob_root, container, prefix, dates, seed=0):
+    """
+    Write one single band SFED COG per date.
+
+    Returns:
+        list: Paths of the COGs
+    """
+    height, width = FLOODSCAN_SHAPE
+    profile = {
+        "driver": "COG",
+        "dtype": "float32",
+        "count": 1,
+        "height": height,
+        "width": width,
+        "crs": "EPSG:4326",
+        "transform": FLOODSCAN_TRANSFORM,
+        "nodata": np.nan,
+        "compress": "DEFLATE",
+        "blocksize": 512,
+    }
+    paths = []
+    for date in dates:
+        path = Path(blob_root) / container / blob_date_name(prefix, date)
+        paths.append(path)
+        if path.exists():
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng([seed, date.toordinal()])
+        with rasterio.open(path, "w", **profile) as dst:
+            dst.write(flood_field(rng), 1)
+            dst.set_band_description(1, "SFED")
+    logger.info(f"{len(paths)} synthetic SFED COGs in {path.parent}")
+    return paths
+
+
+def write_baseline(path, seed=0):
+    """
+    Write a DOY baseline NetCDF with a seasonal cycle over one base field.
+    """
+    path = Path(path)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    y, x = grid_coords()
+    base = flood_field(np.random.default_rng(seed), wet_fraction=0.1)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with netCDF4.Dataset(tmp_path, "w") as nc:
+        nc.createDimension("dayofyear", 366)
+        nc.createDimension("y", len(y))
+        nc.createDimension("x", len(x))
+        nc.createVariable("dayofyear", "i8", ("dayofyear",))[:] = np.arange(
+            1, 367
+        )
+        nc.createVariable("y", "f8", ("y",))[:] = y
+        nc.createVariable("x", "f8", ("x",))[:] = x
+        var = nc.createVariable(
+            "__xarray_dataarray_variable__",
+            "f4",
+            ("dayofyear", "y", "x"),
+            zlib=True,
+            complevel=1,
+            chunksizes=(1, 1080, 1080),
+            fill_value=np.float32(np.nan),
+        )
+        for doy in range(1, 367):
+            season = 0.5 + 0.5 * np.sin(2 * np.pi * doy / 366)
+            var[doy - 1] = base * np.float32(season)
+    tmp_path.replace(path)
+    logger.info(f"Synthetic baseline written to {path}")
+    return path
+
+
+def write_rp_cube(path, n_years=26, seed=0):
+    """
+    Write a yearly maxima cube for the SFED_RP band, from one flood field
+    per year.
+    """
+    from src.utils.rp_raster import save_cube
+
+    path = Path(path)
+    if path.exists():
+        return path
+    maxima = np.stack(
+        [
+            flood_field(np.random.default_rng([seed, year]), wet_fraction=0.2)
+            for year in range(n_years)
+        ]
+    )
+    save_cube(maxima, path, list(range(1998, 1998 + n_years)), "synthetic")
+    return path
+
+
+def admin_units(n_units):
+    """
+    Lay out about `n_units` rectangular admin 2 units over ADMIN_EXTENT.
+
+    Units are grouped 2 x 2 into admin 1 units, and admin 1 units 4 x 4 into
+    countries.
+
+    Returns:
+        pandas.DataFrame: One row per admin 2 unit with its codes, names and
+        bounds
+    """
+    minx, miny, maxx, maxy = ADMIN_EXTENT
+    aspect = (maxx - minx) / (maxy - miny)
+    n_rows = max(2, int(round(np.sqrt(n_units / aspect))))
+    n_cols = max(2, int(round(n_units / n_rows)))
+    dx = (maxx - minx) / n_cols
+    dy = (maxy - miny) / n_rows
+    rows = []
+    for i in range(n_rows):
+        for j in range(n_cols):
+            country = (i // 8) * (-(-n_cols // 8)) + j // 8
+            iso3 = ISO3_CODES[country % len(ISO3_CODES)]
+            suffix = f"{country // len(ISO3_CODES):02d}"
+            adm0 = f"{iso3[:2]}{suffix}"
+            adm1 = f"{adm0}{(i % 8) // 2:01d}{(j % 8) // 2:01d}"
+            adm2 = f"{adm1}{i % 2:01d}{j % 2:01d}"
+            rows.append(
+                {
+                    "ISO3": iso3,
+                    "ADM0_PCODE": adm0,
+                    "ADM0_NAME": iso3,
+                    "ADM1_PCODE": adm1,
+                    "ADM1_NAME": f"Province {adm1}",
+                    "ADM2_PCODE": adm2,
+                    "ADM2_NAME": f"District {adm2}",
+                    "minx": minx + j * dx,
+                    "miny": maxy - (i + 1) * dy,
+                    "maxx": minx + (j + 1) * dx,
+                    "maxy": maxy - i * dy,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def write_admin_boundaries(folder, units):
+    """
+    Write admin 1 and 2 boundaries as GeoJSON, with the ISO3 and
+    ADM{level}_PCODE properties read by read_admin_shapes.
+
+    Returns:
+        dict: Path per admin level
+    """
+    paths = {}
+    for level in (1, 2):
+        pcode = f"ADM{level}_PCODE"
+        bounds = units.groupby(["ISO3", pcode], as_index=False).agg(
+            minx=("minx", "min"),
+            miny=("miny", "min"),
+            maxx=("maxx", "max"),
+            maxy=("maxy", "max"),
+        )
+        features = [
+            {
+                "type": "Feature",
+                "properties": {"ISO3": row.ISO3, pcode: getattr(row, pcode)},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        [
+                            [row.minx, row.miny],
+                            [row.maxx, row.miny],
+                            [row.maxx, row.maxy],
+                            [row.minx, row.maxy],
+                            [row.minx, row.miny],
+                        ]
+                    ],
+                },
+            }
+            for row in bounds.itertuples()
+        ]
+        path = Path(folder) / f"admin_boundaries_adm{level}.geojson"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"type": "FeatureCollection", "features": features}, f)
+        paths[level] = path
+    return paths
+
+
+def write_admin_lookup(path, units):
+    """Write admin_lookup.parquet with a row per admin 1 and admin 2 unit."""
+    columns = [
+        "ISO3",
+        "ADM0_PCODE",
+        "ADM0_NAME",
+        "ADM1_PCODE",
+        "ADM1_NAME",
+        "ADM2_PCODE",
+        "ADM2_NAME",
+    ]
+    adm2 = units[columns].assign(ADM_LEVEL=2)
+    adm1 = (units[columns[:5]].drop_duplicates().assign(ADM_LEVEL=1)).reindex(
+        columns=columns + ["ADM_LEVEL"]
+    )
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.concat([adm1, adm2], ignore_index=True).to_parquet(path, index=False)
+    return path
+
+
+def write_stats_db(path, units, start_date, end_date, seed=0):
+    """
+    Write the `floodscan` zonal stats table for admin levels 1 and 2 with a
+    row per unit and day from `start_date` to `end_date`, and the `iso3`
+    table of countries with an active HRP (all of them).
+
+    Returns:
+        int: Number of rows in the floodscan table
+    """
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start_date, end_date, freq="D").strftime("%Y-%m-%d")
+    n_rows = 0
+    with sqlite3.connect(path) as con:
+        con.execute(
+            "CREATE TABLE floodscan (iso3 TEXT, pcode TEXT, adm_level INTEGER,"
+            " valid_date TEXT, band TEXT, mean REAL)"
+        )
+        for level in (1, 2):
+            level_units = units[
+                ["ISO3", f"ADM{level}_PCODE"]
+            ].drop_duplicates()
+            for iso3, pcode in level_units.itertuples(index=False):
+                means = rng.gamma(0.5, 0.02, len(dates))
+                con.executemany(
+                    "INSERT INTO floodscan VALUES (?, ?, ?, ?, 'SFED', ?)",
+                    zip(
+                        [iso3] * len(dates),
+                        [pcode] * len(dates),
+                        [level] * len(dates),
+                        dates,
+                        means.tolist(),
+                    ),
+                )
+                n_rows += len(dates)
+        con.execute(
+            "CREATE INDEX floodscan_level_date "
+            "ON floodscan (adm_level, band, valid_date)"
+        )
+        con.execute("CREATE TABLE iso3 (iso3 TEXT, has_active_hrp BOOLEAN)")
+        con.executemany(
+            "INSERT INTO iso3 VALUES (?, 1)",
+            [(iso3,) for iso3 in units["ISO3"].unique()],
+        )
+    logger.info(f"Synthetic zonal stats DB with {n_rows} rows in {path}")
+    return n_rows
+
+
+def daily_dates(end_date, n_days):
+    """The `n_days` dates up to and including `end_date`."""
+    return [end_date - timedelta(days=i) for i in range(n_days)][::-1]
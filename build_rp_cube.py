@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""
+Build the yearly SFED maxima cube of the SFED_RP band.
+
+Computes the maximum SFED of every pixel for each year of the historical
+FloodScan archive (the NetCDF read by open_historical_floodscan, or any
+other with a SFED_AREA variable over time, lat and lon) and saves them
+sorted along the year axis to the configured rp_raster cube_file. Needs
+AA_DATA_DIR_NEW set, as for the other uses of the archive:
+
+    python build_rp_cube.py
+
+Years are reduced one at a time with dask, so memory use stays at a few
+global grids. Rebuilding the cube changes its fingerprint, so the COGs made
+with the previous one are made again.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from src.utils.preflight import CONFIG_FILE, read_configuration
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--source",
+        help="Historical NetCDF. Defaults to the one on the shared drive.",
+    )
+    parser.add_argument(
+        "--output", help="Cube file. Defaults to the configured one."
+    )
+    parser.add_argument("--config", default=CONFIG_FILE)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    configuration = read_configuration(args.config)
+    rp_config = configuration.get("rp_raster") or {}
+    output = os.path.expanduser(args.output or rp_config["cube_file"])
+
+    # Imported here so that --help stays fast
+    from src.datasources import floodscan
+    from src.utils.rp_raster import build_yearly_max_cube
+
+    source = args.source or floodscan.FP_FS_HISTORICAL
+    da = floodscan.open_historical_floodscan(source)
+    start = time.perf_counter()
+    build_yearly_max_cube(
+        da,
+        output,
+        source=source,
+        tile_rows=rp_config.get("tile_rows", 256),
+    )
+    logger.info(f"Built {output} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -11,33 +11,49 @@ HDX Pipeline:
 import logging
 import os
 import os.path
-import re
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 from datetime import datetime
+from functools import partial
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import rioxarray as rxr
-import xarray as xr
-from azure.storage.blob import BlobServiceClient
 from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
 from hdx.location.country import Country
 from slugify import slugify
+from sqlalchemy.exc import SQLAlchemyError
 
 from src.utils import pg
-from src.utils import return_periods as rp
-from src.utils.date_utils import (
-    create_date_range,
-    get_start_and_last_date_from_90_days,
-)
+from src.utils.blob_catalogue import BlobCatalogue
+from src.utils.checkpoints import CheckpointStore, fingerprint
+from src.utils.date_utils import create_date_range
+from src.utils.instrumentation import Instrumentation
+from src.utils.quantize import load_quantizer
+from src.utils.stage_dag import StageDAG
+from src.utils.storage import AzureBlobStorage, storage_credentials
+from src.utils.stream_pipeline import StreamPipeline
+from src.utils.tabular_utils import DEFAULT_CHUNK_SIZE, write_xlsx_sheets
+from src.utils.zip_manifest import ManifestZip, copy_zip
 
 logger = logging.getLogger(__name__)
 DATE_FORMAT = "%Y-%m-%d"
 
 
 class Floodscan:
-    def __init__(self, configuration, retriever, folder, errors):
+    def __init__(
+        self,
+        configuration,
+        retriever,
+        folder,
+        errors,
+        instrumentation=None,
+        storage=None,
+        checkpoints=None,
+    ):
         self.configuration = configuration
         self.retriever = retriever
         self.folder = folder
@@ -47,79 +63,325 @@ class Floodscan:
         self.created_date = None
         self.start_date = None
         self.latest_date = None
-
-        try:
-            self.account = os.environ["STORAGE_ACCOUNT"]
-            self.container = os.environ["CONTAINER"]
-            self.key = os.environ["KEY"]
-        except Exception:
-            self.account = self.configuration["account"]
-            self.container = self.configuration["container"]
-            self.key = self.configuration["key"]
+        self.last90_days_geotiffs = {}
+        self.historical_baseline = None
+        self.rp_raster = None
+        self.quantizer = load_quantizer(configuration)
+        self.instrumentation = instrumentation or Instrumentation()
+        self._download_lock = threading.Lock()
+        self._shared_downloads = {}
+        self._rasters_downloaded = threading.Event()
+        self._rasters_lock = threading.Lock()
+        self._baseline_lock = threading.Lock()
+        self.checkpoints = checkpoints or CheckpointStore()
+        self.blobs = {}
+        self.raster_fingerprints = {}
+
+        self.account, self.container, self.key = storage_credentials(
+            configuration
+        )
+        self.storage = storage or AzureBlobStorage(
+            self.account,
+            self.key,
+            **self.configuration.get("blob_download", {}),
+        )
 
     def get_data(self):
+        """Run the raster stages (download, merge with the baseline, COG
+        writing and zipping) and the zonal stats of admin 1 and 2 as a stage
+        DAG, so that the branches overlap. A failed stage is added to the
+        errors and nothing is returned for upload."""
+
+        # The raster stack (dask, xarray, rioxarray, GDAL), the return period
+        # fitting (scipy, lmoments3) and the zonal stats engines are imported
+        # by the stages using them, so importing this module stays cheap
+        from src.utils.dask_utils import dask_execution
 
         dataset_name = self.configuration["dataset_names"]["HDX-FLOODSCAN"]
 
-        last90_days_files = self._get_latest_90_days_geotiffs(
-            self.account, self.container, self.key
-        )
-        historical_baseline = self._get_historical_baseline(
-            self.account, self.container, self.key
+        # The admin 1 and 2 stages both label countries, and Country builds
+        # its lookups lazily without a lock, so they are built up front
+        Country.countriesdata()
+        with dask_execution(**self.configuration.get("dask", {})):
+            stages = self.get_data_stages()
+            results = stages.run()
+        if stages.failed:
+            return []
+
+        self.dataset_data[dataset_name] = [
+            results["zonal_stats_adm2"],
+            results["rasters"],
+            results["excel_write"],
+        ]
+
+        self.created_date = datetime.today().date()
+        return [{"name": dataset_name}]
+
+    def get_data_stages(self):
+        """Stage DAG of get_data.
+
+        The listing of the last 90 days gives the latest date the zonal
+        stats database is checked against, so the zonal stats only wait for
+        it, or for the rasters when the zonal stats are computed from them.
+        The baseline is loaded on first use, so it is not downloaded when
+        every output it goes into is restored from a checkpoint."""
+        stages = StageDAG(
+            self.errors,
+            max_workers=self.configuration.get("stage_workers"),
+            category="get_data",
         )
-        last90_days_file = self._generate_zipped_file(
-            last90_days_files, historical_baseline
+        stages.add("listing", self._list_latest_90_days)
+        stages.add(
+            "rasters",
+            lambda: self._stream_rasters(stages.results["listing"]),
+            after=["listing"],
         )
 
-        # Find the minimum and maximum dates
-        (
-            self.start_date,
-            self.latest_date,
-        ) = get_start_and_last_date_from_90_days(last90_days_file)
-
-        # save all geotiffs as one zipped file
-        last90_days_file = shutil.make_archive(
-            "baseline_zipped_file", "zip", "geotiffs"
+        zonal_stats_after = ["listing"]
+        if self.configuration.get("zonal_stats", {}).get("source") == "raster":
+            zonal_stats_after.append("rasters")
+        for admin_level in (1, 2):
+            stages.add(
+                f"zonal_stats_adm{admin_level}",
+                partial(
+                    self.get_zonal_stats_for_admin,
+                    mode="prod",
+                    admin_level=admin_level,
+                    band="SFED",
+                ),
+                after=zonal_stats_after,
+            )
+        stages.add(
+            "excel_write",
+            lambda: self._write_readme_sheets(
+                stages.results["zonal_stats_adm1"],
+                stages.results["zonal_stats_adm2"],
+            ),
+            after=["zonal_stats_adm1", "zonal_stats_adm2"],
         )
-        shutil.rmtree("geotiffs")
+        return stages
+
+    def _load_historical_baseline(self):
+        with self._baseline_lock:
+            if self.historical_baseline is None:
+                with self.instrumentation.stage("baseline_load"):
+                    self.historical_baseline = self._get_historical_baseline(
+                        self.account, self.container, self.key
+                    )
+        return self.historical_baseline
+
+    def _load_rp_raster(self):
+        """Per-pixel return period engine of the SFED_RP band, or None when
+        the band is disabled."""
+        if self.rp_raster is None:
+            self.rp_raster = load_rp_raster(self.configuration)
+        return self.rp_raster
+
+    def _blob_etags(self, blobs):
+        """ETags of blobs in the container, fetched in parallel."""
+        with ThreadPoolExecutor(self.storage.max_workers) as executor:
+            infos = executor.map(
+                lambda blob: self.storage.stat(self.container, blob), blobs
+            )
+            return {blob: info.etag for blob, info in zip(blobs, infos)}
+
+    def _get_raster_fingerprints(self, blobs):
+        """Fingerprint of the inputs of each day's COG: its GeoTIFF blob and
+        the baseline blob, with their ETags, the return period cube when
+        the SFED_RP band is enabled and the quantization if any."""
+        baseline_blob = self.configuration["baseline_filename"]
+        etags = self._blob_etags([baseline_blob, *blobs.values()])
+        cog_settings = cog_fingerprint_inputs(
+            self._load_rp_raster(), self.quantizer
+        )
+        return {
+            date: fingerprint(
+                blob,
+                etags[blob],
+                baseline_blob,
+                etags[baseline_blob],
+                *cog_settings,
+            )
+            for date, blob in blobs.items()
+        }
 
-        merged_zonal_stats_admin1 = self.get_zonal_stats_for_admin(
-            mode="prod", admin_level=1, band="SFED"
+    def _stream_rasters(self, blobs):
+        """Download the GeoTIFF of each day, merge it with the baseline,
+        encode it as a COG and add it to the zip, as a pipeline of bounded
+        queues. Only a few days are held in memory or on disk at a time,
+        and downloading overlaps with encoding."""
+        try:
+            return self._zip_rasters(blobs)
+        finally:
+            # Also when the checkpoint lookup or the pipeline fails, so that
+            # raster_zonal_stats is not left waiting for the downloads
+            self._rasters_downloaded.set()
+
+    def _zip_rasters(self, blobs):
+        from src.utils.dask_utils import dask_performance_report
+
+        config = self.configuration.get("raster_pipeline", {})
+        queue_size = config.get("queue_size", 2)
+        pipeline = StreamPipeline("rasters")
+        pipeline.add(
+            "download",
+            self._download_geotiff,
+            workers=config.get("download_workers", 4),
+            queue_size=queue_size,
+            on_done=self._rasters_downloaded.set,
         )
-        merged_zonal_stats_admin2 = self.get_zonal_stats_for_admin(
-            mode="prod", admin_level=2, band="SFED"
+        pipeline.add(
+            "merge",
+            self._merge_with_baseline,
+            workers=config.get("merge_workers", 1),
+            queue_size=queue_size,
+        )
+        pipeline.add(
+            "encode",
+            self._encode_cog,
+            workers=config.get("encode_workers", 2),
+            queue_size=queue_size,
         )
 
-        with pd.ExcelWriter(
-            "files" + os.sep + "floodscan_readme.xlsx",
-            mode="a",
-            engine="openpyxl",
-            if_sheet_exists="replace",
-        ) as excel_merged_file:
-            merged_zonal_stats_admin1.to_excel(
-                excel_merged_file, sheet_name="admin1", index=False
+        zipped_file = "baseline_zipped_file.zip"
+        manifest_file = "baseline_zipped_file.manifest.json"
+        previous_zip = previous_manifest = None
+        if self.checkpoints.enabled:
+            with self.instrumentation.stage(
+                "checkpoint_lookup", files=len(blobs)
+            ):
+                self.raster_fingerprints = self._get_raster_fingerprints(blobs)
+            zip_fingerprint = fingerprint(
+                sorted(self.raster_fingerprints.values())
             )
-            merged_zonal_stats_admin2.to_excel(
-                excel_merged_file, sheet_name="admin2", index=False
+            cached_zip = self.checkpoints.lookup("zip", zip_fingerprint)
+            if cached_zip is not None:
+                copy_zip(cached_zip, zipped_file)
+                return zipped_file
+            previous_zip = self.checkpoints.latest("zip")
+            previous_manifest = self.checkpoints.latest("zip_manifest")
+
+        os.makedirs("geotiffs", exist_ok=True)
+        logger.info("Calculating baseline...")
+        with self.instrumentation.stage("raster_pipeline") as stage:
+            with ManifestZip(
+                zipped_file, manifest_file, previous_zip, previous_manifest
+            ) as zipf:
+                # Days in the previous zip are copied from it, days with
+                # a COG checkpoint are added from it, and only the
+                # remaining ones go through the pipeline
+                todo = {}
+                n_cached = 0
+                for date, blob in blobs.items():
+                    arcname = os.path.basename(self._cog_file(date))
+                    date_fingerprint = self.raster_fingerprints.get(date)
+                    if zipf.reuse(arcname, date_fingerprint):
+                        continue
+                    path = self.checkpoints.lookup(
+                        self._cog_checkpoint(date), date_fingerprint
+                    )
+                    if path is None:
+                        todo[date] = blob
+                    else:
+                        zipf.write(path, arcname, date_fingerprint)
+                        n_cached += 1
+                if todo:
+                    self._load_historical_baseline()
+                    self._load_rp_raster()
+
+                def add_to_zip(date_out_file):
+                    date, out_file = date_out_file
+                    if self.checkpoints.enabled:
+                        path = self.checkpoints.save(
+                            self._cog_checkpoint(date),
+                            self.raster_fingerprints[date],
+                            out_file,
+                            move=True,
+                        )
+                    else:
+                        path = out_file
+                    zipf.write(
+                        path,
+                        os.path.basename(out_file),
+                        self.raster_fingerprints.get(date),
+                    )
+                    if os.path.exists(out_file):
+                        os.remove(out_file)
+
+                with dask_performance_report(
+                    self.configuration.get("dask", {}).get(
+                        "performance_report"
+                    )
+                ):
+                    stage["files"] = pipeline.run(todo.items(), add_to_zip)
+                for name, busy_s in pipeline.busy_s.items():
+                    stage[f"{name}_busy_s"] = round(busy_s, 3)
+                stage["reused_members"] = zipf.reused
+            stage["bytes"] = os.path.getsize(zipped_file)
+        shutil.rmtree("geotiffs")
+        logger.info(
+            f"Finished adding baseline geotiffs to {stage['files']} files, "
+            f"{zipf.reused} copied from the previous zip and {n_cached} "
+            "restored from checkpoints."
+        )
+        if self.checkpoints.enabled:
+            self.checkpoints.save("zip", zip_fingerprint, zipped_file)
+            self.checkpoints.save(
+                "zip_manifest", zip_fingerprint, manifest_file, move=True
             )
+            self.checkpoints.prune(
+                "cog_", [self._cog_checkpoint(date) for date in blobs]
+            )
+        else:
+            # Only used to rebuild the zip from its checkpoint
+            os.remove(manifest_file)
+        return zipped_file
 
-        self.dataset_data[dataset_name] = [
-            merged_zonal_stats_admin2.apply(lambda x: x.to_dict(), axis=1),
-            last90_days_file,
-            excel_merged_file,
-        ]
+    @staticmethod
+    def _cog_file(date):
+        return f"geotiffs/{date.strftime('%Y%m%d')}_aer_floodscan_sfed.tif"
 
-        self.created_date = datetime.today().date()
-        return [{"name": dataset_name}]
+    @staticmethod
+    def _cog_checkpoint(date):
+        return f"cog_{date.strftime('%Y%m%d')}"
+
+    def _write_readme_sheets(
+        self, merged_zonal_stats_admin1, merged_zonal_stats_admin2
+    ):
+        excel_file = "files" + os.sep + "floodscan_readme.xlsx"
+        with self.instrumentation.stage("excel_write") as stage:
+            # The zonal stats sheets are streamed in chunks of rows after
+            # the readme sheet, so memory stays flat however many days and
+            # admin units are written
+            stage["rows"] = write_xlsx_sheets(
+                excel_file,
+                {
+                    "admin1": merged_zonal_stats_admin1,
+                    "admin2": merged_zonal_stats_admin2,
+                },
+                template=excel_file,
+                chunk_size=self.configuration.get(
+                    "tabular_chunk_size", DEFAULT_CHUNK_SIZE
+                ),
+            )
+        return excel_file
+
+    def _download_shared(self, container, blob):
+        """Download a blob read by several stages only once, even when the
+        stages run at the same time."""
+        with self._download_lock:
+            if blob not in self._shared_downloads:
+                self._shared_downloads[blob] = self.retriever.download_file(
+                    url=blob,
+                    account=self.account,
+                    container=container,
+                    key=self.key,
+                    blob=blob,
+                )
+            return self._shared_downloads[blob]
 
     def get_adm2_labels(self, df_adm2_90d, level):
-        admin_lookup = self.retriever.download_file(
-            url="admin_lookup.parquet",
-            account=self.account,
-            container="polygon",
-            key=self.key,
-            blob="admin_lookup.parquet",
-        )
+        admin_lookup = self._download_shared("polygon", "admin_lookup.parquet")
 
         df_parquet_labels = pd.read_parquet(admin_lookup)
 
@@ -155,24 +417,204 @@ class Floodscan:
 
         return df_fs_labelled_subset
 
+    def get_zonal_stats_engine(self, admin_level):
+        """Label grid (or, with method "weighted", coverage weight matrix) of
+        the admin boundaries on the FloodScan grid, built once per boundaries
+        file and cached."""
+        config = self.configuration["zonal_stats"]
+        blob = config["boundaries_blob"].format(admin_level=admin_level)
+        boundaries_file = self._download_shared(
+            config["boundaries_container"], blob
+        )
+        return load_zonal_stats_engine(config, boundaries_file, admin_level)
+
+    def raster_zonal_stats(self, admin_level):
+        """Admin zonal means of the last 90 days computed from the SFED
+        rasters, in the layout of pg.fs_last_90_days. Waits for the rasters
+        to be downloaded when they are still streaming in."""
+        timeout = self.configuration.get("raster_pipeline", {}).get(
+            "download_timeout_s", 3600
+        )
+        if not self._rasters_downloaded.wait(timeout):
+            raise TimeoutError(
+                f"SFED rasters still downloading after {timeout} s"
+            )
+        with self._rasters_lock:
+            # Days restored from checkpoints were not downloaded
+            for date, blob in self.blobs.items():
+                if date not in self.last90_days_geotiffs:
+                    self._download_geotiff((date, blob))
+        if not self.last90_days_geotiffs:
+            raise ValueError("No SFED rasters loaded to compute stats from")
+        logger.info(f"Computing admin {admin_level} zonal stats from rasters")
+        with self.instrumentation.stage(
+            f"raster_zonal_stats_adm{admin_level}"
+        ) as stage:
+            engine = self.get_zonal_stats_engine(admin_level)
+            df = engine.to_frame(self.last90_days_geotiffs)
+            stage["rows"] = len(df)
+        return df
+
+    def _get_last_90_days_stats(self, mode, admin_level, band):
+        source = self.configuration.get("zonal_stats", {}).get("source", "db")
+        if source == "db":
+            try:
+                with self.instrumentation.stage(
+                    f"sql_last_90_days_adm{admin_level}"
+                ) as stage:
+                    df_current = pg.fs_last_90_days(
+                        mode=mode,
+                        admin_level=admin_level,
+                        band=band,
+                        only_HRP=True,
+                    )
+                    stage["rows"] = len(df_current)
+            except SQLAlchemyError as err:
+                logger.warning(f"Zonal stats DB unavailable: {err}")
+            else:
+                latest_db_date = pd.to_datetime(df_current["valid_date"]).max()
+                if (
+                    self.latest_date is None
+                    or latest_db_date >= self.latest_date
+                ):
+                    return df_current
+                logger.warning(
+                    f"Zonal stats DB is lagging: latest date {latest_db_date}"
+                    f" is before {self.latest_date}"
+                )
+                if not self._boundaries_exist(admin_level):
+                    config = self.configuration["zonal_stats"]
+                    blob = config["boundaries_blob"].format(
+                        admin_level=admin_level
+                    )
+                    logger.error(
+                        f"Cannot fall back to raster zonal stats: no admin "
+                        f"{admin_level} boundaries at "
+                        f"{config['boundaries_container']}/{blob} (upload "
+                        "them with upload_admin_boundaries.py). Publishing "
+                        f"the lagging DB stats, which end on {latest_db_date}"
+                    )
+                    return df_current
+        df_raster = self.raster_zonal_stats(admin_level)
+        # The same units as pg.fs_last_90_days with only_HRP
+        hrp_iso3 = pg.fs_hrp_iso3(mode=mode)
+        return df_raster[df_raster["iso3"].isin(hrp_iso3)].reset_index(
+            drop=True
+        )
+
+    def _boundaries_exist(self, admin_level):
+        config = self.configuration["zonal_stats"]
+        return self.storage.exists(
+            config["boundaries_container"],
+            config["boundaries_blob"].format(admin_level=admin_level),
+        )
+
+    def _get_baseline_stats(self, mode, admin_level, band, doys):
+        source = self.configuration.get("baseline_stats_source", "sql")
+        if source == "sql":
+            with self.instrumentation.stage(
+                f"sql_rolling_11_day_mean_adm{admin_level}"
+            ) as stage:
+                df = pg.fs_rolling_11_day_mean(
+                    mode=mode,
+                    admin_level=admin_level,
+                    band=band,
+                    only_HRP=True,
+                )
+                stage["rows"] = len(df)
+            return df
+        from src.utils.zonal_stats import BaselineStats
+
+        engine = self.get_zonal_stats_engine(admin_level)
+        baseline_version = Path(self.configuration["baseline_filename"]).stem
+        baseline_stats = BaselineStats.cached(
+            engine,
+            self._load_historical_baseline()["SFED_BASELINE"],
+            baseline_version,
+            admin_level,
+            self.configuration["zonal_stats"]["cache_folder"],
+        )
+        return baseline_stats.lookup(doys)
+
+    def _zonal_stats_fingerprint(self, mode, admin_level, band):
+        """Fingerprint of the inputs of the zonal stats: the latest date,
+        the day of the run (the database queries are relative to it), the
+        settings and, when computed from the rasters, their fingerprints."""
+        inputs = [
+            mode,
+            admin_level,
+            band,
+            self.latest_date,
+            datetime.today().date(),
+            self.configuration.get("zonal_stats"),
+            self.configuration.get("baseline_stats_source", "sql"),
+        ]
+        if self.configuration.get("zonal_stats", {}).get("source") == "raster":
+            inputs.append(sorted(self.raster_fingerprints.values()))
+        return fingerprint(*inputs)
+
     def get_zonal_stats_for_admin(self, mode, admin_level, band):
-        df_current = pg.fs_last_90_days(
-            mode=mode, admin_level=admin_level, band=band, only_HRP=True
+        stats_fingerprint = self._zonal_stats_fingerprint(
+            mode, admin_level, band
         )
-        df_with_labels = self.get_adm2_labels(df_current, admin_level)
-        df_current = df_with_labels.rename(
-            columns={f"ADM{admin_level}_PCODE": "pcode"}
+        merged_zonal_stats = self.checkpoints.load_frame(
+            f"zonal_stats_adm{admin_level}", stats_fingerprint
         )
-        df_yr_max = pg.fs_year_max(
-            mode=mode, admin_level=admin_level, band=band
+        if merged_zonal_stats is not None:
+            return merged_zonal_stats
+        df_w_rps = self.checkpoints.load_frame(
+            f"rp_adm{admin_level}", stats_fingerprint
+        )
+        if df_w_rps is None:
+            df_w_rps = self._get_return_periods(mode, admin_level, band)
+            self.checkpoints.save_frame(
+                f"rp_adm{admin_level}", stats_fingerprint, df_w_rps
+            )
+        merged_zonal_stats = self._add_baseline_stats(
+            df_w_rps, mode, admin_level, band
         )
-        df_w_rps = rp.fs_add_rp(
-            df=df_current, df_maxima=df_yr_max, by=["iso3", "pcode"]
+        self.checkpoints.save_frame(
+            f"zonal_stats_adm{admin_level}",
+            stats_fingerprint,
+            merged_zonal_stats,
         )
-        df_w_rps = df_w_rps.rename(columns={"value": band})
+        return merged_zonal_stats
+
+    def _get_return_periods(self, mode, admin_level, band):
+        df_current = self._get_last_90_days_stats(mode, admin_level, band)
+        with self.instrumentation.stage(
+            f"labelling_adm{admin_level}"
+        ) as stage:
+            df_with_labels = self.get_adm2_labels(df_current, admin_level)
+            stage["rows"] = len(df_with_labels)
+        df_current = df_with_labels.rename(
+            columns={f"ADM{admin_level}_PCODE": "pcode"}
+        )
+        with self.instrumentation.stage(
+            f"sql_year_max_adm{admin_level}"
+        ) as stage:
+            df_yr_max = pg.fs_year_max(
+                mode=mode, admin_level=admin_level, band=band
+            )
+            stage["rows"] = len(df_yr_max)
+        with self.instrumentation.stage(
+            f"rp_calculation_adm{admin_level}"
+        ) as stage:
+            from src.utils import return_periods as rp
+
+            df_w_rps = rp.fs_add_rp(
+                df=df_current, df_maxima=df_yr_max, by=["iso3", "pcode"]
+            )
+            stage["rows"] = len(df_w_rps)
+        return df_w_rps.rename(columns={"value": band})
+
+    def _add_baseline_stats(self, df_w_rps, mode, admin_level, band):
         df_w_rps["doy"] = pd.to_datetime(df_w_rps["valid_date"]).dt.dayofyear
-        df_rolling_11_day_mean = pg.fs_rolling_11_day_mean(
-            mode=mode, admin_level=admin_level, band=band, only_HRP=True
+        df_rolling_11_day_mean = self._get_baseline_stats(
+            mode=mode,
+            admin_level=admin_level,
+            band=band,
+            doys=df_w_rps["doy"].unique(),
         )
 
         df_rolling_11_day_mean.iso3 = df_rolling_11_day_mean.iso3.astype(str)
@@ -188,16 +630,14 @@ class Floodscan:
         merged_zonal_stats = merged_zonal_stats.rename(
             columns={"sfed_baseline": "SFED_BASELINE"}
         )
-        merged_zonal_stats = merged_zonal_stats.drop("doy", axis=1)
-
-        return merged_zonal_stats
+        return merged_zonal_stats.drop("doy", axis=1)
 
     def generate_dataset_and_showcase(self, dataset_name):
         # Setting metadata and configurations
         name = self.configuration["dataset_names"]["HDX-FLOODSCAN"]
         title = self.configuration["title"]
         dataset = Dataset({"name": slugify(name), "title": title})
-        rows = self.dataset_data[dataset_name][0]
+        df_stats = self.dataset_data[dataset_name][0]
         dataset.set_maintainer(self.configuration["maintainer_id"])
         dataset.set_organization(self.configuration["organization_id"])
         dataset.set_expected_update_frequency(
@@ -219,42 +659,21 @@ class Floodscan:
         ongoing = False
         if not start_date:
             logger.error(f"Start date missing for {dataset_name}")
-            return None, None
+            return None
         dataset.set_time_period(start_date, self.latest_date, ongoing)
 
-        headers = rows[0].keys()
-        date_headers = [
-            h
-            for h in headers
-            if "date" in h.lower() and type(rows[0][h]) == int
-        ]
-        for row in rows:
-            dataset.add_other_location(row["iso3"])
-            for date_header in date_headers:
-                row_date = row[date_header]
-                if not row_date:
-                    continue
-                if len(str(row_date)) > 9:
-                    row_date = row_date / 1000
-                row_date = datetime.utcfromtimestamp(row_date)
-                row_date = row_date.strftime("%Y-%m-%d")
-                row[date_header] = row_date
-
-        rows
-        dataset.generate_resource(
-            self.folder,
-            resource_data["name"],
-            rows,
-            resource_data,
-            list(rows[0].keys()),
-            encoding="utf-8",
-        )
-        res = dataset.get_resource(0)
-        res["name"] = self.configuration["stats_filename"]
-        res["description"] = self.configuration["description_stats_file"]
-        res.set_file_to_upload(self.dataset_data[dataset_name][2])
-        res.set_format("xlsx")
-        dataset.add_update_resource(res)
+        if df_stats.empty:
+            logger.error(f"No data rows for {dataset_name}")
+            return None
+        for iso3 in df_stats["iso3"].unique():
+            dataset.add_other_location(iso3)
+
+        # The zonal stats are published as the Excel file of both admin
+        # levels written by get_data
+        resource = Resource(resource_data)
+        resource.set_file_to_upload(self.dataset_data[dataset_name][2])
+        resource.set_format("xlsx")
+        dataset.add_update_resource(resource)
 
         resource_data = {
             "name": self.configuration["90days_filename"],
@@ -279,108 +698,242 @@ class Floodscan:
         da_subset.attrs["long_name"] = band
         return da_subset
 
-    def blob_client(self):
-        account_url = f"https://{self.account}.blob.core.windows.net"
-        return BlobServiceClient(account_url=account_url, credential=self.key)
-
-    def _get_latest_90_days_geotiffs(self, account, container, key):
-        das = {}
-
-        existing_files = [
-            x.name
-            for x in self.blob_client()
-            .get_container_client(container)
-            .list_blobs(
-                name_starts_with="floodscan/daily/v5/processed/aer_area"
-            )
-        ]
+    def _get_blob_catalogue(self, container):
+        catalogue_config = self.configuration.get("blob_catalogue", {})
+        catalogue = BlobCatalogue(
+            self.storage,
+            container,
+            prefix=self.configuration["daily_blob_prefix"],
+            suffix=self.configuration["daily_blob_suffix"],
+        )
+        catalogue_file = catalogue_config.get("file")
+        if catalogue_file:
+            catalogue.load(catalogue_file)
+        catalogue.refresh(
+            lookback_months=catalogue_config.get("lookback_months", 4)
+        )
+        if catalogue_file:
+            catalogue.save(catalogue_file)
+        return catalogue
+
+    def geotiff_reader(self):
+        """Reader for windowed (date, bbox, band) reads of the daily GeoTIFFs
+        straight from blob storage, fetching only the tiles needed."""
+        from src.utils.cog_reader import CogReader
+
+        catalogue = self._get_blob_catalogue(self.container)
+        return CogReader(
+            lambda date: self.storage.gdal_path(
+                self.container, catalogue.blob_name(date)
+            ),
+            gdal_options=self.storage.gdal_options,
+        )
 
-        latest_available_file = sorted(existing_files)[-1]
-        search_str = "([0-9]{4}-[0-9]{2}-[0-9]{2})"
-        search_res = re.search(search_str, latest_available_file)
-        latest_available_date = datetime.strptime(search_res[0], "%Y-%m-%d")
+    def _list_latest_90_days(self):
+        """Blobs of the days available in the last 90 days, by date."""
+        with self.instrumentation.stage("listing") as stage:
+            catalogue = self._get_blob_catalogue(self.container)
+            stage["blobs"] = len(catalogue)
+        latest_available_date = catalogue.latest_date()
         dates = create_date_range(90, latest_available_date)
+        available_dates = set(catalogue.dates_in_range(dates[-1], dates[0]))
 
-        for date in dates:
-            blob = f"floodscan/daily/v5/processed/aer_area_300s_v{date.strftime(DATE_FORMAT)}_v05r01.tif"
-
-            if blob in existing_files:
-                geotiff_file_for_date = self.retriever.download_file(
-                    url=blob,
-                    account=account,
-                    container=container,
-                    key=key,
-                    blob=blob,
+        blobs = {}
+        for date in sorted(dates):
+            if date in available_dates:
+                blobs[date] = catalogue.blob_name(date)
+            else:
+                logger.warning(
+                    f"Missing blob for date {date.strftime(DATE_FORMAT)}."
                 )
+        # Find the minimum and maximum dates
+        self.start_date, self.latest_date = min(blobs), max(blobs)
+        self.blobs = blobs
+        return blobs
 
-                da_in = rxr.open_rasterio(geotiff_file_for_date, chunks="auto")
-                das[date] = da_in.sel({"band": 1}, drop=True)
-            else:
-                logger.warning(f"Missing blob {blob} for date {date.strftime(DATE_FORMAT)}.")
+    def _download_geotiff(self, date_blob):
+        import rioxarray as rxr
+
+        date, blob = date_blob
+        geotiff_file_for_date = self.retriever.download_file(
+            url=blob,
+            account=self.account,
+            container=self.container,
+            key=self.key,
+            blob=blob,
+        )
 
-        return das
+        from src.utils.grid import FLOODSCAN_GRID
+
+        da_in = rxr.open_rasterio(geotiff_file_for_date, chunks="auto")
+        da_in = da_in.sel({"band": 1}, drop=True)
+        da_in = FLOODSCAN_GRID.snap(da_in, full=True)
+        self.last90_days_geotiffs[date] = da_in
+        return date, da_in
 
     def _get_historical_baseline(self, account, container, key):
         blob = self.configuration["baseline_filename"]
 
-        if not os.path.isfile(blob):
-            historical_baseline_file = self.retriever.download_file(
-                url=blob,
-                account=account,
-                container=container,
-                key=key,
-                blob=blob,
-            )
-        else:
-            historical_baseline_file = blob
-
-        chunks = {"lat": 1080, "lon": 1080, "time": 1}
-        ds_historical_baseline = xr.open_dataset(
-            historical_baseline_file, chunks=chunks
-        )
-        ds_historical_baseline = ds_historical_baseline.rename_vars(
-            {"__xarray_dataarray_variable__": "SFED_BASELINE"}
+        historical_baseline_file = self.retriever.download_file(
+            url=blob,
+            account=account,
+            container=container,
+            key=key,
+            blob=blob,
         )
 
-        return ds_historical_baseline
+        return open_historical_baseline(historical_baseline_file)
 
-    def _generate_zipped_file(
-        self, last90_days_geotiffs, ds_historical_baseline
-    ):
-        os.makedirs("geotiffs", exist_ok=True)
-        out_files = []
-
-        logger.info("Calculating baseline...")
-        for tif_date in last90_days_geotiffs:
-            da_current = last90_days_geotiffs[tif_date]
-            ds_historical_baseline = ds_historical_baseline.persist()
-
-            dt_temp_str = tif_date.strftime("%Y%m%d")
-            doy_temp = int(tif_date.strftime("%j"))
-            h_sfed_temp = ds_historical_baseline.sel(
-                {"dayofyear": doy_temp}, drop=True
-            )
-            ds_current_sfed = da_current.to_dataset(name="SFED")
-
-            merged_temp = xr.merge(
-                [ds_current_sfed.SFED, h_sfed_temp.SFED_BASELINE],
-                combine_attrs="drop",
-            )
-            merged_temp["SFED"] = merged_temp.SFED.rio.write_nodata(
-                np.nan, inplace=True
-            )
-            merged_temp = merged_temp.rio.set_spatial_dims(
-                y_dim="y", x_dim="x"
+    def _merge_with_baseline(self, date_da):
+        tif_date, da_current = date_da
+        merged_temp = merge_with_baseline(
+            da_current,
+            self.historical_baseline,
+            tif_date,
+            rp_raster=self._load_rp_raster(),
+            quantizer=self.quantizer,
+        )
+        return tif_date, merged_temp, self._cog_file(tif_date)
+
+    def _encode_cog(self, date_merged_out_file):
+        from src.utils import cog_utils
+
+        tif_date, merged_temp, out_file = date_merged_out_file
+        # Computed with the configured dask scheduler one day at a time, not
+        # in one graph of every day: the days share no tasks, and a single
+        # dask.compute would hold every merged day in memory before writing
+        return tif_date, cog_utils.write_cog(merged_temp.load(), out_file)
+
+
+def open_historical_baseline(path):
+    """Open the DOY baseline NetCDF lazily, with its variable named
+    SFED_BASELINE, snapped to the FloodScan grid and chunked by day of year
+    and grid chunks. Days of year are only read when selected."""
+    import xarray as xr
+
+    from src.utils.grid import FLOODSCAN_GRID
+
+    ds_historical_baseline = xr.open_dataset(path)
+    ds_historical_baseline = FLOODSCAN_GRID.snap(
+        ds_historical_baseline, full=True
+    ).chunk({"dayofyear": 1, **FLOODSCAN_GRID.chunks})
+    return ds_historical_baseline.rename_vars(
+        {"__xarray_dataarray_variable__": "SFED_BASELINE"}
+    )
+
+
+def merge_with_baseline(
+    da_current, ds_historical_baseline, date, rp_raster=None, quantizer=None
+):
+    """
+    Two band (SFED, SFED_BASELINE) dataset of a day's SFED raster and the
+    baseline of its day of year, ready to be written as a COG.
+
+    Both are snapped to the FloodScan grid, so the bands are merged as they
+    are, and a raster off the grid raises a GridMismatchError rather than
+    being realigned.
+
+    Args:
+        da_current (xarray.DataArray): SFED raster of the day
+        ds_historical_baseline (xarray.Dataset): DOY baseline, from
+            open_historical_baseline
+        date (datetime): Day of the raster
+        rp_raster (ReturnPeriodRaster): Adds the return period classes of
+            the SFED values as a third band, SFED_RP, computed straight
+            away. Defaults to None.
+        quantizer (Quantizer): Stores the bands as integers with their
+            scale, offset and nodata instead of floats. Defaults to None.
+
+    Returns:
+        xarray.Dataset: Merged bands
+    """
+    import rioxarray  # noqa: F401 (registers the .rio accessor)
+    import xarray as xr
+
+    from src.utils.grid import FLOODSCAN_GRID
+
+    doy_temp = int(date.strftime("%j"))
+    h_sfed_temp = ds_historical_baseline.sel(
+        {"dayofyear": doy_temp}, drop=True
+    )
+    # Already snapped rasters are only looked up in the grid's cache
+    h_sfed_temp = FLOODSCAN_GRID.snap(h_sfed_temp, full=True)
+    da_current = FLOODSCAN_GRID.snap(da_current, full=True)
+    ds_current_sfed = da_current.to_dataset(name="SFED")
+    bands = [ds_current_sfed.SFED, h_sfed_temp.SFED_BASELINE]
+    if rp_raster is not None:
+        bands.append(rp_raster.rp_band(da_current))
+
+    if quantizer is None:
+        merged_temp = xr.merge(bands, join="exact", combine_attrs="drop")
+        merged_temp["SFED"] = merged_temp.SFED.rio.write_nodata(
+            np.nan, inplace=True
+        )
+        if rp_raster is not None:
+            merged_temp["SFED_RP"] = merged_temp.SFED_RP.rio.write_nodata(
+                np.nan
             )
-            merged_temp = merged_temp.rio.write_crs(4326)
-
-            # Save geotiff
-            out_file = f"geotiffs/{int(dt_temp_str)}_aer_floodscan_sfed.tif"
-            merged_temp.rio.to_raster(out_file, driver="COG")
-            out_files.append(out_file)
-
-        logger.info(
-            f"Finished adding baseline geotiffs to {len(out_files)} files."
+    else:
+        # Quantized before merging, so only the integers are held until
+        # the COG is written
+        encoded = [quantizer.encode(band) for band in bands[:2]]
+        if rp_raster is not None:
+            encoded.append(quantizer.encode_classes(bands[2]))
+        merged_temp = xr.merge(encoded, join="exact", combine_attrs="drop")
+        for band in encoded:
+            merged_temp[band.name].attrs = band.attrs
+    merged_temp = merged_temp.rio.set_spatial_dims(y_dim="y", x_dim="x")
+    return merged_temp.rio.write_crs(4326)
+
+
+def cog_fingerprint_inputs(rp_raster=None, quantizer=None):
+    """Fingerprints of the optional settings of the COGs, to add to the
+    fingerprints of their inputs. Empty when none is set, so the COGs of
+    the defaults keep their fingerprints."""
+    return [
+        setting.fingerprint
+        for setting in (rp_raster, quantizer)
+        if setting is not None
+    ]
+
+
+def load_zonal_stats_engine(config, boundaries_file, admin_level):
+    """
+    Zonal stats engine of an admin level, from its cache if the boundaries
+    file has been seen before.
+
+    Args:
+        config (dict): zonal_stats section of the configuration
+        boundaries_file (str): GeoJSON boundaries of the admin level
+        admin_level (int): Admin level
+
+    Returns:
+        ZonalStats or WeightedZonalStats: Engine for the configured method
+    """
+    from src.utils.zonal_stats import WeightedZonalStats, ZonalStats
+
+    if config.get("method") == "weighted":
+        return WeightedZonalStats.cached(
+            boundaries_file,
+            admin_level,
+            config["cache_folder"],
+            oversample=config.get("oversample", 10),
         )
-
-        return out_files
+    return ZonalStats.cached(
+        boundaries_file, admin_level, config["cache_folder"]
+    )
+
+
+def load_rp_raster(configuration):
+    """Per-pixel return period engine of the SFED_RP band from the
+    rp_raster section of the configuration, or None when the band is
+    disabled."""
+    config = configuration.get("rp_raster") or {}
+    if not config.get("enabled"):
+        return None
+    from src.utils.rp_raster import ReturnPeriodRaster
+
+    return ReturnPeriodRaster(
+        os.path.expanduser(config["cube_file"]),
+        tile_rows=config.get("tile_rows", 256),
+    )
@@ -3,16 +3,15 @@
 Top level script. Calls other functions that generate datasets that this script then creates in HDX.
 
 """
-import base64
-import hashlib
-import hmac
 import logging
-from datetime import datetime
-from os.path import exists, expanduser, join
+import threading
+from contextlib import nullcontext
+from os import getenv
+from os.path import basename, exists, expanduser, join
+from tempfile import gettempdir
 
-from hdx.data.hdxobject import HDXError
 from hdx.facades.infer_arguments import facade
-from hdx.utilities.downloader import Download
+from hdx.utilities.downloader import Download, DownloadError
 from hdx.utilities.errors_onexit import ErrorsOnExit
 from hdx.utilities.path import (
     progress_storing_folder,
@@ -20,7 +19,16 @@ from hdx.utilities.path import (
 )
 from hdx.utilities.retriever import Retrieve
 
-from floodscan import Floodscan
+from src.utils import preflight
+from src.utils.checkpoints import CheckpointStore
+from src.utils.download_cache import DownloadCache, link_or_copy
+from src.utils.instrumentation import Instrumentation
+from src.utils.profiling import Profiler
+from src.utils.storage import (
+    AzureBlobStorage,
+    StorageBackend,
+    storage_from_configuration,
+)
 
 from typing import Any, Callable, Optional  # noqa: F401
 
@@ -33,6 +41,33 @@ updated_by_script = "HDX Scraper: FloodScan"
 
 
 class AzureBlobDownload(Download):
+    def __init__(
+        self,
+        blob_options: Optional[dict] = None,
+        cache: Optional[DownloadCache] = None,
+        storage: Optional[StorageBackend] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Download class for blob storage. Blobs are fetched through a
+        storage backend: the one given, or else a pooled AzureBlobStorage per
+        storage account, with large blobs split into parallel ranged GETs.
+
+        Args:
+            blob_options (Dict): Options passed to AzureBlobStorage, e.g.
+                max_workers, chunk_size or endpoint. Defaults to None.
+            cache (DownloadCache): Cache to download blobs through. Defaults
+                to None (no caching).
+            storage (StorageBackend): Storage to download all blobs from,
+                whatever the account. Defaults to None.
+            **kwargs: Parameters to pass to Download
+        """
+        super().__init__(**kwargs)
+        self.blob_options = blob_options or {}
+        self.cache = cache
+        self.storage = storage
+        self._storages = {}
+        self._storages_lock = threading.Lock()
+
     def download_file(
         self,
         url: str,
@@ -55,13 +90,7 @@ class AzureBlobDownload(Download):
             folder (str): Folder to download it to. Defaults to temporary folder.
             filename (str): Filename to use for downloaded file. Defaults to deriving from url.
             path (str): Full path to use for downloaded file instead of folder and filename.
-            overwrite (bool): Whether to overwrite existing file. Defaults to False.
             keep (bool): Whether to keep already downloaded file. Defaults to False.
-            post (bool): Whether to use POST instead of GET. Defaults to False.
-            parameters (Dict): Parameters to pass. Defaults to None.
-            timeout (float): Timeout for connecting to URL. Defaults to None (no timeout).
-            headers (Dict): Headers to pass. Defaults to None.
-            encoding (str): Encoding to use for text response. Defaults to None (best guess).
 
         Returns:
             str: Path of downloaded file
@@ -69,151 +98,265 @@ class AzureBlobDownload(Download):
         folder = kwargs.get("folder")
         filename = kwargs.get("filename")
         path = kwargs.get("path")
-        overwrite = kwargs.get("overwrite", False)
         keep = kwargs.get("keep", False)
 
-        request_time = datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT")
-        api_version = "2018-03-28"
-        parameters = {
-            "verb": "GET",
-            "Content-Encoding": "",
-            "Content-Language": "",
-            "Content-Length": "",
-            "Content-MD5": "",
-            "Content-Type": "",
-            "Date": "",
-            "If-Modified-Since": "",
-            "If-Match": "",
-            "If-None-Match": "",
-            "If-Unmodified-Since": "",
-            "Range": "",
-            "CanonicalizedHeaders": "x-ms-date:"
-            + request_time
-            + "\nx-ms-version:"
-            + api_version
-            + "\n",
-            "CanonicalizedResource": "/"
-            + account
-            + "/"
-            + container
-            + "/"
-            + blob,
-        }
-
-        signature = (
-            parameters["verb"]
-            + "\n"
-            + parameters["Content-Encoding"]
-            + "\n"
-            + parameters["Content-Language"]
-            + "\n"
-            + parameters["Content-Length"]
-            + "\n"
-            + parameters["Content-MD5"]
-            + "\n"
-            + parameters["Content-Type"]
-            + "\n"
-            + parameters["Date"]
-            + "\n"
-            + parameters["If-Modified-Since"]
-            + "\n"
-            + parameters["If-Match"]
-            + "\n"
-            + parameters["If-None-Match"]
-            + "\n"
-            + parameters["If-Unmodified-Since"]
-            + "\n"
-            + parameters["Range"]
-            + "\n"
-            + parameters["CanonicalizedHeaders"]
-            + parameters["CanonicalizedResource"]
-        )
-
-        signed_string = base64.b64encode(
-            hmac.new(
-                base64.b64decode(key),
-                msg=signature.encode("utf-8"),
-                digestmod=hashlib.sha256,
-            ).digest()
-        ).decode()
-
-        headers = {
-            "x-ms-date": request_time,
-            "x-ms-version": api_version,
-            "Authorization": ("SharedKey " + account + ":" + signed_string),
-        }
-
-        url = (
-            "https://"
-            + account
-            + ".blob.core.windows.net/"
-            + container
-            + "/"
-            + blob
-        )
-
-        if keep and exists(url):
-            print(f"The blob URL exists: {url}")
+        storage = self.storage_for(account, key)
+        url = storage.url(container, blob)
+        if not path:
+            path = join(folder or gettempdir(), filename or basename(blob))
+
+        if keep and exists(path):
+            logger.info(f"Keeping already downloaded {path}")
             return path
-        self.setup(
-            url=url,
-            stream=True,
-            post=kwargs.get("post", False),
-            parameters=kwargs.get("parameters"),
-            timeout=kwargs.get("timeout"),
-            headers=headers,
-            encoding=kwargs.get("encoding"),
-        )
-        return self.stream_path(
-            path, f"Download of {url} failed in retrieval of stream!"
-        )
-
-
-def main(save: bool = False, use_saved: bool = False) -> None:
-    """Generate datasets and create them in HDX"""
-    with ErrorsOnExit() as errors:
+        try:
+            if self.cache is None:
+                storage.download(container, blob, path)
+                return path
+            return self._download_cached(storage, container, blob, path)
+        except Exception as e:
+            raise DownloadError(
+                f"Download of {url} failed in retrieval of stream!"
+            ) from e
+
+    def _download_cached(
+        self, storage: StorageBackend, container: str, blob: str, path: str
+    ) -> str:
+        """Download a blob through the download cache. A cached copy is
+        revalidated with a conditional request and only transferred again if
+        it has changed.
+
+        Returns:
+            str: Path of downloaded file
+        """
+        cached = self.cache.lookup(container, blob)
+        staging_path = self.cache.staging_path(container, blob)
+        try:
+            info = storage.download(
+                container,
+                blob,
+                staging_path,
+                if_none_match=cached["etag"] if cached else None,
+                if_modified_since=cached["last_modified"] if cached else None,
+            )
+            if info is None:
+                logger.info(f"Using cached {blob}, not modified")
+                self.cache.touch(container, blob)
+                cached_path = cached["path"]
+            else:
+                cached_path = self.cache.commit(
+                    container,
+                    blob,
+                    staging_path,
+                    etag=info.etag,
+                    last_modified=info.last_modified,
+                )
+        finally:
+            # Left over when not modified or the download failed
+            staging_path.unlink(missing_ok=True)
+        return link_or_copy(cached_path, path)
+
+    def storage_for(self, account: str, key: str) -> StorageBackend:
+        """Get the storage to download from. Without a storage set, a pooled
+        AzureBlobStorage is created per storage account on first use so its
+        connections are reused across downloads.
+
+        Args:
+            account (str): Storage account to access the blob
+            key (str): Key to access the blob
+
+        Returns:
+            StorageBackend: Storage for the account
+        """
+        if self.storage is not None:
+            return self.storage
+        with self._storages_lock:
+            if account not in self._storages:
+                self._storages[account] = AzureBlobStorage(
+                    account, key, **self.blob_options
+                )
+            return self._storages[account]
+
+    def close(self) -> None:
+        for storage in self._storages.values():
+            storage.close()
+        self._storages = {}
+        super().close()
+
+
+def get_download_cache(
+    configuration: Configuration,
+) -> Optional[DownloadCache]:
+    """Set up the download cache from the configuration. The
+    FLOODSCAN_CACHE_DIR environment variable overrides the configured folder.
+
+    Args:
+        configuration (Configuration): Project configuration
+
+    Returns:
+        Optional[DownloadCache]: Download cache or None if not configured
+    """
+    cache_config = configuration.get("download_cache", {})
+    folder = getenv("FLOODSCAN_CACHE_DIR", cache_config.get("folder"))
+    if not folder:
+        return None
+    return DownloadCache(folder, max_size=cache_config.get("max_size"))
+
+
+def get_checkpoint_store(configuration: Configuration) -> CheckpointStore:
+    """Set up the stage checkpoints from the configuration. The
+    FLOODSCAN_CHECKPOINT_DIR environment variable overrides the configured
+    folder.
+
+    Args:
+        configuration (Configuration): Project configuration
+
+    Returns:
+        CheckpointStore: Checkpoint store, disabled if no folder is configured
+    """
+    checkpoint_config = configuration.get("checkpoints") or {}
+    folder = getenv(
+        "FLOODSCAN_CHECKPOINT_DIR", checkpoint_config.get("folder")
+    )
+    return CheckpointStore(folder)
+
+
+def count_uploads(statuses: Optional[dict]) -> dict:
+    """Count the resources whose file was uploaded to the HDX filestore.
+    The hash of each file is compared with the one stored in the resource's
+    metadata on HDX (for a zip, from the CRCs of its members), and files
+    that have not changed are not uploaded again.
+
+    Args:
+        statuses (Optional[dict]): Status code of each resource returned by
+            create_in_hdx
+
+    Returns:
+        dict: Numbers of uploaded_resources and unchanged_resources
+    """
+    statuses = statuses or {}
+    unchanged = [name for name, status in statuses.items() if status in (3, 4)]
+    for name in unchanged:
+        logger.info(f"Resource {name} unchanged, not uploaded")
+    return {
+        "uploaded_resources": sum(status == 2 for status in statuses.values()),
+        "unchanged_resources": len(unchanged),
+    }
+
+
+def main(
+    save: bool = False,
+    use_saved: bool = False,
+    profile: Optional[str] = None,
+    profile_dir: str = "profiles",
+    force: bool = False,
+) -> None:
+    """Generate datasets and create them in HDX
+
+    Args:
+        save (bool): Save downloaded data. Defaults to False.
+        use_saved (bool): Use saved data. Defaults to False.
+        profile (Optional[str]): Profile the pipeline stages with cprofile,
+            sampling or both. Defaults to None (no profiling).
+        profile_dir (str): Folder for the profile files. Defaults to profiles.
+        force (bool): Run even if nothing changed since the last publish.
+            Defaults to False.
+    """
+    if profile:
+        profiler = Profiler(profile, profile_dir)
+    else:
+        profiler = nullcontext()
+    instrumentation = Instrumentation()
+    with profiler, ErrorsOnExit() as errors:
         with wheretostart_tempdir_batch(lookup) as info:
             folder = info["folder"]
-            with AzureBlobDownload() as downloader:
+            configuration = Configuration.read()
+            if profile:
+                profiler.patch(configuration.get("profile_stages"))
+            cache = get_download_cache(configuration)
+            with storage_from_configuration(
+                configuration
+            ) as blob_storage, AzureBlobDownload(
+                cache=cache, storage=blob_storage
+            ) as downloader:
+                try:
+                    new_data, versions = preflight.check(
+                        configuration, blob_storage
+                    )
+                except Exception:
+                    logger.exception("Preflight check failed")
+                    new_data, versions = True, None
+                if not new_data and not force:
+                    logger.info("Nothing new to publish, stopping")
+                    return
+                # Imported once there is something to publish: floodscan
+                # and the HDX dataset classes pull in pandas and the raster
+                # stack, which the preflight check and --help do not need
+                from hdx.data.hdxobject import HDXError
+
+                from floodscan import Floodscan
+
                 retriever = Retrieve(
                     downloader, folder, "saved_data", folder, save, use_saved
                 )
                 folder = info["folder"]
                 batch = info["batch"]
-                configuration = Configuration.read()
-                floodscan = Floodscan(configuration, retriever, folder, errors)
-                dataset_names = floodscan.get_data()
+                floodscan = Floodscan(
+                    configuration,
+                    retriever,
+                    folder,
+                    errors,
+                    instrumentation,
+                    storage=blob_storage,
+                    checkpoints=get_checkpoint_store(configuration),
+                )
+                with instrumentation.stage("get_data"):
+                    dataset_names = floodscan.get_data()
                 logger.info(
                     f"Number of datasets to upload: {len(dataset_names)}"
                 )
+                published = bool(dataset_names)
 
                 for _, nextdict in progress_storing_folder(
                     info, dataset_names, "name"
                 ):
                     dataset_name = nextdict["name"]
-                    dataset = floodscan.generate_dataset_and_showcase(
-                        dataset_name=dataset_name
-                    )
+                    with instrumentation.stage("generate_dataset"):
+                        dataset = floodscan.generate_dataset_and_showcase(
+                            dataset_name=dataset_name
+                        )
                     if dataset:
                         dataset.update_from_yaml()
                         dataset["notes"] = dataset["notes"].replace(
                             "\n", "  \n"
                         )  # ensure markdown has line breaks
                         try:
-                            dataset.create_in_hdx(
-                                remove_additional_resources=True,
-                                updated_by_script=updated_by_script,
-                                batch=batch,
-                                ignore_fields=[
-                                    "resource:description",
-                                    "extras",
-                                ],
-                            )
+                            with instrumentation.stage("hdx_upload") as stage:
+                                statuses = dataset.create_in_hdx(
+                                    remove_additional_resources=True,
+                                    updated_by_script=updated_by_script,
+                                    batch=batch,
+                                    ignore_fields=[
+                                        "resource:description",
+                                        "extras",
+                                    ],
+                                )
+                                stage.update(count_uploads(statuses))
                         except HDXError as err:
                             errors.add(
                                 f"Could not upload {dataset_name}: {err}"
                             )
+                            published = False
                             continue
+                    else:
+                        published = False
+
+                state_file = preflight.state_file(configuration)
+                if published and versions and state_file:
+                    preflight.save_state(state_file, versions)
+
+            metrics_file = configuration.get("instrumentation_file")
+            if metrics_file:
+                instrumentation.write_json(metrics_file)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
 import rioxarray as rxr
 import xarray as xr
 
 from src.utils import cloud_utils, cog_utils, date_utils
+from src.utils.cog_reader import CogReader
+from src.utils.env_utils import load_env
+from src.utils.grid import FLOODSCAN_GRID
 
+load_env()
 DATA_DIR_GDRIVE = Path(os.getenv("AA_DATA_DIR_NEW"))
 FP_FS_HISTORICAL = (
     DATA_DIR_GDRIVE
@@ -20,9 +26,9 @@ FP_FS_HISTORICAL = (
 )
 
 
-def open_historical_floodscan():
+def open_historical_floodscan(path=FP_FS_HISTORICAL):
     chunks = {"lat": 1080, "lon": 1080, "time": 1}
-    ds = xr.open_dataset(FP_FS_HISTORICAL, chunks=chunks)
+    ds = xr.open_dataset(path, chunks=chunks)
     da = ds["SFED_AREA"]
     da = da.rio.set_spatial_dims(x_dim="lon", y_dim="lat")
     da = da.rio.write_crs(4326)
@@ -35,26 +41,93 @@ def load_floodscan_cogs(
     mode="dev",
     container_name="global",
     prefix="raster/cogs/aer_area_300s",
+    band="SFED",
+    bbox=None,
+    max_workers=8,
 ):
-    container_client = cloud_utils.get_container_client(
-        mode=mode, container_name=container_name
-    )
-    cogs_list = [
-        x.name
-        for x in container_client.list_blobs(name_starts_with=prefix)
-        if (date_utils.extract_date(x.name).date() >= start_date)
-        & (gen_utils.extract_date(x.name).date() <= end_date)  # noqa
-    ]
-
-    das = []
-    for cog in cogs_list:
-        da_in = process_floodscan_cog(
-            cog_name=cog, container_name="global", mode="dev"
+    """
+    Lazily load the FloodScan COGs between two dates into one DataArray.
+
+    Blob dates are parsed once while listing, the COGs are opened concurrently
+    without computing anything, and the results are stacked with a single
+    concat along a pre-sorted `date` index. Each COG is snapped to the
+    FloodScan grid, so they share the exact same x/y coordinates and are not
+    realigned, and a COG off the grid raises a GridMismatchError.
+
+    Parameters
+    ----------
+    start_date, end_date : datetime.date
+        First and last date to load (inclusive).
+    mode : str, optional
+        Environment mode ("dev" or "prod"). Default is "dev".
+    container_name : str, optional
+        Container holding the COGs. Default is "global".
+    prefix : str, optional
+        Blob prefix of the COGs. Default is "raster/cogs/aer_area_300s".
+    band : str, optional
+        Band to keep. Default is "SFED".
+    bbox : tuple, optional
+        (minx, miny, maxx, maxy) to read. Only the tiles covering it are
+        fetched. Default is None (the whole globe).
+    max_workers : int, optional
+        Number of COGs to open concurrently. Default is 8.
+
+    Returns
+    -------
+    xarray.DataArray
+        Dask-backed data with dims (date, band, y, x).
+    """
+    start_date = pd.Timestamp(start_date).date()
+    end_date = pd.Timestamp(end_date).date()
+    storage = cloud_utils.get_storage(mode)
+    cogs = {}
+    for x in storage.list(container_name, prefix):
+        cog_date = date_utils.extract_date(x.name)
+        if start_date <= cog_date.date() <= end_date:
+            cogs[cog_date] = x.name
+    dates = sorted(cogs)
+
+    def open_cog(cog_date):
+        da = open_floodscan_cog(
+            cog_name=cogs[cog_date],
+            mode=mode,
+            container_name=container_name,
+            bbox=bbox,
+            band=band,
         )
-        da_sfed = subset_band(da_in, band="SFED")
-        das.append(da_sfed)
+        return FLOODSCAN_GRID.snap(da, full=bbox is None)
 
-    return xr.combine_by_coords(das, combine_attrs="drop")
+    with ThreadPoolExecutor(max_workers) as executor:
+        das = list(executor.map(open_cog, dates))
+
+    return xr.concat(
+        das,
+        dim=pd.Index(dates, name="date"),
+        join="override",
+        coords="minimal",
+        compat="override",
+        combine_attrs="drop",
+    )
+
+
+def open_floodscan_cog(cog_name, mode, container_name, bbox=None, band=None):
+    """Open one COG lazily, optionally windowed to `bbox` and subset to
+    `band`, without a date dimension."""
+    if bbox is not None:
+        return process_floodscan_cog(
+            cog_name=cog_name,
+            mode=mode,
+            container_name=container_name,
+            bbox=bbox,
+            band=band,
+        ).isel(date=0, drop=True)
+    url_str_tmp = cog_utils.cog_url(
+        cog_name=cog_name, mode=mode, container_name=container_name
+    )
+    da_in = rxr.open_rasterio(url_str_tmp, chunks="auto")
+    if band is not None:
+        da_in = subset_band(da_in, band=band)
+    return da_in
 
 
 def subset_band(da, band="SFED"):
@@ -65,7 +138,20 @@ def subset_band(da, band="SFED"):
     return da_subset
 
 
-def process_floodscan_cog(cog_name, mode, container_name):
+def process_floodscan_cog(
+    cog_name, mode, container_name, bbox=None, band=None
+):
+    if bbox is not None or band is not None:
+        # Only fetch the tiles covering the window and bands requested
+        reader = CogReader(
+            lambda date: cog_utils.cog_vsi_path(
+                mode=mode, container_name=container_name, cog_name=cog_name
+            )
+        )
+        da_in = reader.read(
+            date_utils.extract_date(cog_name), bbox=bbox, band=band
+        )
+        return da_in.expand_dims(["date"])
     url_str_tmp = cog_utils.cog_url(
         cog_name=cog_name, mode=mode, container_name=container_name
     )
@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def month_starts(start, end):
+    """List the first day of every month from `start` to `end` inclusive."""
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(datetime(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def shift_months(date, n_months):
+    """Return the first day of the month `n_months` after `date`."""
+    index = date.year * 12 + date.month - 1 + n_months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+class BlobCatalogue:
+    """
+    Sorted index of the dated blobs under a prefix.
+
+    Blob names are expected to be exactly `prefix`, a date in `date_format`
+    and `suffix`, e.g. "floodscan/daily/v5/processed/aer_area_300s_v" and
+    "_v05r01.tif" for the daily FloodScan GeoTIFFs; other blobs under the
+    prefix (e.g. .aux.xml files or other versions) are skipped. Blobs are
+    listed one month at a time with date-bounded prefixes, and each name is
+    parsed once into a sorted list of dates, so lookups are binary searches
+    rather than scans of the listing.
+
+    The catalogue can be saved to a JSON file and loaded again on the next
+    run, so that a search further back for the latest blob is not repeated.
+    The months of the lookback window are listed again on every refresh, so
+    days arriving late are picked up and deleted blobs are dropped.
+
+    Args:
+        storage (StorageBackend): Storage holding the blobs
+        container (str): Container holding the blobs
+        prefix (str): Part of the blob names that precedes the date
+        suffix (str): Part of the blob names that follows the date
+        date_format (str): Format of the date in the blob names
+    """
+
+    def __init__(
+        self, storage, container, prefix, suffix="", date_format=DATE_FORMAT
+    ):
+        self.storage = storage
+        self.container = container
+        self.prefix = prefix
+        self.suffix = suffix
+        self.date_format = date_format
+        self.dates = []
+        self.blobs = {}
+        self._date_len = len(datetime(2000, 1, 1).strftime(date_format))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __contains__(self, date):
+        i = bisect_left(self.dates, date)
+        return i < len(self.dates) and self.dates[i] == date
+
+    def _parse(self, name):
+        """Date of a blob name, or None if it is not a dated blob name."""
+        date_str = name[len(self.prefix) : len(self.prefix) + self._date_len]
+        if name != self.prefix + date_str + self.suffix:
+            logger.debug(f"Skipping blob not named as a dated blob: {name}")
+            return None
+        try:
+            return datetime.strptime(date_str, self.date_format)
+        except ValueError:
+            logger.debug(f"Skipping blob without a date: {name}")
+            return None
+
+    def _add(self, name):
+        date = self._parse(name)
+        if date is None:
+            return
+        if date not in self.blobs:
+            insort(self.dates, date)
+        self.blobs[date] = name
+
+    def list_month(self, month):
+        """
+        List the blobs dated within the month of `month`, replacing the ones
+        known for that month, so blobs deleted since are dropped.
+
+        Returns:
+            int: Number of new dates found
+        """
+        month = datetime(month.year, month.month, 1)
+        month_prefix = self.prefix + month.strftime(self.date_format)[:7]
+        listed = {}
+        for blob in self.storage.list(self.container, month_prefix):
+            date = self._parse(blob.name)
+            if date is not None:
+                listed[date] = blob.name
+        lo = bisect_left(self.dates, month)
+        hi = bisect_left(self.dates, shift_months(month, 1))
+        known = self.dates[lo:hi]
+        for date in known:
+            if date not in listed:
+                logger.info(f"Dropping deleted blob {self.blobs.pop(date)}")
+        self.dates[lo:hi] = sorted(listed)
+        self.blobs.update(listed)
+        return len(listed.keys() - set(known))
+
+    def refresh(
+        self, end_date=None, lookback_months=4, max_lookback_months=24
+    ):
+        """
+        Bring the catalogue up to date.
+
+        The `lookback_months` months up to `end_date` are listed, carrying
+        on further back (up to `max_lookback_months`) until at least one blob
+        is found, and then until the `lookback_months` months up to the
+        latest blob are covered. A populated catalogue starts from the
+        `lookback_months` months up to its latest date instead, so a
+        lagging latest blob is not searched for again.
+
+        Args:
+            end_date (datetime): Last month to list. Defaults to today.
+            lookback_months (int): Months to list when starting from empty
+            max_lookback_months (int): Furthest back to look for any blob
+
+        Returns:
+            int: Number of new dates found
+        """
+        end_date = end_date or datetime.today()
+        start_date = min(self.dates[-1], end_date) if self.dates else end_date
+        months = month_starts(
+            shift_months(start_date, 1 - lookback_months), end_date
+        )
+        n_new = 0
+        for month in months:
+            n_new += self.list_month(month)
+
+        while not self.dates and len(months) < max_lookback_months:
+            month = shift_months(min(months), -1)
+            months.append(month)
+            n_new += self.list_month(month)
+
+        # If the latest blob lags behind end_date, still cover the
+        # lookback_months up to the latest date
+        if self.dates:
+            first_month = shift_months(self.dates[-1], 1 - lookback_months)
+            while min(months) > first_month:
+                month = shift_months(min(months), -1)
+                months.append(month)
+                n_new += self.list_month(month)
+
+        logger.info(
+            f"Listed {len(months)} months under {self.prefix}, "
+            f"{n_new} new dates"
+        )
+        return n_new
+
+    def latest_date(self):
+        if not self.dates:
+            raise ValueError(f"No blobs found under {self.prefix}")
+        return self.dates[-1]
+
+    def dates_in_range(self, start_date, end_date):
+        """Dates with a blob between `start_date` and `end_date` inclusive."""
+        lo = bisect_left(self.dates, start_date)
+        hi = bisect_right(self.dates, end_date)
+        return self.dates[lo:hi]
+
+    def blob_name(self, date):
+        return self.blobs[date]
+
+    def save(self, path):
+        """Save the catalogue to a JSON file, replacing it atomically."""
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "prefix": self.prefix,
+                    "suffix": self.suffix,
+                    "date_format": self.date_format,
+                    "blobs": [self.blobs[date] for date in self.dates],
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Load a catalogue saved with `save`. Nothing is loaded if the file does
+        not exist or was saved for a different prefix or suffix.
+
+        Returns:
+            bool: Whether the catalogue was loaded
+        """
+        path = Path(path).expanduser()
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        if (
+            saved.get("prefix"),
+            saved.get("suffix"),
+            saved.get("date_format"),
+        ) != (self.prefix, self.suffix, self.date_format):
+            return False
+        for name in saved["blobs"]:
+            self._add(name)
+        return True
@@ -0,0 +1,324 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = "2018-03-28"
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 8
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# Standard headers in the order they appear in the SharedKey string-to-sign
+SIGNED_HEADERS = [
+    "Content-Encoding",
+    "Content-Language",
+    "Content-Length",
+    "Content-MD5",
+    "Content-Type",
+    "Date",
+    "If-Modified-Since",
+    "If-Match",
+    "If-None-Match",
+    "If-Unmodified-Since",
+    "Range",
+]
+
+
+def shared_key_signature(key, account, verb, container, blob, headers):
+    """
+    Sign a Blob Storage request with the account key (SharedKey scheme).
+
+    Args:
+        key (str): Base64 encoded storage account key
+        account (str): Storage account name
+        verb (str): HTTP verb, e.g. "GET" or "HEAD"
+        container (str): Container holding the blob
+        blob (str): Name of the blob
+        headers (dict): Request headers, including the x-ms-* headers
+
+    Returns:
+        str: Value for the Authorization header
+    """
+    standard = [headers.get(name, "") for name in SIGNED_HEADERS]
+    canonicalized_headers = "".join(
+        f"{name.lower()}:{value}\n"
+        for name, value in sorted(headers.items(), key=lambda x: x[0].lower())
+        if name.lower().startswith("x-ms-")
+    )
+    canonicalized_resource = f"/{account}/{container}/{blob}"
+    signature = (
+        "\n".join([verb] + standard)
+        + "\n"
+        + canonicalized_headers
+        + canonicalized_resource
+    )
+    signed_string = base64.b64encode(
+        hmac.new(
+            base64.b64decode(key),
+            msg=signature.encode("utf-8"),
+            digestmod=hashlib.sha256,
+        ).digest()
+    ).decode()
+    return f"SharedKey {account}:{signed_string}"
+
+
+def file_md5(path, block_size=STREAM_BLOCK_SIZE):
+    """Return the base64 encoded MD5 of a file, as used by Content-MD5."""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            md5.update(block)
+    return base64.b64encode(md5.digest()).decode()
+
+
+class BlobDownloadClient:
+    """
+    Reusable Blob Storage download client.
+
+    Keeps one pooled HTTP session per client so connections are reused across
+    blobs, and splits blobs larger than `chunk_size` into ranged GETs that are
+    fetched in parallel. Downloads are checked against the blob's Content-MD5
+    when the service reports one.
+
+    Args:
+        account (str): Storage account name
+        key (str): Base64 encoded storage account key
+        endpoint (str): Base URL of the blob service. Defaults to the public
+            Azure endpoint of the account. Can point at a local stand-in.
+        max_workers (int): Number of ranged GETs to run concurrently
+        chunk_size (int): Size in bytes of each ranged GET
+        timeout (float): Timeout for each request. Defaults to None.
+        sas_token (str): SAS token to authorise requests with instead of the
+            account key. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        account,
+        key,
+        endpoint=None,
+        max_workers=DEFAULT_MAX_WORKERS,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        timeout=None,
+        sas_token=None,
+    ):
+        self.account = account
+        self.key = key
+        self.sas_token = sas_token.lstrip("?") if sas_token else None
+        self.endpoint = (
+            endpoint or f"https://{account}.blob.core.windows.net"
+        ).rstrip("/")
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+        retries = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["HEAD", "GET"],
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max(max_workers, 1),
+            max_retries=retries,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def blob_url(self, container, blob):
+        url = f"{self.endpoint}/{container}/{quote(blob)}"
+        if self.sas_token:
+            url += f"?{self.sas_token}"
+        return url
+
+    def _request(self, verb, container, blob, headers=None, stream=False):
+        headers = dict(headers or {})
+        headers["x-ms-date"] = datetime.utcnow().strftime(
+            "%a, %d %b %Y %H:%M:%S GMT"
+        )
+        headers["x-ms-version"] = API_VERSION
+        if not self.sas_token:
+            headers["Authorization"] = shared_key_signature(
+                self.key, self.account, verb, container, blob, headers
+            )
+        response = self.session.request(
+            verb,
+            self.blob_url(container, blob),
+            headers=headers,
+            stream=stream,
+            timeout=self.timeout,
+        )
+        if response.status_code >= 400:
+            response.close()
+        response.raise_for_status()
+        return response
+
+    def get_properties(self, container, blob, headers=None):
+        """
+        Get the size and validators of a blob with a HEAD request.
+
+        Args:
+            container (str): Container holding the blob
+            blob (str): Name of the blob
+            headers (dict): Extra request headers, e.g. If-None-Match
+
+        Returns:
+            dict: size, etag, last_modified and content_md5 (None if unset).
+            The key not_modified is True if a conditional request matched.
+        """
+        response = self._request("HEAD", container, blob, headers=headers)
+        return {
+            "size": int(response.headers.get("Content-Length", 0)),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_md5": response.headers.get("Content-MD5"),
+            "accept_ranges": response.headers.get("Accept-Ranges") == "bytes",
+            "not_modified": response.status_code == 304,
+        }
+
+    def read_range(self, container, blob, start=0, end=None):
+        """
+        Read bytes `start` to `end` (inclusive) of a blob, or to the end of
+        the blob if `end` is None.
+        """
+        headers = {}
+        if start or end is not None:
+            end = "" if end is None else end
+            headers["x-ms-range"] = f"bytes={start}-{end}"
+        with self._request("GET", container, blob, headers=headers) as r:
+            return r.content
+
+    def _download_single(self, container, blob, path):
+        with self._request("GET", container, blob, stream=True) as response:
+            with open(path, "wb") as f:
+                for block in response.iter_content(STREAM_BLOCK_SIZE):
+                    f.write(block)
+
+    def _download_range(self, container, blob, path, start, end, etag):
+        headers = {"x-ms-range": f"bytes={start}-{end}"}
+        if etag:
+            # Fail rather than stitch together ranges of different versions
+            headers["If-Match"] = etag
+        with self._request(
+            "GET", container, blob, headers=headers, stream=True
+        ) as response:
+            if response.status_code != 206:
+                raise IOError(
+                    f"Expected partial content for {blob} bytes {start}-{end},"
+                    f" got HTTP {response.status_code}"
+                )
+            written = 0
+            with open(path, "r+b") as f:
+                f.seek(start)
+                for block in response.iter_content(STREAM_BLOCK_SIZE):
+                    f.write(block)
+                    written += len(block)
+        if written != end - start + 1:
+            raise IOError(
+                f"Short read for {blob} bytes {start}-{end}: got {written}"
+            )
+
+    def download(
+        self, container, blob, path, if_none_match=None, if_modified_since=None
+    ):
+        """
+        Download a blob to `path`.
+
+        The blob is written to a temporary file next to `path` which is only
+        moved into place once complete and verified. If validators of a
+        previously downloaded copy are given, the blob is revalidated with a
+        conditional request first and nothing is transferred if unchanged.
+
+        Args:
+            container (str): Container to download from
+            blob (str): Name of the blob to be downloaded
+            path (str or Path): Where to save the blob
+            if_none_match (str): ETag of a local copy. Defaults to None.
+            if_modified_since (str): Last-Modified of a local copy, used when
+                there is no ETag. Defaults to None.
+
+        Returns:
+            dict: Blob properties as returned by `get_properties`, with path
+            set to the downloaded file, or to None if not modified.
+        """
+        path = Path(path)
+        conditions = {}
+        if if_none_match:
+            conditions["If-None-Match"] = if_none_match
+        elif if_modified_since:
+            conditions["If-Modified-Since"] = if_modified_since
+        properties = self.get_properties(container, blob, headers=conditions)
+        if properties["not_modified"]:
+            properties["path"] = None
+            return properties
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(path.name + ".part")
+        size = properties["size"]
+
+        try:
+            if size <= self.chunk_size or not properties["accept_ranges"]:
+                self._download_single(container, blob, part_path)
+            else:
+                with open(part_path, "wb") as f:
+                    f.truncate(size)
+                ranges = [
+                    (start, min(start + self.chunk_size, size) - 1)
+                    for start in range(0, size, self.chunk_size)
+                ]
+                logger.info(
+                    f"Downloading {blob} ({size} bytes) in {len(ranges)} "
+                    f"ranges with {self.max_workers} workers"
+                )
+                with ThreadPoolExecutor(self.max_workers) as executor:
+                    futures = [
+                        executor.submit(
+                            self._download_range,
+                            container,
+                            blob,
+                            part_path,
+                            start,
+                            end,
+                            properties["etag"],
+                        )
+                        for start, end in ranges
+                    ]
+                    for future in futures:
+                        future.result()
+
+            expected_md5 = properties["content_md5"]
+            if expected_md5:
+                actual_md5 = file_md5(part_path)
+                if actual_md5 != expected_md5:
+                    raise IOError(
+                        f"Content-MD5 mismatch for {blob}: expected "
+                        f"{expected_md5}, got {actual_md5}"
+                    )
+            os.replace(part_path, path)
+        finally:
+            if part_path.exists():
+                part_path.unlink()
+        properties["path"] = path
+        return properties
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Bump when a change to the pipeline makes existing checkpoints invalid
+CHECKPOINT_VERSION = 4
+
+
+def fingerprint(*inputs):
+    """
+    Fingerprint of the inputs a stage output was computed from.
+
+    Args:
+        *inputs: JSON serialisable values (dates and paths are converted to
+            strings), e.g. blob names and ETags, dates and settings
+
+    Returns:
+        str: Hex SHA-256 of the inputs and CHECKPOINT_VERSION
+    """
+    payload = json.dumps(
+        [CHECKPOINT_VERSION, *inputs], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CheckpointStore:
+    """
+    On-disk checkpoints of the outputs of expensive stages, so that a run
+    repeated after a failure resumes from them instead of starting over.
+
+    Each checkpoint is a file stored under a name with the fingerprint of
+    the inputs it was computed from. It is only used again by a run passing
+    the same fingerprint, and is replaced when saved with another one. Files
+    and their metadata are moved into place atomically, so an interrupted
+    save leaves the previous checkpoint or none at all. Saving is best
+    effort: a checkpoint that cannot be written is logged and skipped.
+
+    Args:
+        folder (str or Path): Folder holding the checkpoints. Defaults to
+            None, which disables checkpointing.
+    """
+
+    def __init__(self, folder=None):
+        self.folder = Path(folder).expanduser() if folder else None
+        self.hits = []
+        if self.folder is not None:
+            self.folder.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.folder is not None
+
+    def _data_path(self, name):
+        return self.folder / name
+
+    def _meta_path(self, name):
+        return self.folder / f"{name}.json"
+
+    def lookup(self, name, fingerprint):
+        """
+        Get the path of a checkpoint.
+
+        Returns:
+            Path: Path of the checkpoint file, or None if there is no
+            checkpoint with that name and fingerprint
+        """
+        if not self.enabled:
+            return None
+        path = self._data_path(name)
+        try:
+            with open(self._meta_path(name)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if meta.get("fingerprint") != fingerprint:
+            logger.info(f"Checkpoint {name} is out of date")
+            return None
+        if not path.is_file() or path.stat().st_size != meta.get("size"):
+            logger.warning(f"Checkpoint {name} is incomplete, ignoring it")
+            return None
+        logger.info(f"Resuming from checkpoint {name}")
+        self.hits.append(name)
+        return path
+
+    def latest(self, name):
+        """Get the path of the checkpoint `name` whatever inputs it was
+        computed from, e.g. to update it, or None if there is no complete
+        checkpoint with that name."""
+        if not self.enabled:
+            return None
+        path = self._data_path(name)
+        try:
+            with open(self._meta_path(name)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not path.is_file() or path.stat().st_size != meta.get("size"):
+            return None
+        return path
+
+    def save(self, name, fingerprint, path, move=False):
+        """
+        Store a file as the checkpoint `name`.
+
+        Args:
+            name (str): Name of the checkpoint
+            fingerprint (str): Fingerprint of the inputs of the file
+            path (str or Path): File to store
+            move (bool): Move the file into the store instead of copying it
+
+        Returns:
+            Path: Path of the checkpoint file, or `path` if checkpointing is
+            disabled or the file could not be stored
+        """
+        if not self.enabled:
+            return Path(path)
+        data_path = self._data_path(name)
+        tmp_path = data_path.with_name(f"{name}.{uuid.uuid4().hex}.part")
+        try:
+            if move:
+                shutil.move(path, tmp_path)
+            else:
+                shutil.copyfile(path, tmp_path)
+            meta = {
+                "fingerprint": fingerprint,
+                "size": tmp_path.stat().st_size,
+                "created": time.time(),
+            }
+            # Invalidate the old checkpoint before replacing its file
+            self._meta_path(name).unlink(missing_ok=True)
+            os.replace(tmp_path, data_path)
+            meta_tmp_path = tmp_path.with_suffix(".json")
+            with open(meta_tmp_path, "w") as f:
+                json.dump(meta, f)
+            os.replace(meta_tmp_path, self._meta_path(name))
+        except OSError as err:
+            logger.warning(f"Could not save checkpoint {name}: {err}")
+            if move and tmp_path.exists():
+                shutil.move(tmp_path, path)
+            return Path(path)
+        return data_path
+
+    def load_frame(self, name, fingerprint):
+        """Get a DataFrame checkpoint, or None if there is no valid one."""
+        import pandas as pd
+
+        path = self.lookup(name, fingerprint)
+        if path is None:
+            return None
+        return pd.read_parquet(path)
+
+    def save_frame(self, name, fingerprint, df):
+        """Store a DataFrame as a Parquet checkpoint."""
+        if not self.enabled:
+            return
+        tmp_path = self.folder / f"{name}.{uuid.uuid4().hex}.parquet"
+        try:
+            df.to_parquet(tmp_path, index=False)
+        except (OSError, ValueError, TypeError) as err:
+            # e.g. object columns pyarrow cannot convert
+            logger.warning(f"Could not save checkpoint {name}: {err}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        self.save(name, fingerprint, tmp_path, move=True)
+
+    def prune(self, prefix, keep):
+        """Delete the checkpoints whose name starts with `prefix`, except
+        the ones in `keep`."""
+        if not self.enabled:
+            return
+        keep = set(keep)
+        for meta_path in self.folder.glob(f"{prefix}*.json"):
+            name = meta_path.name[: -len(".json")]
+            if name not in keep:
+                meta_path.unlink(missing_ok=True)
+                self._data_path(name).unlink(missing_ok=True)
@@ -1,15 +1,39 @@
 import logging
 import os
-from io import BytesIO
+from functools import lru_cache
 
-from azure.core.exceptions import ResourceNotFoundError
-from azure.storage.blob import ContainerClient
-from dotenv import load_dotenv
+from src.utils.env_utils import load_env
+from src.utils.storage import AzureBlobStorage, BlobNotFoundError
+from src.utils.tabular_utils import DEFAULT_ROW_GROUP_SIZE, write_parquet
 
-load_dotenv()
 logger = logging.getLogger(__name__)
 
 
+@lru_cache()
+def get_storage(mode):
+    """
+    Get the storage backend of the data science blob storage account.
+
+    The backend is created once per mode, so its pooled connections are
+    reused by every read and write.
+
+    Parameters
+    ----------
+    mode : str
+        The environment mode ("dev" or "prod"), used to determine the
+        storage account and SAS token.
+
+    Returns
+    -------
+    src.utils.storage.AzureBlobStorage
+        Storage backend authorised with the SAS token of the mode.
+    """
+    load_env()
+    return AzureBlobStorage(
+        f"imb0chd0{mode}", sas_token=os.getenv(f"DSCI_AZ_SAS_{mode.upper()}")
+    )
+
+
 def get_container_client(mode, container_name):
     """
     Get a client for accessing an Azure Blob Storage container.
@@ -33,6 +57,9 @@ def get_container_client(mode, container_name):
         specified Azure Blob Storage container
 
     """
+    from azure.storage.blob import ContainerClient
+
+    load_env()
     blob_sas = os.getenv(f"DSCI_AZ_SAS_{mode.upper()}")
     blob_url = (
         f"https://imb0chd0{mode}.blob.core.windows.net/"  # noqa
@@ -43,11 +70,19 @@ def get_container_client(mode, container_name):
     return ContainerClient.from_container_url(blob_url)
 
 
-def write_output_stats(df, fname, mode="dev"):
+def write_output_stats(
+    df, fname, mode="dev", row_group_size=DEFAULT_ROW_GROUP_SIZE
+):
     """
     Write a DataFrame to a Parquet file either locally or to
     Azure Blob Storage.
 
+    The Parquet file is written one row group at a time. When uploading,
+    each row group is streamed into block blob blocks that are staged in
+    parallel as soon as they fill up, and the block list is committed once
+    the file is complete, so neither the DataFrame's Arrow table nor the
+    Parquet file is ever held in memory as a whole.
+
     Parameters
     ----------
     df : pandas.DataFrame
@@ -58,32 +93,27 @@ def write_output_stats(df, fname, mode="dev"):
         The mode of operation. If set to "local", the DataFrame is saved to a
         local Parquet file. Otherwise, the DataFrame is uploaded as a Parquet
         file to Azure Blob Storage. Default is "dev".
+    row_group_size : int, optional
+        Maximum number of rows per Parquet row group. Default is 100000.
 
     Returns
     -------
     None
     """
     if mode == "local":
-        df.to_parquet(fname, engine="pyarrow", index=False)
+        write_parquet(df, fname, row_group_size)
     else:
-        # Convert the DataFrame to a Parquet file in memory
-        parquet_buffer = BytesIO()
-        df.to_parquet(parquet_buffer, engine="pyarrow", index=False)
-        parquet_buffer.seek(0)  # Rewind the buffer
-        container_client = get_container_client(mode, "tabular")
-        data = parquet_buffer.getvalue()
-        container_client.upload_blob(name=fname, data=data, overwrite=True)
+        with get_storage(mode).open_write("tabular", fname) as f:
+            write_parquet(df, f, row_group_size)
     return
 
 
-def download_from_azure(
-    blob_service_client, container_name, blob_path, local_file_path
-):
+def download_from_azure(storage, container_name, blob_path, local_file_path):
     """
-    Download a file from Azure Blob Storage.
+    Download a file from blob storage.
 
     Args:
-    blob_service_client (BlobServiceClient): The Azure Blob Service Client
+    storage (StorageBackend): The storage backend, e.g. from get_storage
     container_name (str): The name of the container
     blob_path (str or Path): The path of the blob in the container
     local_file_path (str or Path): The local path where the file should be saved
@@ -92,21 +122,14 @@ def download_from_azure(
     bool: True if download was successful, False otherwise
     """
     try:
-        # Get the blob client
-        blob_client = blob_service_client.get_blob_client(
-            container=container_name, blob=str(blob_path)
-        )
-
-        # Download the blob
-        with open(local_file_path, "wb") as download_file:
-            download_file.write(blob_client.download_blob().readall())
+        storage.download(container_name, str(blob_path), local_file_path)
 
         logger.info(
             f"Successfully downloaded blob {blob_path} to {local_file_path}"
         )
         return True
 
-    except ResourceNotFoundError:
+    except BlobNotFoundError:
         logger.warning(f"Blob {blob_path} not found")
         return False
 
@@ -1,10 +1,16 @@
-import os
+from src.utils import cloud_utils
 
-from dotenv import load_dotenv
 
-load_dotenv()
+def cog_url(mode, container_name, cog_name):
+    return cloud_utils.get_storage(mode).url(container_name, cog_name)
 
 
-def cog_url(mode, container_name, cog_name):
-    blob_sas = os.getenv(f"DSCI_AZ_SAS_{mode.upper()}")
-    return f"https://imb0chd0{mode}.blob.core.windows.net/{container_name}/{cog_name}?{blob_sas}"  # noqa
+def cog_vsi_path(mode, container_name, cog_name):
+    # GDAL path for range-request reads of the COG instead of a full download
+    return cloud_utils.get_storage(mode).gdal_path(container_name, cog_name)
+
+
+def write_cog(ds, out_file):
+    # A dask-backed dataset is computed by rioxarray as it is written
+    ds.rio.to_raster(out_file, driver="COG")
+    return out_file
@@ -0,0 +1,99 @@
+import logging
+from contextlib import contextmanager, nullcontext
+
+import dask
+
+logger = logging.getLogger(__name__)
+
+SCHEDULERS = ["threads", "processes", "synchronous", "distributed"]
+
+
+@contextmanager
+def dask_execution(
+    scheduler="threads",
+    n_workers=None,
+    threads_per_worker=None,
+    memory_limit=None,
+    performance_report=None,
+):
+    """
+    Run the enclosed dask computations on the chosen scheduler.
+
+    The raster stage computes one day at a time, with the number of days in
+    flight bounded by the raster pipeline, so each day's graph runs on this
+    scheduler (or cluster) rather than one graph of every day.
+
+    Parameters
+    ----------
+    scheduler : str, optional
+        "threads", "processes" or "synchronous" for dask's local schedulers,
+        or "distributed" for a `LocalCluster`. Default is "threads".
+    n_workers : int, optional
+        Number of threads, processes or cluster workers. Defaults to dask's
+        choice (the number of cores).
+    threads_per_worker : int, optional
+        Threads per `LocalCluster` worker. Only used with "distributed".
+    memory_limit : str or int, optional
+        Memory limit per `LocalCluster` worker, e.g. "4GB". Only used with
+        "distributed".
+    performance_report : str, optional
+        Not used here: the report is saved around the raster pipeline by
+        `dask_performance_report`. Accepted so that the dask section of the
+        configuration can be passed as it is.
+
+    Yields
+    ------
+    distributed.Client or None
+        The client of the local cluster, or None for the local schedulers.
+    """
+    if scheduler not in SCHEDULERS:
+        raise ValueError(
+            f"Invalid dask scheduler {scheduler}. Choose one of {SCHEDULERS}."
+        )
+    if scheduler != "distributed":
+        if performance_report:
+            logger.warning(
+                "A dask performance report needs the distributed scheduler,"
+                " not saving one"
+            )
+        with dask.config.set(scheduler=scheduler, num_workers=n_workers):
+            yield None
+        return
+
+    try:
+        from dask.distributed import Client, LocalCluster
+    except ImportError as err:
+        raise ImportError(
+            "The distributed dask scheduler needs the distributed package:"
+            " pip install distributed"
+        ) from err
+
+    with LocalCluster(
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        memory_limit=memory_limit or "auto",
+    ) as cluster, Client(cluster) as client:
+        logger.info(
+            f"Started dask cluster, dashboard at {client.dashboard_link}"
+        )
+        yield client
+
+
+def dask_performance_report(path):
+    """
+    Save the dask performance report of the enclosed computations to the
+    HTML file `path`, when they run on a distributed client (see
+    `dask_execution`). Otherwise, or without a path, nothing is saved.
+    """
+    if not path:
+        return nullcontext()
+    try:
+        from dask.distributed import default_client
+        from dask.distributed import performance_report as report
+
+        default_client()
+    except (ImportError, ValueError):
+        # No distributed client: the warning is logged by dask_execution
+        return nullcontext()
+    logger.info(f"Saving dask performance report to {path}")
+    return report(filename=path)
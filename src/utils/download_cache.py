@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCache:
+    """
+    On-disk cache of downloaded blobs.
+
+    Entries are keyed by container and blob name and stored alongside the
+    validators (ETag and Last-Modified) the service returned, so a repeat
+    download can be revalidated with a conditional request instead of being
+    transferred again. Files and metadata are moved into place atomically, and
+    the least recently used entries are evicted once the cache grows beyond
+    `max_size` bytes.
+
+    Args:
+        folder (str or Path): Folder holding the cache
+        max_size (int): Maximum total size of cached files in bytes. Defaults
+            to None (unbounded).
+    """
+
+    def __init__(self, folder, max_size=None):
+        self.folder = Path(folder).expanduser()
+        self.max_size = max_size
+        self.staging_folder = self.folder / "staging"
+        self.staging_folder.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(container, blob):
+        return hashlib.sha256(f"{container}/{blob}".encode()).hexdigest()
+
+    def _data_path(self, key):
+        return self.folder / key[:2] / key
+
+    def _meta_path(self, key):
+        return self.folder / key[:2] / f"{key}.json"
+
+    def staging_path(self, container, blob):
+        """New, empty file to download into before it is committed to the
+        cache. It is on the same filesystem as the cache so the commit is a
+        rename, and unique to the download, so threads or processes fetching
+        the same blob never write into each other's file. The caller removes
+        it if it is not committed."""
+        fd, path = tempfile.mkstemp(
+            prefix=f"{self.key(container, blob)}.", dir=self.staging_folder
+        )
+        os.close(fd)
+        return Path(path)
+
+    def _write_meta(self, key, meta):
+        meta_path = self._meta_path(key)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f"{meta_path.name}.", dir=meta_path.parent
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def lookup(self, container, blob):
+        """
+        Get the cache entry for a blob.
+
+        Returns:
+            dict: Metadata of the cached blob including its local path, or None
+            if the blob is not cached.
+        """
+        key = self.key(container, blob)
+        data_path = self._data_path(key)
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not data_path.exists():
+            return None
+        meta["path"] = data_path
+        return meta
+
+    def touch(self, container, blob):
+        """Mark a cached blob as recently used."""
+        key = self.key(container, blob)
+        meta = self.lookup(container, blob)
+        if meta is None:
+            return
+        meta.pop("path")
+        meta["last_access"] = time.time()
+        self._write_meta(key, meta)
+
+    def commit(self, container, blob, path, etag=None, last_modified=None):
+        """
+        Move a downloaded file into the cache.
+
+        Args:
+            container (str): Container the blob was downloaded from
+            blob (str): Name of the blob
+            path (str or Path): Downloaded file, normally `staging_path`
+            etag (str): ETag returned by the service
+            last_modified (str): Last-Modified returned by the service
+
+        Returns:
+            Path: Path of the cached file
+        """
+        key = self.key(container, blob)
+        data_path = self._data_path(key)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, data_path)
+        self._write_meta(
+            key,
+            {
+                "container": container,
+                "blob": blob,
+                "etag": etag,
+                "last_modified": last_modified,
+                "size": data_path.stat().st_size,
+                "last_access": time.time(),
+            },
+        )
+        self.evict(keep=key)
+        return data_path
+
+    def entries(self):
+        for meta_path in self.folder.glob("??/*.json"):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            meta["key"] = meta_path.stem
+            yield meta
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits within
+        `max_size`. The entry with key `keep` is never removed."""
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries(), key=lambda x: x["last_access"])
+        total = sum(x["size"] for x in entries)
+        for entry in entries:
+            if total <= self.max_size:
+                break
+            if entry["key"] == keep:
+                continue
+            self._data_path(entry["key"]).unlink(missing_ok=True)
+            self._meta_path(entry["key"]).unlink(missing_ok=True)
+            total -= entry["size"]
+            logger.info(f"Evicted {entry['blob']} from download cache")
+
+
+def link_or_copy(src, dst):
+    """Hard link `src` to `dst`, copying when a link is not possible (e.g.
+    across filesystems). Any existing `dst` is replaced."""
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dst.with_name(dst.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+    return dst
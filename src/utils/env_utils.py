@@ -0,0 +1,15 @@
+from functools import lru_cache
+
+
+@lru_cache()
+def load_env():
+    """
+    Load the variables in a .env file into the environment.
+
+    Called by the functions reading credentials from the environment rather
+    than when their modules are imported, so importing them has no side
+    effects and the .env file is only read, once, by runs needing it.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
@@ -0,0 +1,180 @@
+import hashlib
+import threading
+
+import numpy as np
+from affine import Affine
+
+# FloodScan 300 arc second global grid
+FLOODSCAN_SHAPE = (2160, 4320)
+FLOODSCAN_TRANSFORM = Affine(1 / 12, 0, -180, 0, -1 / 12, 90)
+FLOODSCAN_CHUNKS = (1080, 1080)
+
+# Names of the spatial dimensions in the NetCDFs, renamed to those of the
+# GeoTIFFs
+SPATIAL_DIM_NAMES = {"lat": "y", "latitude": "y", "lon": "x", "longitude": "x"}
+
+
+class GridMismatchError(ValueError):
+    """A raster is not on the FloodScan grid."""
+
+
+class FloodscanGrid:
+    """
+    The FloodScan grid every raster is put on before being combined.
+
+    The daily GeoTIFFs, the DOY baseline and the historical archive hold
+    the same grid with differently named dimensions (x/y or lon/lat), rows
+    in either order and coordinates that differ in their last bits, so
+    merging them as they are outer-joins their coordinates into a larger,
+    mostly empty grid. `snap` checks once that the coordinates of a raster
+    are the centres of contiguous cells of the grid, and replaces them with
+    the exact coordinates of those cells, north up, with the dimensions
+    named y and x and the grid's chunks. Snapped rasters then merge with
+    join="exact" as they are, and a raster off the grid raises a
+    GridMismatchError instead of being realigned.
+
+    The cells matching a coordinate array are cached by its content, so
+    snapping the rasters of every day costs one lookup per axis.
+
+    Args:
+        shape (tuple): Rows and columns
+        transform (Affine): Transform of the top left cell
+        chunks (tuple): Dask chunks of the rows and columns
+        tolerance (float): Largest offset of a coordinate from the centre of
+            its cell, as a fraction of the cell size. Defaults to 0.01.
+    """
+
+    def __init__(
+        self,
+        shape=FLOODSCAN_SHAPE,
+        transform=FLOODSCAN_TRANSFORM,
+        chunks=FLOODSCAN_CHUNKS,
+        tolerance=0.01,
+    ):
+        self.shape = tuple(shape)
+        self.transform = transform
+        self.chunks = dict(zip(("y", "x"), chunks))
+        self.tolerance = tolerance
+        self.y = transform.f + transform.e * (np.arange(shape[0]) + 0.5)
+        self.x = transform.c + transform.a * (np.arange(shape[1]) + 0.5)
+        self._index_maps = {}
+        self._lock = threading.Lock()
+
+    def cells(self, dim, coords):
+        """
+        Cells of the grid matching coordinates along one axis.
+
+        Args:
+            dim (str): "y" or "x"
+            coords (numpy.ndarray): Coordinates of the cell centres
+
+        Returns:
+            tuple: (first, stop, flipped): the coordinates are those of the
+            cells first to stop - 1, in reverse order if flipped
+
+        Raises:
+            GridMismatchError: If the coordinates are not the centres of
+            contiguous cells of the grid
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        key = (dim, hashlib.sha1(coords.tobytes()).hexdigest())
+        with self._lock:
+            cells = self._index_maps.get(key)
+        if cells is None:
+            cells = self._match(dim, coords)
+            with self._lock:
+                self._index_maps[key] = cells
+        return cells
+
+    def _match(self, dim, coords):
+        if dim == "y":
+            origin, step = self.transform.f, self.transform.e
+            size = self.shape[0]
+        else:
+            origin, step = self.transform.c, self.transform.a
+            size = self.shape[1]
+        if len(coords) == 0:
+            raise GridMismatchError(f"No {dim} coordinates")
+        position = (coords - origin) / step - 0.5
+        index = np.rint(position)
+        offset = np.abs(position - index).max()
+        if not offset <= self.tolerance:
+            raise GridMismatchError(
+                f"{dim} coordinates are up to {offset:.3g} cells off the "
+                "centres of the FloodScan grid cells"
+            )
+        index = index.astype(np.intp)
+        steps = np.unique(np.diff(index))
+        if len(steps) > 1 or (len(steps) == 1 and abs(steps[0]) != 1):
+            raise GridMismatchError(
+                f"{dim} coordinates are not contiguous FloodScan grid cells"
+            )
+        first, last = sorted((int(index[0]), int(index[-1])))
+        if first < 0 or last >= size:
+            raise GridMismatchError(
+                f"{dim} coordinates extend beyond the FloodScan grid"
+            )
+        return first, last + 1, bool(len(steps) and steps[0] < 0)
+
+    def transform_of(self, rows, cols):
+        """Transform of the window of the grid from rows[0] and cols[0]."""
+        return self.transform * Affine.translation(cols[0], rows[0])
+
+    def snap(self, obj, full=False):
+        """
+        Put a raster on the grid.
+
+        Args:
+            obj (xarray.DataArray or xarray.Dataset): Raster with y/x or
+                lat/lon dimensions, any other dimensions are kept
+            full (bool): Require the whole grid rather than a window of it
+
+        Returns:
+            Same type as obj: The raster with dimensions y and x, north up,
+            with the exact coordinates, transform and CRS of the grid and,
+            if dask-backed, chunked like the grid
+
+        Raises:
+            GridMismatchError: If the raster is not on the grid
+        """
+        import rioxarray  # noqa: F401 (registers the .rio accessor)
+
+        renames = {
+            name: dim
+            for name, dim in SPATIAL_DIM_NAMES.items()
+            if name in obj.dims
+        }
+        if renames:
+            obj = obj.rename(renames)
+        rows = self.cells("y", obj["y"].values)
+        cols = self.cells("x", obj["x"].values)
+        if full and (rows[1] - rows[0], cols[1] - cols[0]) != self.shape:
+            raise GridMismatchError(
+                f"Raster of {obj.sizes['y']} x {obj.sizes['x']} cells does "
+                f"not cover the {self.shape} FloodScan grid"
+            )
+        flips = {
+            dim: slice(None, None, -1)
+            for dim, cells in (("y", rows), ("x", cols))
+            if cells[2]
+        }
+        if flips:
+            obj = obj.isel(flips)
+        obj = obj.assign_coords(
+            y=self.y[rows[0] : rows[1]], x=self.x[cols[0] : cols[1]]
+        )
+        if obj.chunks and self._needs_chunking(obj):
+            obj = obj.chunk(self.chunks)
+        obj = obj.rio.set_spatial_dims(x_dim="x", y_dim="y")
+        obj = obj.rio.write_crs(4326)
+        return obj.rio.write_transform(self.transform_of(rows, cols))
+
+    def _needs_chunking(self, obj):
+        chunks = obj.chunksizes
+        return any(
+            max(chunks[dim]) != min(size, obj.sizes[dim])
+            for dim, size in self.chunks.items()
+        )
+
+
+FLOODSCAN_GRID = FloodscanGrid()
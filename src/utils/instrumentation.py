@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PROC_IO = "/proc/self/io"
+PROC_STATM = "/proc/self/statm"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def read_io_counters():
+    """
+    Bytes read and written by the process so far, from /proc/self/io.
+
+    rchar/wchar count every read and write call (files and sockets), while
+    read_bytes/write_bytes only count storage I/O. Returns an empty dict where
+    /proc is not available.
+    """
+    try:
+        with open(PROC_IO) as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except (OSError, ValueError):
+        return {}
+    return {
+        "bytes_read": int(counters["rchar"]),
+        "bytes_written": int(counters["wchar"]),
+        "disk_bytes_read": int(counters["read_bytes"]),
+        "disk_bytes_written": int(counters["write_bytes"]),
+    }
+
+
+def current_rss():
+    """Resident set size of the process in bytes."""
+    try:
+        with open(PROC_STATM) as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Instrumentation:
+    """
+    Records wall time, CPU time, peak RSS, bytes read and written, and any
+    row or file counts of each stage of a run.
+
+    Stages are timed with the `stage` context manager. RSS is sampled on a
+    background thread while stages are open so each stage gets its own peak.
+    CPU time and I/O are process wide, so stages running concurrently include
+    each other's usage.
+
+    Args:
+        sample_interval (float): Seconds between RSS samples
+    """
+
+    def __init__(self, sample_interval=0.1):
+        self.sample_interval = sample_interval
+        self.started = time.time()
+        self._perf_started = time.perf_counter()
+        self.stages = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def _sample_rss(self):
+        while True:
+            with self._lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+                rss = current_rss()
+                for record in self._open:
+                    record["peak_rss_bytes"] = max(
+                        record["peak_rss_bytes"], rss
+                    )
+            time.sleep(self.sample_interval)
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """
+        Record a stage of the run.
+
+        Args:
+            name (str): Name of the stage
+            **counts: Initial counts, e.g. files=91
+
+        Yields:
+            dict: The stage record. Counts known only at the end of the stage
+            can be added to it, e.g. record["rows"] = len(df).
+        """
+        record = {"stage": name, **counts}
+        record["peak_rss_bytes"] = current_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        io_start = read_io_counters()
+        with self._lock:
+            self._open.append(record)
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample_rss, daemon=True
+                )
+                self._sampler.start()
+        try:
+            yield record
+        except BaseException:
+            record["failed"] = True
+            raise
+        finally:
+            io_end = read_io_counters()
+            with self._lock:
+                self._open.remove(record)
+                record["peak_rss_bytes"] = max(
+                    record["peak_rss_bytes"], current_rss()
+                )
+            record["start_s"] = round(wall_start - self._perf_started, 3)
+            record["wall_s"] = round(time.perf_counter() - wall_start, 3)
+            record["cpu_s"] = round(time.process_time() - cpu_start, 3)
+            for key in io_end:
+                record[key] = io_end[key] - io_start[key]
+            self.stages.append(record)
+            logger.info(
+                f"Stage {name} took {record['wall_s']}s wall, "
+                f"{record['cpu_s']}s CPU"
+            )
+
+    def summary(self):
+        """All stage records with totals for the run."""
+        return {
+            "started": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)
+            ),
+            "wall_s": round(time.time() - self.started, 3),
+            "cpu_s": round(time.process_time(), 3),
+            "peak_rss_bytes": resource.getrusage(
+                resource.RUSAGE_SELF
+            ).ru_maxrss
+            * 1024,
+            "stages": self.stages,
+        }
+
+    def write_json(self, path):
+        """Write the summary to a JSON file and return its path."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2, default=str)
+        logger.info(f"Wrote run metrics to {path}")
+        return path
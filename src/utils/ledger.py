@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+class DateLedger:
+    """
+    Append-only record of the dates a long running job has completed, so
+    that the job can be stopped at any point and resumed when run again.
+
+    Each completed date is written as one JSON line with the fingerprint of
+    the inputs it was processed from, and flushed to disk straight away. A
+    date only counts as done for the same fingerprint, so dates whose inputs
+    changed since (e.g. a new version of their blob) are processed again. A
+    line cut short by a crash is ignored, and the last line for a date wins.
+
+    Args:
+        path (str or Path): JSON lines file of the ledger
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        # Whether the last line was cut short, without its newline
+        self._truncated = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        self._truncated = bool(lines) and not lines[-1].endswith("\n")
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                self.entries[entry["date"]] = entry
+            except (json.JSONDecodeError, KeyError, TypeError):
+                logger.warning(f"Ignoring incomplete ledger line: {line!r}")
+        logger.info(f"{len(self.entries)} dates in ledger {self.path}")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def done(self, date, fingerprint):
+        """Whether `date` was completed from inputs with `fingerprint`."""
+        entry = self.entries.get(date.strftime(DATE_FORMAT))
+        return entry is not None and entry.get("fingerprint") == fingerprint
+
+    def record(self, date, fingerprint, **info):
+        """
+        Record `date` as completed.
+
+        Args:
+            date (datetime): Completed date
+            fingerprint (str): Fingerprint of its inputs
+            **info: JSON serialisable details stored with the date
+        """
+        entry = {
+            "date": date.strftime(DATE_FORMAT),
+            "fingerprint": fingerprint,
+            **info,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            if self._truncated:
+                # Start a new line rather than completing the broken one
+                f.write("\n")
+                self._truncated = False
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[entry["date"]] = entry
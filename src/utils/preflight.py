@@ -0,0 +1,164 @@
+"""
+Preflight check of whether there is anything new to publish.
+
+Compares the newest FloodScan blob date, the baseline blob's ETag and
+(optionally) the latest date in the zonal stats DB with the versions saved
+after the last successful publish. Only the storage client and the blob
+catalogue are imported, not the raster stack, so the check takes well under
+a second and the workflow can skip the run when nothing has changed:
+
+    python -m src.utils.preflight
+
+prints the result, writes `new_data=true|false` to $GITHUB_OUTPUT when set,
+and exits with 0 either way. Any error is treated as new data, so a failing
+check never stops a run.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+from src.utils.blob_catalogue import BlobCatalogue
+from src.utils.storage import storage_credentials, storage_from_configuration
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = Path("config") / "project_configuration.yaml"
+
+
+def read_configuration(path=CONFIG_FILE):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def current_versions(configuration, storage):
+    """
+    Versions of the inputs of a run.
+
+    Args:
+        configuration (dict): Project configuration
+        storage (StorageBackend): Storage holding the FloodScan blobs
+
+    Returns:
+        dict: latest_date (newest daily blob), baseline_etag and, if the
+        check_db preflight setting is on, db_latest_date
+    """
+    _, container, _ = storage_credentials(configuration)
+    catalogue_config = configuration.get("blob_catalogue", {})
+    catalogue = BlobCatalogue(
+        storage,
+        container,
+        prefix=configuration["daily_blob_prefix"],
+        suffix=configuration["daily_blob_suffix"],
+    )
+    catalogue_file = catalogue_config.get("file")
+    if catalogue_file:
+        catalogue.load(catalogue_file)
+    catalogue.refresh(
+        lookback_months=catalogue_config.get("lookback_months", 4)
+    )
+    if catalogue_file:
+        catalogue.save(catalogue_file)
+
+    baseline = storage.stat(container, configuration["baseline_filename"])
+    versions = {
+        "latest_date": catalogue.latest_date().strftime("%Y-%m-%d"),
+        "baseline_etag": baseline.etag,
+    }
+    if (configuration.get("publish_state") or {}).get("check_db"):
+        # Only imported when needed: it pulls in pandas and SQLAlchemy
+        from src.utils import pg
+
+        db_latest_date = pg.fs_latest_date(mode="prod")
+        versions["db_latest_date"] = (
+            db_latest_date.strftime("%Y-%m-%d") if db_latest_date else None
+        )
+    return versions
+
+
+def state_file(configuration):
+    """Path of the publish state file, or None if not configured. The
+    FLOODSCAN_PUBLISH_STATE environment variable overrides the configured
+    file."""
+    state_config = configuration.get("publish_state") or {}
+    path = os.getenv("FLOODSCAN_PUBLISH_STATE", state_config.get("file"))
+    return Path(path).expanduser() if path else None
+
+
+def load_state(path):
+    """Versions saved after the last successful publish, or None."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_state(path, versions):
+    """Save the versions of a successful publish, replacing the file
+    atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({**versions, "published": time.time()}, f, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved publish state to {path}")
+
+
+def is_up_to_date(state, versions):
+    """Whether every version matches the last publish."""
+    if not state:
+        return False
+    return all(state.get(key) == value for key, value in versions.items())
+
+
+def check(configuration, storage):
+    """
+    Compare the current versions with the last publish.
+
+    Returns:
+        tuple: (whether there is anything new to publish, current versions)
+    """
+    versions = current_versions(configuration, storage)
+    path = state_file(configuration)
+    state = load_state(path) if path else None
+    if is_up_to_date(state, versions):
+        logger.info(f"Nothing new since the last publish: {versions}")
+        return False, versions
+    logger.info(f"New data to publish: {versions}, last publish: {state}")
+    return True, versions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", default=CONFIG_FILE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        configuration = read_configuration(args.config)
+        with storage_from_configuration(configuration) as storage:
+            new_data, _ = check(configuration, storage)
+    except Exception:
+        logger.exception("Preflight check failed, assuming new data")
+        new_data = True
+    logger.info(f"Preflight check took {time.perf_counter() - start:.2f}s")
+
+    print(f"new_data={str(new_data).lower()}")
+    github_output = os.getenv("GITHUB_OUTPUT")
+    if github_output:
+        with open(github_output, "a") as f:
+            f.write(f"new_data={str(new_data).lower()}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,304 @@
+import cProfile
+import functools
+import importlib
+import logging
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("cprofile", "sampling", "both")
+
+# Stages profiled by default, as dotted paths of a module attribute or of a
+# method of a class in a module
+DEFAULT_STAGES = [
+    "floodscan.Floodscan.get_data",
+    "floodscan.Floodscan.get_zonal_stats_for_admin",
+    "floodscan.Floodscan._stream_rasters",
+    "src.utils.return_periods.fs_add_rp",
+]
+
+# cProfile can only have one active profiler in the process from Python 3.12
+# (it is built on sys.monitoring), so stages take turns to own it
+_cprofile_lock = threading.Lock()
+_cprofile_owner = None
+
+
+def resolve_target(target):
+    """
+    Find the object holding the function at a dotted path.
+
+    Args:
+        target (str): e.g. "floodscan.Floodscan.get_data" or
+            "src.utils.return_periods.fs_add_rp"
+
+    Returns:
+        tuple: (owner, attribute name), where owner is a module or class
+    """
+    parts = target.split(".")
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            owner = importlib.import_module(".".join(parts[:i]))
+        except ImportError:
+            continue
+        for part in parts[i:-1]:
+            owner = getattr(owner, part)
+        if not hasattr(owner, parts[-1]):
+            raise AttributeError(f"{target} not found")
+        return owner, parts[-1]
+    raise ImportError(f"No module found for {target}")
+
+
+def frame_stack(frame):
+    """Collapse a frame and its callers into "module:function" names."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}:{code.co_name}")
+        frame = frame.f_back
+    return names[::-1]
+
+
+class StackSampler:
+    """
+    Sampling profiler that records the stacks of every thread at a fixed
+    interval on a background thread.
+
+    Stacks are counted in the collapsed format ("thread;frame;frame count"
+    per line) read by flamegraph.pl, speedscope and inferno. Unlike cProfile
+    it also sees the work done on dask and thread pool worker threads, and
+    adds little overhead to the profiled code.
+
+    Args:
+        interval (float): Seconds between samples
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._counters = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._counters:
+                    self._thread = None
+                    return
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = ";".join(
+                        [thread_names.get(thread_id, str(thread_id))]
+                        + frame_stack(frame)
+                    )
+                    for counter in self._counters:
+                        counter[stack] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start counting samples into a new Counter, which is returned."""
+        counter = Counter()
+        with self._lock:
+            self._counters.append(counter)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+        return counter
+
+    def stop(self, counter):
+        with self._lock:
+            self._counters.remove(counter)
+
+
+def write_collapsed(counter, path):
+    with open(path, "w") as f:
+        for stack, count in sorted(counter.items()):
+            f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    Opt-in profiling of pipeline stages.
+
+    Each stage is profiled with cProfile, the stack sampler or both, and
+    written to `output_dir` as `<stage>.prof` (for pstats or snakeviz),
+    `<stage>.txt` (the top functions by cumulative time) and
+    `<stage>.collapsed` (for flame graphs). Stages called more than once get
+    a numbered suffix.
+
+    Stages can be nested. cProfile can only have one active profiler per
+    thread, so an enclosing stage's profiler is paused during a nested stage
+    and the nested stats are added back into it when it is written.
+
+    cProfile only sees the thread a stage runs on, and from Python 3.12 only
+    one profiler can be active in the whole process. The first thread to
+    enter a stage owns cProfile until its outermost stage ends; stages
+    entered on other threads meanwhile (e.g. the zonal stats running
+    alongside get_data) are not cProfiled, and only get a `.collapsed` file
+    when sampling. Use sampling to see work done on worker threads.
+
+    Args:
+        mode (str): One of "cprofile", "sampling" or "both"
+        output_dir (str or Path): Folder for the profile files
+        interval (float): Seconds between stack samples
+        top (int): Number of functions in the text summaries
+    """
+
+    def __init__(
+        self, mode="cprofile", output_dir="profiles", interval=0.005, top=50
+    ):
+        if mode not in PROFILE_MODES:
+            raise ValueError(
+                f"Unknown profile mode {mode}, expected one of {PROFILE_MODES}"
+            )
+        self.mode = mode
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.top = top
+        self.sampler = StackSampler(interval) if mode != "cprofile" else None
+        self.files = []
+        self._calls = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._patched = []
+
+    def _file_stem(self, name):
+        with self._lock:
+            self._calls[name] += 1
+            calls = self._calls[name]
+        if calls > 1:
+            name = f"{name}_{calls}"
+        return self.output_dir / name.replace(".", "_")
+
+    def _start_cprofile(self, name, parent):
+        """
+        Start a cProfile for stage `name`, or return None when another
+        thread owns cProfile or another profiling tool is active.
+        """
+        global _cprofile_owner
+        thread_id = threading.get_ident()
+        with _cprofile_lock:
+            if parent is None:
+                if _cprofile_owner is not None:
+                    logger.warning(
+                        f"Not cProfiling {name}: a stage on another thread "
+                        "is already profiled, use --profile sampling to see "
+                        "threaded stages"
+                    )
+                    return None
+                _cprofile_owner = thread_id
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # e.g. a debugger or coverage already uses sys.monitoring
+                logger.warning(f"Not cProfiling {name}: {e}")
+                if parent is None:
+                    _cprofile_owner = None
+                return None
+        return profile
+
+    def _release_cprofile(self):
+        global _cprofile_owner
+        with _cprofile_lock:
+            _cprofile_owner = None
+
+    def _write_cprofile(self, profile, children, stem):
+        stats = pstats.Stats(profile)
+        for child in children:
+            stats.add(child)
+        stats.dump_stats(f"{stem}.prof")
+        with open(f"{stem}.txt", "w") as f:
+            stats.stream = f
+            stats.sort_stats("cumulative").print_stats(self.top)
+        with self._lock:
+            self.files.extend([f"{stem}.prof", f"{stem}.txt"])
+
+    @contextmanager
+    def stage(self, name):
+        """Profile the code run inside the context as stage `name`."""
+        stem = self._file_stem(name)
+        profile = None
+        counter = None
+        active = self._local.__dict__.setdefault("active", [])
+        parent = active[-1] if active else None
+        if self.mode != "sampling":
+            if parent is not None:
+                parent["profile"].disable()
+            profile = self._start_cprofile(name, parent)
+            if profile is not None:
+                record = {"profile": profile, "children": []}
+                active.append(record)
+            elif parent is not None:
+                parent["profile"].enable()
+        if self.sampler is not None:
+            counter = self.sampler.start()
+        try:
+            yield
+        finally:
+            if counter is not None:
+                self.sampler.stop(counter)
+                write_collapsed(counter, f"{stem}.collapsed")
+                with self._lock:
+                    self.files.append(f"{stem}.collapsed")
+            if profile is not None:
+                profile.disable()
+                active.pop()
+                self._write_cprofile(profile, record["children"], stem)
+                if parent is not None:
+                    parent["children"].extend([profile, *record["children"]])
+                    parent["profile"].enable()
+                else:
+                    self._release_cprofile()
+            if profile is not None or counter is not None:
+                logger.info(f"Profiled {name} to {stem}.*")
+
+    def wrap(self, func, name=None):
+        """Return `func` wrapped so every call is profiled as a stage."""
+        name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def patch(self, targets=None):
+        """
+        Profile functions in place, without editing the code calling them.
+
+        Args:
+            targets (list): Dotted paths of the functions or methods to
+                profile. Defaults to DEFAULT_STAGES.
+        """
+        for target in targets or DEFAULT_STAGES:
+            owner, attr = resolve_target(target)
+            func = owner.__dict__.get(attr, getattr(owner, attr))
+            self._patched.append((owner, attr, func))
+            setattr(owner, attr, self.wrap(getattr(owner, attr), target))
+
+    def unpatch(self):
+        while self._patched:
+            owner, attr, func = self._patched.pop()
+            setattr(owner, attr, func)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.unpatch()
+        logger.info(
+            f"Wrote {len(self.files)} profile files to {self.output_dir}"
+        )
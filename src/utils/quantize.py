@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class Quantizer:
+    """
+    Compact integer storage of SFED values.
+
+    Values from `min_value` to `max_value` are stored as the nearest of the
+    integers 0 to the largest value of `dtype` minus one, which is kept as
+    nodata for NaN. The scale and offset to get the values back
+    (value = stored * scale_factor + add_offset) are set as attributes, which
+    rioxarray writes as the band scales and offsets of GeoTIFFs and
+    mask_and_scale applies when reading them.
+
+    Args:
+        dtype (str): "uint8" (values 4 times smaller than float32, within
+            half a step of (max_value - min_value) / 254) or "uint16"
+        min_value (float): Smallest value. Defaults to 0.
+        max_value (float): Largest value, 1 for a flooded fraction.
+    """
+
+    def __init__(self, dtype="uint8", min_value=0.0, max_value=1.0):
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind != "u":
+            raise ValueError(f"Quantized dtype must be unsigned, not {dtype}")
+        self.nodata = np.iinfo(self.dtype).max
+        self.offset = float(min_value)
+        self.scale = (max_value - min_value) / (self.nodata - 1)
+
+    @property
+    def fingerprint(self):
+        """Settings the stored values depend on."""
+        return f"{self.dtype.name}:{self.offset}:{self.scale}"
+
+    @property
+    def max_error(self):
+        """Largest difference between a value in range and its decoding."""
+        return self.scale / 2
+
+    def attrs(self, scale=None, offset=None):
+        return {
+            "scale_factor": self.scale if scale is None else scale,
+            "add_offset": self.offset if offset is None else offset,
+            "_FillValue": self.nodata,
+        }
+
+    def encode(self, da):
+        """
+        Quantize a float DataArray, lazily if it is dask-backed. Values out
+        of range are clipped and NaN becomes nodata.
+
+        Args:
+            da (xarray.DataArray): Float values
+
+        Returns:
+            xarray.DataArray: Stored values of dtype, with their scale,
+            offset and nodata as attributes
+        """
+        stored = ((da - self.offset) / self.scale).round()
+        stored = stored.clip(0, self.nodata - 1).fillna(self.nodata)
+        stored = stored.astype(self.dtype)
+        stored.attrs = self.attrs()
+        return stored
+
+    def encode_classes(self, da):
+        """Store integer classes with NaN for nodata (e.g. the SFED_RP
+        band) as dtype, unscaled."""
+        stored = da.fillna(self.nodata).astype(self.dtype)
+        stored.attrs = self.attrs(scale=1.0, offset=0.0)
+        return stored
+
+    def decode(self, da):
+        """
+        Float32 values of a DataArray stored by encode, with NaN for
+        nodata. The scale and offset of its attributes are used if set.
+
+        Args:
+            da (xarray.DataArray): Stored values
+
+        Returns:
+            xarray.DataArray: Decoded values
+        """
+        scale = da.attrs.get("scale_factor", self.scale)
+        offset = da.attrs.get("add_offset", self.offset)
+        values = da.where(da != self.nodata) * scale + offset
+        values = values.astype(np.float32)
+        values.attrs = {}
+        return values
+
+
+def load_quantizer(configuration):
+    """Quantizer of the quantize section of the configuration, or None when
+    the rasters are kept as floats."""
+    config = configuration.get("quantize") or {}
+    if not config.get("dtype"):
+        return None
+    return Quantizer(
+        config["dtype"],
+        min_value=config.get("min_value", 0.0),
+        max_value=config.get("max_value", 1.0),
+    )
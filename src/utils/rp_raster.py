@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from src.utils.checkpoints import fingerprint
+from src.utils.grid import FLOODSCAN_GRID
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the return period classes, as in
+# return_periods.reclassify_rp. Class 0 is nodata
+RP_CLASS_BREAKS = np.array([1.5, 2, 3, 4, 5, 7, 10])
+RP_CLASS_LABELS = ("1-1.5", "1.5-2", "2-3", "3-4", "4-5", "5-7", "7-10", ">10")
+RP_NODATA = 0
+
+
+def _meta_path(path):
+    return Path(f"{path}.json")
+
+
+def searchsorted_along_axis(a, v, side="left"):
+    """
+    np.searchsorted of every value of `v` in the column of `a` above it.
+
+    A binary search run on all the columns at once, so it takes
+    log2(len(a)) vectorized steps over the grid instead of one search per
+    pixel.
+
+    Args:
+        a (numpy.ndarray): Array of shape (n, ...) sorted along axis 0
+        v (numpy.ndarray): Values of shape a.shape[1:]
+        side (str): "left" or "right", as in np.searchsorted
+
+    Returns:
+        numpy.ndarray: Insertion indices, of the shape of `v`
+    """
+    n = a.shape[0]
+    lo = np.zeros(v.shape, dtype=np.intp)
+    hi = np.full(v.shape, n, dtype=np.intp)
+    for _ in range(n.bit_length()):
+        active = lo < hi
+        mid = (lo + hi) // 2
+        a_mid = np.take_along_axis(
+            a, np.minimum(mid, n - 1)[np.newaxis], axis=0
+        )[0]
+        right = (a_mid < v) if side == "left" else (a_mid <= v)
+        right &= active
+        lo = np.where(right, mid + 1, lo)
+        hi = np.where(active & ~right, mid, hi)
+    return lo
+
+
+def empirical_rp_grid(maxima, values):
+    """
+    Empirical return period of each value against the yearly maxima of its
+    pixel.
+
+    Vectorized equivalent of return_periods.empirical_rp and the
+    interpolation of fs_add_rp: a maximum has the return period
+    (n + 1) / rank, with tied maxima sharing the largest rank, values
+    between two maxima are interpolated linearly, values below the smallest
+    get 1 and values above the largest infinity. A value equal to tied
+    maxima gets their return period, where interp1d gives NaN.
+
+    Args:
+        maxima (numpy.ndarray): Yearly maxima of shape (n_years, ...),
+            sorted along axis 0
+        values (numpy.ndarray): Values of shape maxima.shape[1:]
+
+    Returns:
+        numpy.ndarray: Return periods, NaN where the value or any maximum
+        of the pixel is missing
+    """
+    n = maxima.shape[0]
+    # Number of maxima below each value and below the maximum just under it
+    k = searchsorted_along_axis(maxima, values)
+    hi = np.take_along_axis(maxima, np.minimum(k, n - 1)[np.newaxis], 0)[0]
+    lo = np.take_along_axis(maxima, np.maximum(k - 1, 0)[np.newaxis], 0)[0]
+    k_lo = searchsorted_along_axis(maxima, lo)
+
+    rp_hi = (n + 1) / np.maximum(n - k, 1)
+    rp_lo = (n + 1) / (n - k_lo)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rp = rp_lo + (values - lo) / (hi - lo) * (rp_hi - rp_lo)
+    rp = np.where(values == hi, rp_hi, rp)
+    rp = np.where((k == 0) & (values < hi), 1.0, rp)
+    rp = np.where(k == n, np.inf, rp)
+    # NaN sorts last, so a pixel with any missing maximum has it at the end
+    return np.where(np.isnan(values) | np.isnan(maxima[-1]), np.nan, rp)
+
+
+def classify_rp(rp):
+    """Return period class (1 to 8, see RP_CLASS_LABELS) of each return
+    period, RP_NODATA where it is NaN."""
+    classes = np.searchsorted(RP_CLASS_BREAKS, rp, side="left") + 1
+    return np.where(np.isnan(rp), RP_NODATA, classes).astype(np.uint8)
+
+
+def _new_cube(path, shape):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+    cube = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.float32, shape=shape
+    )
+    return tmp_path, cube
+
+
+def _sort_cube(cube, tile_rows):
+    # A band of rows at a time, so the whole cube is never in memory
+    for row in range(0, cube.shape[1], tile_rows):
+        cube[:, row : row + tile_rows] = np.sort(
+            cube[:, row : row + tile_rows], axis=0
+        )
+    cube.flush()
+
+
+def _commit_cube(tmp_path, path, shape, years, source):
+    # The cube is moved into place before its metadata, so an interrupted
+    # build leaves the previous cube or none at all
+    years = [int(year) for year in years]
+    shape = list(shape)
+    meta = {
+        "years": years,
+        "shape": shape,
+        "source": str(source),
+        # A new cube invalidates the COGs made with the previous one
+        "fingerprint": fingerprint(source, years, shape, tmp_path.name),
+    }
+    _meta_path(path).unlink(missing_ok=True)
+    os.replace(tmp_path, path)
+    with open(_meta_path(path), "w") as f:
+        json.dump(meta, f)
+    logger.info(f"Wrote {shape[0]} years of maxima of {shape[1:]} to {path}")
+
+
+def save_cube(maxima, path, years, source, tile_rows=256):
+    """
+    Save yearly maxima as the cube of a ReturnPeriodRaster.
+
+    Args:
+        maxima (numpy.ndarray): Yearly maxima of shape (n_years, y, x), with
+            the northernmost row first
+        path (str or Path): .npy file of the cube
+        years (list): Year of each maximum
+        source (str): Where the maxima were computed from
+        tile_rows (int): Rows sorted at a time
+    """
+    tmp_path, cube = _new_cube(path, maxima.shape)
+    cube[:] = maxima
+    _sort_cube(cube, tile_rows)
+    del cube
+    _commit_cube(tmp_path, Path(path), maxima.shape, years, source)
+
+
+def build_yearly_max_cube(da, path, source, tile_rows=256):
+    """
+    Build the cube of a ReturnPeriodRaster from the historical SFED archive.
+
+    The maximum of each year is computed over the whole grid one year at a
+    time and written straight to the memory mapped cube, which is then
+    sorted along the year axis a band of rows at a time, so memory use is
+    bounded by a few grids whatever the length of the archive.
+
+    Args:
+        da (xarray.DataArray): Dask-backed daily SFED of dims time and y/x
+            or lat/lon on the FloodScan grid, e.g. from
+            datasources.floodscan.open_historical_floodscan
+        path (str or Path): .npy file of the cube
+        source (str): Where `da` was read from
+        tile_rows (int): Rows sorted at a time
+    """
+    da = FLOODSCAN_GRID.snap(da, full=True).transpose("time", "y", "x")
+    years = np.unique(da["time"].dt.year.values)
+    shape = (len(years), *da.shape[1:])
+    tmp_path, cube = _new_cube(path, shape)
+    try:
+        try:
+            for i, year in enumerate(years):
+                da_year = da.isel(
+                    time=np.flatnonzero(da["time"].dt.year.values == year)
+                )
+                cube[i] = da_year.max("time").values
+                logger.info(f"Computed the maxima of {year}")
+            _sort_cube(cube, tile_rows)
+        finally:
+            del cube
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    _commit_cube(tmp_path, Path(path), shape, years, source)
+
+
+class ReturnPeriodRaster:
+    """
+    Per-pixel empirical return periods of SFED rasters.
+
+    Built on a cube of the yearly SFED maxima of every pixel of the
+    FloodScan grid, sorted along the year axis (see build_yearly_max_cube),
+    which is memory mapped and read a band of `tile_rows` rows at a time.
+    The return period of each pixel of a raster is found with a vectorized
+    binary search of its value in the maxima of the pixel, then classified
+    in the return period bins of the zonal stats.
+
+    Args:
+        path (str or Path): .npy file of the cube
+        tile_rows (int): Rows of the grid processed at a time. Defaults to
+            256, about 115 MB of maxima for 26 years.
+    """
+
+    def __init__(self, path, tile_rows=256):
+        self.path = Path(path)
+        with open(_meta_path(self.path)) as f:
+            meta = json.load(f)
+        self.years = meta["years"]
+        self.fingerprint = meta["fingerprint"]
+        self.cube = np.load(self.path, mmap_mode="r")
+        self.tile_rows = tile_rows
+
+    @property
+    def shape(self):
+        return self.cube.shape[1:]
+
+    def classify(self, values):
+        """
+        Return period class of each pixel of a north up grid.
+
+        Args:
+            values (numpy.ndarray): SFED values on the grid of the cube
+
+        Returns:
+            numpy.ndarray: uint8 classes, 1 to 8 for the bins of
+            RP_CLASS_LABELS and RP_NODATA where there is no value or no
+            complete record of maxima
+        """
+        if values.shape != self.shape:
+            raise ValueError(
+                f"Raster of shape {values.shape} does not match the "
+                f"{self.shape} grid of the return period cube"
+            )
+        classes = np.empty(values.shape, dtype=np.uint8)
+        for row in range(0, values.shape[0], self.tile_rows):
+            rows = slice(row, row + self.tile_rows)
+            classes[rows] = classify_rp(
+                empirical_rp_grid(np.asarray(self.cube[:, rows]), values[rows])
+            )
+        return classes
+
+    def rp_band(self, da):
+        """
+        SFED_RP band of a day's SFED raster: its return period classes on
+        the same coordinates, as float32 with NaN for nodata so it can be
+        written in the same COG as the SFED band.
+
+        Args:
+            da (xarray.DataArray): SFED raster on the FloodScan grid
+
+        Returns:
+            xarray.DataArray: Return period classes, north up
+        """
+        da = FLOODSCAN_GRID.snap(da, full=True)
+        classes = self.classify(da.values)
+        band = np.where(classes == RP_NODATA, np.nan, classes)
+        da_rp = da.copy(data=band.astype(np.float32)).rename("SFED_RP")
+        # Attributes such as long_name would name the band after the SFED
+        da_rp.attrs = {}
+        return da_rp
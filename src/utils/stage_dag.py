@@ -0,0 +1,131 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class StageDAG:
+    """
+    Run pipeline stages on a thread pool as soon as the stages they depend on
+    have finished, so independent branches overlap.
+
+    A stage that raises is recorded in `failed` and reported to `errors`
+    (an hdx ErrorHandler, e.g. ErrorsOnExit) instead of stopping the run:
+    stages depending on it are skipped, while the other branches run to
+    completion. Without `errors`, the first failure is raised once every
+    branch has finished.
+
+    Stages are run in threads, so they should release the GIL for most of
+    their work (I/O, database queries, numpy, GDAL or dask computations).
+
+    Args:
+        errors (ErrorHandler): Where to add failed stages. Defaults to None.
+        max_workers (int): Number of stages run at once. Defaults to the
+            number of stages.
+        category (str): Category of the messages added to `errors`
+    """
+
+    def __init__(self, errors=None, max_workers=None, category=""):
+        self.errors = errors
+        self.max_workers = max_workers
+        self.category = category
+        self.stages = {}
+        self.results = {}
+        self.failed = {}
+        self.skipped = set()
+
+    def add(self, name, func, after=()):
+        """
+        Add a stage.
+
+        Args:
+            name (str): Unique name of the stage
+            func (Callable): Called without arguments to run the stage. Its
+                return value is stored in `results[name]`.
+            after (Iterable[str]): Names of the stages that must have
+                finished before this one starts
+
+        Returns:
+            str: The name of the stage
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name} added twice")
+        self.stages[name] = (func, tuple(after))
+        return name
+
+    def _check(self):
+        for name, (_, after) in self.stages.items():
+            unknown = set(after) - set(self.stages)
+            if unknown:
+                raise ValueError(
+                    f"Stage {name} depends on unknown stages {sorted(unknown)}"
+                )
+        # Kahn's algorithm: every stage must be reachable without a cycle
+        remaining = {
+            name: set(after) for name, (_, after) in self.stages.items()
+        }
+        while remaining:
+            ready = [name for name, after in remaining.items() if not after]
+            if not ready:
+                raise ValueError(
+                    f"Stages {sorted(remaining)} have circular dependencies"
+                )
+            for name in ready:
+                del remaining[name]
+            for after in remaining.values():
+                after.difference_update(ready)
+
+    def _skip_dependents(self, failed_name):
+        for name, (_, after) in self.stages.items():
+            if (
+                name not in self.skipped
+                and failed_name in after
+                and name not in self.results
+            ):
+                logger.warning(f"Skipping stage {name}: {failed_name} failed")
+                self.skipped.add(name)
+                self._skip_dependents(name)
+
+    def _failed(self, name, err):
+        logger.error(f"Stage {name} failed", exc_info=err)
+        self.failed[name] = err
+        if self.errors is not None:
+            self.errors.add(f"Stage {name} failed: {err}", self.category)
+        self._skip_dependents(name)
+
+    def run(self):
+        """
+        Run every stage.
+
+        Returns:
+            dict: Result of each stage that succeeded, by stage name
+        """
+        self._check()
+        pending = dict(self.stages)
+        running = {}
+        max_workers = self.max_workers or max(len(self.stages), 1)
+        with ThreadPoolExecutor(
+            max_workers, thread_name_prefix="stage"
+        ) as executor:
+            while pending or running:
+                for name in list(pending):
+                    func, after = pending[name]
+                    if name in self.skipped:
+                        del pending[name]
+                    elif all(stage in self.results for stage in after):
+                        logger.debug(f"Starting stage {name}")
+                        running[executor.submit(func)] = name
+                        del pending[name]
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    err = future.exception()
+                    if err is None:
+                        self.results[name] = future.result()
+                    else:
+                        self._failed(name, err)
+        if self.failed and self.errors is None:
+            raise next(iter(self.failed.values()))
+        return self.results
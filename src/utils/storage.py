@@ -0,0 +1,654 @@
+import base64
+import logging
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import formatdate
+from io import BytesIO
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from requests import HTTPError
+
+from src.utils.blob_download import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_MAX_WORKERS,
+    BlobDownloadClient,
+)
+from src.utils.env_utils import load_env
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class BlobNotFoundError(FileNotFoundError):
+    pass
+
+
+class BlobInfo(NamedTuple):
+    name: str
+    size: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_md5: Optional[str] = None
+
+
+def _copy_stream(data, f, block_size=DEFAULT_BLOCK_SIZE):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        f.write(data)
+        return
+    for block in iter(lambda: data.read(block_size), b""):
+        f.write(block)
+
+
+class StorageBackend:
+    """
+    Interface to a blob store holding blobs in containers.
+
+    Backends implement `list`, `stat`, `read_range`, `open_write`, `url` and
+    `gdal_path`. Reading whole blobs, writing bytes or streams, downloads
+    (conditional on the ETag of a local copy) and concurrent multi-blob
+    downloads are built on those, and backends can override them with
+    something faster.
+    """
+
+    #: GDAL configuration options needed to open `gdal_path` paths
+    gdal_options = {}
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def list(self, container, prefix=""):
+        """Iterate over the BlobInfo of the blobs under `prefix`."""
+        raise NotImplementedError
+
+    def stat(self, container, blob):
+        """
+        Get the BlobInfo of a blob.
+
+        Raises:
+            BlobNotFoundError: If the blob does not exist
+        """
+        raise NotImplementedError
+
+    def read_range(self, container, blob, start=0, end=None):
+        """Read bytes `start` to `end` (inclusive, None for the end)."""
+        raise NotImplementedError
+
+    def open_write(self, container, blob):
+        """
+        Context manager yielding a writable binary file object. The blob is
+        only created or replaced once the context exits without an error.
+        """
+        raise NotImplementedError
+
+    def url(self, container, blob):
+        raise NotImplementedError
+
+    def gdal_path(self, container, blob):
+        """Path of the blob for GDAL (and rasterio / rioxarray) to open."""
+        raise NotImplementedError
+
+    def read(self, container, blob):
+        return self.read_range(container, blob)
+
+    def write(self, container, blob, data):
+        """Write bytes or the contents of a binary file object to a blob."""
+        with self.open_write(container, blob) as f:
+            _copy_stream(data, f)
+
+    def exists(self, container, blob):
+        try:
+            self.stat(container, blob)
+        except BlobNotFoundError:
+            return False
+        return True
+
+    def download(
+        self, container, blob, path, if_none_match=None, if_modified_since=None
+    ):
+        """
+        Download a blob to `path`, via a temporary file moved into place
+        once complete.
+
+        Args:
+            container (str): Container holding the blob
+            blob (str): Name of the blob
+            path (str or Path): Where to save the blob
+            if_none_match (str): ETag of a local copy. Defaults to None.
+            if_modified_since (str): Last-Modified of a local copy, used when
+                there is no ETag. Defaults to None.
+
+        Returns:
+            BlobInfo: Info of the blob downloaded, or None if the local copy
+            is up to date
+        """
+        info = self.stat(container, blob)
+        if (if_none_match and if_none_match == info.etag) or (
+            not if_none_match
+            and if_modified_since
+            and if_modified_since == info.last_modified
+        ):
+            return None
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(path.name + ".part")
+        try:
+            with open(part_path, "wb") as f:
+                for start in range(0, info.size, DEFAULT_CHUNK_SIZE):
+                    f.write(
+                        self.read_range(
+                            container,
+                            blob,
+                            start,
+                            min(start + DEFAULT_CHUNK_SIZE, info.size) - 1,
+                        )
+                    )
+            os.replace(part_path, path)
+        finally:
+            if part_path.exists():
+                part_path.unlink()
+        return info
+
+    def get_many(self, container, blobs, folder, max_workers=None):
+        """
+        Download several blobs concurrently into `folder`, keeping their
+        names as relative paths.
+
+        Returns:
+            dict: Downloaded path per blob name
+        """
+        folder = Path(folder)
+
+        def get(blob):
+            path = folder / blob
+            self.download(container, blob, path)
+            return blob, path
+
+        with ThreadPoolExecutor(max_workers or self.max_workers) as executor:
+            return dict(executor.map(get, blobs))
+
+
+class LocalStorage(StorageBackend):
+    """
+    Blobs stored as files, with one folder per container under `root`.
+
+    Args:
+        root (str or Path): Folder holding the container folders
+        max_workers (int): Default concurrency of `get_many`
+    """
+
+    def __init__(self, root, max_workers=DEFAULT_MAX_WORKERS):
+        super().__init__(max_workers)
+        self.root = Path(root).expanduser()
+
+    def _path(self, container, blob):
+        return self.root / container / blob
+
+    def _info(self, container, path):
+        stat = path.stat()
+        return BlobInfo(
+            name=path.relative_to(self.root / container).as_posix(),
+            size=stat.st_size,
+            etag=f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            last_modified=formatdate(stat.st_mtime, usegmt=True),
+        )
+
+    def list(self, container, prefix=""):
+        # Only walk the folder the prefix points into
+        folder = self._path(container, prefix)
+        if prefix and not prefix.endswith("/"):
+            folder = folder.parent
+        if not folder.is_dir():
+            return
+        for path in sorted(folder.rglob("*")):
+            if path.is_file() and not path.name.endswith(".part"):
+                info = self._info(container, path)
+                if info.name.startswith(prefix):
+                    yield info
+
+    def stat(self, container, blob):
+        path = self._path(container, blob)
+        if not path.is_file():
+            raise BlobNotFoundError(f"{container}/{blob} not found")
+        return self._info(container, path)
+
+    def read_range(self, container, blob, start=0, end=None):
+        path = self._path(container, blob)
+        if not path.is_file():
+            raise BlobNotFoundError(f"{container}/{blob} not found")
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(-1 if end is None else end - start + 1)
+
+    @contextmanager
+    def open_write(self, container, blob):
+        path = self._path(container, blob)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+        try:
+            with open(part_path, "wb") as f:
+                yield f
+            os.replace(part_path, path)
+        finally:
+            if part_path.exists():
+                part_path.unlink()
+
+    def download(
+        self, container, blob, path, if_none_match=None, if_modified_since=None
+    ):
+        info = self.stat(container, blob)
+        if (if_none_match and if_none_match == info.etag) or (
+            not if_none_match
+            and if_modified_since
+            and if_modified_since == info.last_modified
+        ):
+            return None
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(path.name + ".part")
+        shutil.copyfile(self._path(container, blob), part_path)
+        os.replace(part_path, path)
+        return info
+
+    def url(self, container, blob):
+        return self._path(container, blob).resolve().as_uri()
+
+    def gdal_path(self, container, blob):
+        return str(self._path(container, blob))
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Blobs held in memory, for tests and benchmarks. GDAL cannot open them,
+    so `gdal_path` is not supported.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        super().__init__(max_workers)
+        self.blobs = {}
+        self._lock = threading.Lock()
+
+    def _get(self, container, blob):
+        with self._lock:
+            try:
+                return self.blobs[(container, blob)]
+            except KeyError:
+                raise BlobNotFoundError(f"{container}/{blob} not found")
+
+    def list(self, container, prefix=""):
+        with self._lock:
+            names = sorted(
+                name
+                for c, name in self.blobs
+                if c == container and name.startswith(prefix)
+            )
+        for name in names:
+            yield self._get(container, name)[1]
+
+    def stat(self, container, blob):
+        return self._get(container, blob)[1]
+
+    def read_range(self, container, blob, start=0, end=None):
+        data = self._get(container, blob)[0]
+        return data[start : None if end is None else end + 1]
+
+    @contextmanager
+    def open_write(self, container, blob):
+        buffer = BytesIO()
+        yield buffer
+        data = buffer.getvalue()
+        info = BlobInfo(
+            name=blob,
+            size=len(data),
+            etag=f'"{uuid.uuid4().hex}"',
+            last_modified=formatdate(usegmt=True),
+        )
+        with self._lock:
+            self.blobs[(container, blob)] = (data, info)
+
+    def url(self, container, blob):
+        return f"memory://{container}/{blob}"
+
+
+class BlockBlobWriter:
+    """
+    File-like writer staging the blocks of a block blob as they fill up and
+    committing the block list at the end, so the blob is never held in
+    memory as a whole.
+
+    Blocks are staged on `max_workers` threads while writing carries on. At
+    most `max_workers` blocks are in flight at once, so memory use stays
+    around (max_workers + 1) x block_size.
+
+    Args:
+        blob_client: azure.storage.blob.BlobClient of the blob to write
+        block_size (int): Size in bytes of each block
+        max_workers (int): Number of blocks to stage concurrently
+    """
+
+    def __init__(
+        self,
+        blob_client,
+        block_size=DEFAULT_BLOCK_SIZE,
+        max_workers=DEFAULT_MAX_WORKERS,
+    ):
+        self.blob_client = blob_client
+        self.block_size = block_size
+        self.block_ids = []
+        self._buffer = bytearray()
+        self._executor = ThreadPoolExecutor(max(max_workers, 1))
+        self._slots = threading.BoundedSemaphore(max(max_workers, 1))
+        self._futures = []
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.block_size:
+            self._stage(bytes(self._buffer[: self.block_size]))
+            del self._buffer[: self.block_size]
+        return len(data)
+
+    def _stage_block(self, block_id, data):
+        try:
+            self.blob_client.stage_block(block_id, data)
+        finally:
+            self._slots.release()
+
+    def _stage(self, data):
+        # Block ids must all have the same length
+        block_id = base64.b64encode(
+            f"{len(self.block_ids):08d}".encode()
+        ).decode()
+        self._slots.acquire()
+        self._futures.append(
+            self._executor.submit(self._stage_block, block_id, data)
+        )
+        self.block_ids.append(block_id)
+        # Surface failed blocks early rather than at commit
+        for future in self._futures:
+            if future.done():
+                future.result()
+        self._futures = [f for f in self._futures if not f.done()]
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        """Stage the last block, wait for every block and commit the list."""
+        try:
+            if self._buffer or not self.block_ids:
+                self._stage(bytes(self._buffer))
+                self._buffer.clear()
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+            self.closed = True
+        self.blob_client.commit_block_list(self.block_ids)
+        logger.debug(f"Committed {len(self.block_ids)} blocks")
+
+    def abort(self):
+        """Stop staging. Uncommitted blocks are discarded by the service."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.closed = True
+
+
+class AzureBlobStorage(StorageBackend):
+    """
+    Azure Blob Storage, authorised with the account key or a SAS token.
+
+    Reads and downloads go through a pooled BlobDownloadClient (parallel
+    ranged GETs, MD5 checks, conditional requests). Listing and block
+    uploads use the Azure SDK.
+
+    Args:
+        account (str): Storage account name
+        key (str): Base64 encoded account key. Defaults to None.
+        sas_token (str): SAS token, used if there is no key. Defaults to None.
+        endpoint (str): Base URL of the blob service. Defaults to the public
+            Azure endpoint of the account.
+        max_workers (int): Concurrent ranged GETs per download, and default
+            concurrency of `get_many`
+        chunk_size (int): Size in bytes of each ranged GET
+        block_size (int): Size in bytes of each staged block when writing
+        timeout (float): Timeout for each request. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        account,
+        key=None,
+        sas_token=None,
+        endpoint=None,
+        max_workers=DEFAULT_MAX_WORKERS,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        block_size=DEFAULT_BLOCK_SIZE,
+        timeout=None,
+    ):
+        super().__init__(max_workers)
+        self.account = account
+        self.key = key
+        self.sas_token = None if key else sas_token
+        self.endpoint = endpoint
+        self.block_size = block_size
+        self.client = BlobDownloadClient(
+            account,
+            key,
+            endpoint=endpoint,
+            max_workers=max_workers,
+            chunk_size=chunk_size,
+            timeout=timeout,
+            sas_token=self.sas_token,
+        )
+        self._service = None
+
+    @property
+    def gdal_options(self):
+        if self.sas_token:
+            return {}
+        if self.endpoint:
+            # /vsiaz/ only reads a custom endpoint from a connection string
+            protocol = self.endpoint.split(":")[0]
+            return {
+                "AZURE_STORAGE_CONNECTION_STRING": (
+                    f"DefaultEndpointsProtocol={protocol};"
+                    f"AccountName={self.account};AccountKey={self.key};"
+                    f"BlobEndpoint={self.endpoint}"
+                )
+            }
+        return {
+            "AZURE_STORAGE_ACCOUNT": self.account,
+            "AZURE_STORAGE_ACCESS_KEY": self.key,
+        }
+
+    def service_client(self):
+        if self._service is None:
+            from azure.storage.blob import BlobServiceClient
+
+            self._service = BlobServiceClient(
+                account_url=self.client.endpoint,
+                credential=(
+                    {"account_name": self.account, "account_key": self.key}
+                    if self.key
+                    else self.sas_token
+                ),
+            )
+        return self._service
+
+    def close(self):
+        self.client.close()
+        if self._service is not None:
+            self._service.close()
+            self._service = None
+
+    def list(self, container, prefix=""):
+        container_client = self.service_client().get_container_client(
+            container
+        )
+        for blob in container_client.list_blobs(name_starts_with=prefix):
+            md5 = blob.content_settings.content_md5
+            yield BlobInfo(
+                name=blob.name,
+                size=blob.size,
+                etag=blob.etag,
+                last_modified=formatdate(
+                    blob.last_modified.timestamp(), usegmt=True
+                ),
+                content_md5=base64.b64encode(md5).decode() if md5 else None,
+            )
+
+    @staticmethod
+    def _info(blob, properties):
+        return BlobInfo(
+            name=blob,
+            size=properties["size"],
+            etag=properties["etag"],
+            last_modified=properties["last_modified"],
+            content_md5=properties["content_md5"],
+        )
+
+    @contextmanager
+    def _not_found(self, container, blob):
+        try:
+            yield
+        except HTTPError as err:
+            if err.response is not None and err.response.status_code == 404:
+                raise BlobNotFoundError(
+                    f"{container}/{blob} not found"
+                ) from err
+            raise
+
+    def stat(self, container, blob):
+        with self._not_found(container, blob):
+            return self._info(
+                blob, self.client.get_properties(container, blob)
+            )
+
+    def read_range(self, container, blob, start=0, end=None):
+        with self._not_found(container, blob):
+            return self.client.read_range(container, blob, start, end)
+
+    def download(
+        self, container, blob, path, if_none_match=None, if_modified_since=None
+    ):
+        with self._not_found(container, blob):
+            properties = self.client.download(
+                container,
+                blob,
+                path,
+                if_none_match=if_none_match,
+                if_modified_since=if_modified_since,
+            )
+        if properties["path"] is None:
+            return None
+        return self._info(blob, properties)
+
+    @contextmanager
+    def open_write(self, container, blob):
+        blob_client = self.service_client().get_blob_client(container, blob)
+        writer = BlockBlobWriter(
+            blob_client, self.block_size, max_workers=self.max_workers
+        )
+        try:
+            yield writer
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def url(self, container, blob):
+        return self.client.blob_url(container, blob)
+
+    def gdal_path(self, container, blob):
+        if self.sas_token:
+            return "/vsicurl/" + self.url(container, blob)
+        return f"/vsiaz/{container}/{blob}"
+
+
+BACKENDS = {
+    "azure": AzureBlobStorage,
+    "local": LocalStorage,
+    "memory": MemoryStorage,
+}
+
+
+def get_storage(backend="azure", **options):
+    """
+    Create a storage backend.
+
+    Args:
+        backend (str): One of "azure", "local" or "memory"
+        **options: Arguments of the backend class, e.g. account and key for
+            azure or root for local
+
+    Returns:
+        StorageBackend: The backend
+    """
+    try:
+        storage_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            f"Unknown storage backend {backend}, expected one of "
+            f"{list(BACKENDS)}"
+        )
+    return storage_class(**options)
+
+
+def storage_credentials(configuration):
+    """Storage account, container and key from the STORAGE_ACCOUNT,
+    CONTAINER and KEY environment variables, or else the configuration."""
+    load_env()
+    try:
+        return (
+            os.environ["STORAGE_ACCOUNT"],
+            os.environ["CONTAINER"],
+            os.environ["KEY"],
+        )
+    except Exception:
+        return (
+            configuration["account"],
+            configuration["container"],
+            configuration["key"],
+        )
+
+
+def storage_from_configuration(configuration):
+    """
+    Set up the storage the pipeline reads blobs from. The storage section of
+    the configuration selects the backend; Azure uses the account and key
+    from storage_credentials and the blob_download options.
+
+    Args:
+        configuration (dict): Project configuration
+
+    Returns:
+        StorageBackend: The backend
+    """
+    options = dict(configuration.get("storage") or {})
+    backend = options.pop("backend", "azure")
+    if backend == "azure":
+        account, _, key = storage_credentials(configuration)
+        options = {
+            "account": account,
+            "key": key,
+            **configuration.get("blob_download", {}),
+            **options,
+        }
+    return get_storage(backend, **options)
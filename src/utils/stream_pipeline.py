@@ -0,0 +1,182 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the items on a queue
+_DONE = object()
+
+
+class StreamPipeline:
+    """
+    Producer-consumer pipeline passing items through a chain of stages on
+    worker threads connected by bounded queues.
+
+    Each stage takes one item at a time from its input queue and puts its
+    result on the next stage's queue. A full queue blocks the stage feeding
+    it, so a slow stage holds back the ones before it and at most about
+    `queue_size + workers` items are held between two stages, however many
+    items go through the pipeline. Results of the last stage are handed to
+    `sink` on the calling thread, in the order they come out.
+
+    If a stage or the sink raises, no new items are started, the ones in
+    flight are drained and the first error is raised by `run`.
+
+    Args:
+        name (str): Name of the pipeline, used for its threads and logs
+    """
+
+    def __init__(self, name="pipeline"):
+        self.name = name
+        self.stages = []
+        self.busy_s = Counter()
+        self.items = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, func, workers=1, queue_size=1, on_done=None):
+        """
+        Add a stage at the end of the pipeline.
+
+        Args:
+            name (str): Name of the stage
+            func (Callable): Called with each item, returns the item passed
+                on to the next stage
+            workers (int): Number of threads running the stage
+            queue_size (int): Number of items that can wait for the stage
+            on_done (Callable): Called without arguments once every item has
+                gone through the stage (or the pipeline stopped)
+
+        Returns:
+            StreamPipeline: The pipeline, so stages can be chained
+        """
+        self.stages.append(
+            {
+                "name": name,
+                "func": func,
+                "workers": max(workers, 1),
+                "queue_size": max(queue_size, 1),
+                "on_done": on_done,
+            }
+        )
+        return self
+
+    def _work(self, stage, inbox, outbox, state):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # Let the other workers of the stage see the end too
+                inbox.put(_DONE)
+                break
+            if state["stop"].is_set():
+                continue
+            start = time.perf_counter()
+            try:
+                result = stage["func"](item)
+            except BaseException as err:
+                logger.error(
+                    f"{self.name} stage {stage['name']} failed", exc_info=err
+                )
+                with self._lock:
+                    state["errors"].append(err)
+                state["stop"].set()
+                continue
+            with self._lock:
+                self.busy_s[stage["name"]] += time.perf_counter() - start
+                self.items[stage["name"]] += 1
+            outbox.put(result)
+        with self._lock:
+            state["running"][stage["name"]] -= 1
+            last = state["running"][stage["name"]] == 0
+        if last:
+            try:
+                if stage["on_done"] is not None:
+                    stage["on_done"]()
+            except BaseException as err:
+                with self._lock:
+                    state["errors"].append(err)
+                state["stop"].set()
+            finally:
+                outbox.put(_DONE)
+
+    def _feed(self, items, inbox, state):
+        try:
+            for item in items:
+                if state["stop"].is_set():
+                    break
+                inbox.put(item)
+        except BaseException as err:
+            with self._lock:
+                state["errors"].append(err)
+            state["stop"].set()
+        finally:
+            inbox.put(_DONE)
+
+    def run(self, items, sink=None):
+        """
+        Pass `items` through every stage.
+
+        Args:
+            items (Iterable): Items fed to the first stage. Read lazily, on
+                a feeder thread.
+            sink (Callable): Called on the calling thread with each result of
+                the last stage. Defaults to None (results are dropped).
+
+        Returns:
+            int: Number of items that came out of the last stage
+        """
+        if not self.stages:
+            raise ValueError("The pipeline has no stages")
+        state = {
+            "stop": threading.Event(),
+            "errors": [],
+            "running": Counter(),
+        }
+        queues = [queue.Queue(stage["queue_size"]) for stage in self.stages]
+        queues.append(queue.Queue(self.stages[-1]["queue_size"]))
+        threads = [
+            threading.Thread(
+                target=self._feed,
+                args=(items, queues[0], state),
+                name=f"{self.name}-feed",
+                daemon=True,
+            )
+        ]
+        for i, stage in enumerate(self.stages):
+            state["running"][stage["name"]] = stage["workers"]
+            for worker in range(stage["workers"]):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=(stage, queues[i], queues[i + 1], state),
+                        name=f"{self.name}-{stage['name']}-{worker}",
+                        daemon=True,
+                    )
+                )
+        for thread in threads:
+            thread.start()
+
+        n_out = 0
+        while True:
+            result = queues[-1].get()
+            if result is _DONE:
+                break
+            if state["stop"].is_set():
+                continue
+            try:
+                if sink is not None:
+                    sink(result)
+                n_out += 1
+            except BaseException as err:
+                state["errors"].append(err)
+                state["stop"].set()
+        for thread in threads:
+            thread.join()
+
+        busy = ", ".join(f"{name} {s:.1f}s" for name, s in self.busy_s.items())
+        logger.info(f"{self.name}: {n_out} items out, busy time {busy}")
+        if state["errors"]:
+            raise state["errors"][0]
+        return n_out
@@ -0,0 +1,158 @@
+import logging
+from copy import copy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROW_GROUP_SIZE = 100000
+DEFAULT_CHUNK_SIZE = 50000
+
+
+def write_parquet(df, sink, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Stream a DataFrame to Parquet one row group at a time.
+
+    Only one row group is converted to Arrow at any time, and each is written
+    to `sink` as soon as it is encoded, so a streaming sink (such as the
+    block blob writer of AzureBlobStorage.open_write) can upload earlier row
+    groups while later ones are being encoded.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The DataFrame to write. The index is not written.
+    sink : str, Path or file-like
+        Path of the Parquet file or a writable binary file object.
+    row_group_size : int, optional
+        Maximum number of rows per row group. Default is 100000.
+
+    Returns
+    -------
+    int
+        Number of row groups written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    n_groups = 0
+    with pq.ParquetWriter(sink, schema) as writer:
+        for start in range(0, max(len(df), 1), row_group_size):
+            table = pa.Table.from_pandas(
+                df.iloc[start : start + row_group_size],
+                schema=schema,
+                preserve_index=False,
+            )
+            writer.write_table(table)
+            n_groups += 1
+    logger.debug(f"Wrote {len(df)} rows in {n_groups} row groups")
+    return n_groups
+
+
+def iter_chunk_rows(df, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the rows of a DataFrame as tuples, one chunk at a time.
+
+    Only a single chunk of rows is converted to Python objects at any time,
+    so memory use does not grow with the number of rows in `df`. Missing
+    values are yielded as None so they are written out as empty cells.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The DataFrame to iterate over. The index is not yielded.
+    chunk_size : int, optional
+        Number of rows converted in one go. Default is 50000.
+
+    Yields
+    ------
+    tuple
+        One row of the DataFrame, in column order.
+    """
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start : start + chunk_size]
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+
+def _copy_sheet(source, target):
+    from openpyxl.cell import WriteOnlyCell
+
+    for key, dimension in source.column_dimensions.items():
+        target.column_dimensions[key].width = dimension.width
+    for row in source.iter_rows():
+        cells = []
+        for cell in row:
+            out = WriteOnlyCell(target, value=cell.value)
+            if cell.has_style:
+                out.font = copy(cell.font)
+                out.alignment = copy(cell.alignment)
+                out.border = copy(cell.border)
+                out.fill = copy(cell.fill)
+                out.number_format = cell.number_format
+            cells.append(out)
+        target.append(cells)
+
+
+def write_xlsx_sheets(
+    filepath, frames, template=None, chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """
+    Stream DataFrames to the sheets of an Excel file with bounded memory.
+
+    The workbook is written in openpyxl's write-only mode, which flushes each
+    row to a temporary file as it is appended, and the rows of each
+    DataFrame are converted one chunk at a time, so peak memory does not
+    grow with the number of rows written.
+
+    Parameters
+    ----------
+    filepath : str or Path
+        Path of the Excel file to write. It may be the same file as
+        `template`.
+    frames : dict of str to pandas.DataFrame
+        DataFrames to write, keyed by sheet name, in sheet order. The index
+        is not written.
+    template : str or Path, optional
+        Excel file whose other sheets (such as a readme) are copied, with
+        their cell styles and column widths, before the DataFrame sheets.
+        Sheets named in `frames` are replaced.
+    chunk_size : int, optional
+        Number of rows converted in one go. Default is 50000.
+
+    Returns
+    -------
+    int
+        Number of data rows written.
+    """
+    from openpyxl import Workbook, load_workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    workbook = Workbook(write_only=True)
+    if template is not None:
+        # The template is only a few rows, so it is read whole before
+        # `filepath`, which may be the same file, is overwritten
+        source = load_workbook(template)
+        for sheet in source.worksheets:
+            if sheet.title not in frames:
+                _copy_sheet(sheet, workbook.create_sheet(sheet.title))
+
+    # The header style of DataFrame.to_excel
+    thin = Side(style="thin")
+    n_rows = 0
+    for name, df in frames.items():
+        sheet = workbook.create_sheet(name)
+        header = []
+        for column in df.columns:
+            cell = WriteOnlyCell(sheet, value=str(column))
+            cell.font = Font(bold=True)
+            cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+            cell.alignment = Alignment(horizontal="center", vertical="top")
+            header.append(cell)
+        sheet.append(header)
+        for row in iter_chunk_rows(df, chunk_size):
+            sheet.append(row)
+            n_rows += 1
+    workbook.save(filepath)
+    logger.info(f"Wrote {n_rows} rows to {filepath}")
+    return n_rows
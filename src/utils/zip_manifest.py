@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, BadZipFile, ZipFile, ZipInfo
+
+logger = logging.getLogger(__name__)
+
+# Fixed modification time of the members, so that a member's bytes only
+# depend on its content
+MEMBER_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def read_manifest(path):
+    """
+    Read a manifest written by ManifestZip.
+
+    Returns:
+        dict: Fingerprint, SHA-256, CRC-32 and size of each member by member
+        name, empty if there is no manifest
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)["members"]
+    except (FileNotFoundError, KeyError, TypeError, ValueError):
+        return {}
+
+
+class ManifestZip:
+    """
+    Zip of files built from an earlier version of itself.
+
+    A manifest, kept in a JSON file next to the zip rather than in it,
+    records the fingerprint of the inputs, the SHA-256 and the CRC-32 of
+    each member. When the zip is rebuilt, a member with the same name,
+    fingerprint and CRC-32 as in the previous zip is copied from it instead
+    of being rebuilt from its inputs, so only new or changed members need
+    their COG merged and encoded. Copied members are decompressed and
+    compressed again through the public zipfile API. Members are written
+    with a fixed modification time, and the manifest is sorted, so the
+    content of the zip only changes with the content of its members.
+
+    The zip is written to a temporary file moved over `path` on close, so
+    `previous` can be `path` itself (or a link to it) and an interrupted
+    build leaves the previous zip as it was.
+
+    Args:
+        path (str or Path): Zip to write
+        manifest_path (str or Path): JSON file of the manifest to write
+        previous (str or Path): Previous version of the zip. Defaults to None.
+        previous_manifest (str or Path): Manifest of `previous`. Defaults to
+            None.
+        compression (int): Compression of new members
+    """
+
+    def __init__(
+        self,
+        path,
+        manifest_path,
+        previous=None,
+        previous_manifest=None,
+        compression=ZIP_DEFLATED,
+    ):
+        self.path = Path(path)
+        self.manifest_path = Path(manifest_path)
+        self.compression = compression
+        self.members = {}
+        self.reused = 0
+        self._previous_manifest = (
+            read_manifest(previous_manifest)
+            if previous and previous_manifest
+            else {}
+        )
+        self._previous = ZipFile(previous) if self._previous_manifest else None
+        self._tmp_path = self.path.with_name(
+            f"{self.path.name}.{uuid.uuid4().hex}.part"
+        )
+        self._zipf = ZipFile(self._tmp_path, "w", compression)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+    def write(self, path, arcname, fingerprint=None):
+        """Compress the file at `path` into the zip as `arcname`."""
+        with open(path, "rb") as src:
+            self._write_stream(src, arcname, fingerprint)
+
+    def _write_stream(self, src, arcname, fingerprint):
+        info = ZipInfo(arcname, MEMBER_DATE_TIME)
+        info.compress_type = self.compression
+        info.external_attr = 0o644 << 16
+        sha256 = hashlib.sha256()
+        with self._zipf.open(info, "w") as dst:
+            while chunk := src.read(1024 * 1024):
+                sha256.update(chunk)
+                dst.write(chunk)
+        self.members[arcname] = {
+            "fingerprint": fingerprint,
+            "sha256": sha256.hexdigest(),
+            "crc": info.CRC,
+            "size": info.file_size,
+        }
+
+    def reuse(self, arcname, fingerprint):
+        """
+        Copy the member `arcname` from the previous zip if it was built from
+        the same inputs.
+
+        Returns:
+            bool: Whether the member was copied
+        """
+        entry = self._previous_manifest.get(arcname)
+        if (
+            fingerprint is None
+            or entry is None
+            or entry.get("fingerprint") != fingerprint
+        ):
+            return False
+        try:
+            info = self._previous.getinfo(arcname)
+            # A manifest saved with another version of the zip
+            if info.CRC != entry.get("crc"):
+                raise BadZipFile("CRC does not match the manifest")
+            with self._previous.open(info) as src:
+                self._write_stream(src, arcname, fingerprint)
+        except (KeyError, BadZipFile) as err:
+            logger.warning(f"Cannot reuse {arcname} from previous zip: {err}")
+            return False
+        self.members[arcname] = entry
+        self.reused += 1
+        return True
+
+    def close(self, commit=True):
+        """Close the zip, and if `commit`, move it over `path` and write the
+        manifest. Otherwise the zip is discarded."""
+        self._zipf.close()
+        if self._previous is not None:
+            self._previous.close()
+        if not commit:
+            self._tmp_path.unlink(missing_ok=True)
+            return
+        # The old manifest goes first, so it never describes the new zip
+        self.manifest_path.unlink(missing_ok=True)
+        os.replace(self._tmp_path, self.path)
+        manifest_tmp_path = self._tmp_path.with_suffix(".json")
+        with open(manifest_tmp_path, "w") as f:
+            json.dump({"members": self.members}, f, indent=1, sort_keys=True)
+        os.replace(manifest_tmp_path, self.manifest_path)
+        logger.info(
+            f"Wrote {len(self.members)} members to {self.path}, "
+            f"{self.reused} copied from the previous zip"
+        )
+
+
+def copy_zip(src, dst):
+    """Copy a zip to `dst` through a temporary file, so that `dst` is never
+    a link to `src` that a later rebuild of `dst` would write through."""
+    dst = Path(dst)
+    tmp_path = dst.with_name(f"{dst.name}.{uuid.uuid4().hex}.part")
+    shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+    return dst
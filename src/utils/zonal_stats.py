@@ -0,0 +1,615 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from affine import Affine
+from rasterio.features import rasterize
+from rasterio.windows import Window, from_bounds
+from scipy import sparse
+
+from src.utils.grid import (
+    FLOODSCAN_GRID,
+    FLOODSCAN_SHAPE,
+    FLOODSCAN_TRANSFORM,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def read_admin_shapes(path, admin_level):
+    """
+    Read admin boundaries from a GeoJSON file.
+
+    Parameters
+    ----------
+    path : str or Path
+        GeoJSON FeatureCollection with one feature per admin unit.
+    admin_level : int
+        Admin level of the features, used to find the `ADM{level}_PCODE`
+        property. The `ISO3` property holds the country code.
+
+    Returns
+    -------
+    list of tuple
+        (geometry, iso3, pcode) for every feature.
+    """
+    with open(path) as f:
+        features = json.load(f)["features"]
+    return [
+        (
+            feature["geometry"],
+            feature["properties"]["ISO3"],
+            feature["properties"][f"ADM{admin_level}_PCODE"],
+        )
+        for feature in features
+    ]
+
+
+def geometry_bounds(geometry):
+    """(minx, miny, maxx, maxy) of a GeoJSON-like Polygon or MultiPolygon."""
+    coords = np.array(
+        [xy for ring in _rings(geometry["coordinates"]) for xy in ring]
+    )
+    return (*coords.min(axis=0)[:2], *coords.max(axis=0)[:2])
+
+
+def _rings(coordinates):
+    # Polygon coordinates are a list of rings, MultiPolygons a list of those
+    if np.ndim(coordinates[0][0]) == 1:
+        return coordinates
+    return [ring for polygon in coordinates for ring in polygon]
+
+
+def coverage_fractions(geometry, out_shape, transform, oversample=10):
+    """
+    Fraction of each grid cell covered by a geometry.
+
+    The geometry is rasterized on a grid `oversample` times finer than the
+    target grid, over its bounding box only, and the fine cells are summed
+    back into the target cells.
+
+    Parameters
+    ----------
+    geometry : dict
+        GeoJSON-like geometry.
+    out_shape : tuple
+        Shape of the target grid.
+    transform : affine.Affine
+        Transform of the target grid.
+    oversample : int, optional
+        Fine cells per target cell along each axis. Default is 10.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Flat indices of the covered target cells and their coverage fraction.
+    """
+    window = from_bounds(*geometry_bounds(geometry), transform=transform)
+    row_start = max(int(np.floor(window.row_off)), 0)
+    col_start = max(int(np.floor(window.col_off)), 0)
+    row_stop = min(int(np.ceil(window.row_off + window.height)), out_shape[0])
+    col_stop = min(int(np.ceil(window.col_off + window.width)), out_shape[1])
+    window = Window(
+        col_start, row_start, col_stop - col_start, row_stop - row_start
+    )
+    if window.width <= 0 or window.height <= 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+    fine_transform = (
+        transform
+        * Affine.translation(col_start, row_start)
+        * Affine.scale(1 / oversample)
+    )
+    fine = rasterize(
+        [(geometry, 1)],
+        out_shape=(window.height * oversample, window.width * oversample),
+        transform=fine_transform,
+        fill=0,
+        dtype="uint8",
+    )
+    fractions = fine.reshape(
+        window.height, oversample, window.width, oversample
+    ).sum(axis=(1, 3), dtype=np.float32) / (oversample**2)
+    rows, cols = np.nonzero(fractions)
+    cells = np.ravel_multi_index(
+        (rows + row_start, cols + col_start), out_shape
+    )
+    return cells, fractions[rows, cols]
+
+
+def stats_frame(units, dates, means):
+    """
+    Zonal means in the layout of `pg.fs_last_90_days`.
+
+    Parameters
+    ----------
+    units : pandas.DataFrame
+        iso3 and pcode of each unit.
+    dates : list
+        Date of each row of `means`.
+    means : numpy.ndarray
+        Means with shape (n_dates, n_units).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns iso3, pcode, valid_date and value.
+    """
+    df = pd.concat([units] * len(dates), ignore_index=True)
+    df["valid_date"] = np.repeat(
+        [pd.Timestamp(date).date() for date in dates], len(units)
+    )
+    df["value"] = np.asarray(means).ravel()
+    return df
+
+
+def file_fingerprint(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ZonalStats:
+    """
+    Zonal means on the FloodScan grid from an integer label grid.
+
+    Admin polygons are rasterized once into a grid of unit labels (0 for cells
+    outside every unit) aligned to the FloodScan grid. Per-unit means of a
+    raster are then a single `np.bincount` pass over the labelled cells, so
+    all units are computed at once rather than masking polygon by polygon.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        Integer grid where cell value i > 0 marks unit `units.iloc[i - 1]`.
+    units : pandas.DataFrame
+        iso3 and pcode of each unit, in label order.
+    """
+
+    def __init__(self, labels, units):
+        self.labels = labels
+        self.units = units.reset_index(drop=True)
+        self.version = None
+        self.cells = np.flatnonzero(labels)
+        self.cell_labels = labels.ravel()[self.cells]
+
+    @classmethod
+    def from_shapes(
+        cls, shapes, out_shape=FLOODSCAN_SHAPE, transform=FLOODSCAN_TRANSFORM
+    ):
+        """
+        Rasterize admin shapes into a label grid.
+
+        Parameters
+        ----------
+        shapes : iterable of tuple
+            (geometry, iso3, pcode) as returned by `read_admin_shapes`.
+            Geometries are GeoJSON-like mappings in EPSG:4326.
+        out_shape : tuple, optional
+            Shape of the grid. Default is the FloodScan grid.
+        transform : affine.Affine, optional
+            Transform of the grid. Default is the FloodScan grid.
+        """
+        shapes = list(shapes)
+        labels = rasterize(
+            ((geom, i + 1) for i, (geom, _, _) in enumerate(shapes)),
+            out_shape=out_shape,
+            transform=transform,
+            fill=0,
+            dtype="int32",
+        )
+        units = pd.DataFrame(
+            [(iso3, pcode) for _, iso3, pcode in shapes],
+            columns=["iso3", "pcode"],
+        )
+        return cls(labels, units)
+
+    @classmethod
+    def cached(cls, shapes_path, admin_level, cache_folder):
+        """
+        Load the label grid for a boundaries file from the cache, building
+        and caching it if the file has not been seen before.
+        """
+        fingerprint = file_fingerprint(shapes_path)[:16]
+        cache_path = (
+            Path(cache_folder).expanduser()
+            / f"labels_adm{admin_level}_{fingerprint}.npz"
+        )
+        if cache_path.exists():
+            zonal_stats = cls.load(cache_path)
+        else:
+            logger.info(f"Rasterizing admin {admin_level} boundaries")
+            zonal_stats = cls.from_shapes(
+                read_admin_shapes(shapes_path, admin_level)
+            )
+            zonal_stats.save(cache_path)
+        zonal_stats.version = cache_path.stem
+        return zonal_stats
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            labels=self.labels,
+            iso3=self.units["iso3"].to_numpy(dtype=str),
+            pcode=self.units["pcode"].to_numpy(dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            units = pd.DataFrame({"iso3": npz["iso3"], "pcode": npz["pcode"]})
+            return cls(npz["labels"], units)
+
+    def means(self, values):
+        """
+        Mean of `values` over each unit, ignoring NaN cells.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            2D raster on the same grid as the labels.
+
+        Returns
+        -------
+        numpy.ndarray
+            Mean per unit, NaN for units without valid cells.
+        """
+        if values.shape != self.labels.shape:
+            raise ValueError(
+                f"Raster shape {values.shape} does not match the label grid "
+                f"{self.labels.shape}"
+            )
+        cell_values = values.ravel()[self.cells]
+        valid = np.isfinite(cell_values)
+        n_bins = len(self.units) + 1
+        sums = np.bincount(
+            self.cell_labels[valid],
+            weights=cell_values[valid],
+            minlength=n_bins,
+        )
+        counts = np.bincount(self.cell_labels[valid], minlength=n_bins)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (sums / counts)[1:]
+
+    def means_cube(self, cube):
+        """Means of a stack of rasters with shape (n_days, *shape), returned
+        with shape (n_days, n_units)."""
+        return np.stack([self.means(np.asarray(values)) for values in cube])
+
+    def to_frame(self, rasters):
+        """
+        Zonal means of several days in the layout of `pg.fs_last_90_days`.
+
+        Parameters
+        ----------
+        rasters : dict
+            2D rasters (numpy or xarray) keyed by date.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns iso3, pcode, valid_date and value.
+        """
+        dates = sorted(rasters)
+        means = [self.means(np.asarray(rasters[date])) for date in dates]
+        return stats_frame(self.units, dates, means)
+
+
+class WeightedZonalStats:
+    """
+    Area-weighted zonal means on the FloodScan grid from a sparse weight
+    matrix.
+
+    Each admin unit is a row of a sparse (unit x grid cell) matrix holding the
+    fraction of every grid cell it covers, so small units that contain no
+    cell centre still get exact area-weighted means. Zonal means of any number
+    of days are one sparse-matrix x dense-matrix product. The matrix only
+    depends on the boundaries, so it is cached as a compressed file keyed by
+    the boundaries version.
+
+    Parameters
+    ----------
+    weights : scipy.sparse.csr_matrix
+        Coverage fractions with shape (n_units, n_cells).
+    units : pandas.DataFrame
+        iso3 and pcode of each unit, in row order.
+    shape : tuple
+        Shape of the grid the weights refer to.
+    """
+
+    def __init__(self, weights, units, shape=FLOODSCAN_SHAPE):
+        self.shape = tuple(shape)
+        self.units = units.reset_index(drop=True)
+        self.version = None
+        # Only keep the columns of cells covered by at least one unit
+        weights = weights.tocsc()
+        self.cells = np.flatnonzero(np.diff(weights.indptr))
+        self.weights = weights[:, self.cells].tocsr()
+
+    @classmethod
+    def from_shapes(
+        cls,
+        shapes,
+        out_shape=FLOODSCAN_SHAPE,
+        transform=FLOODSCAN_TRANSFORM,
+        oversample=10,
+    ):
+        """
+        Build the weight matrix from admin shapes.
+
+        Parameters
+        ----------
+        shapes : iterable of tuple
+            (geometry, iso3, pcode) as returned by `read_admin_shapes`.
+        out_shape : tuple, optional
+            Shape of the grid. Default is the FloodScan grid.
+        transform : affine.Affine, optional
+            Transform of the grid. Default is the FloodScan grid.
+        oversample : int, optional
+            Fine cells per grid cell along each axis used to estimate the
+            coverage fractions. Default is 10.
+        """
+        shapes = list(shapes)
+        rows, cols, data = [], [], []
+        for i, (geom, _, _) in enumerate(shapes):
+            cells, fractions = coverage_fractions(
+                geom, out_shape, transform, oversample
+            )
+            rows.append(np.full(len(cells), i))
+            cols.append(cells)
+            data.append(fractions)
+        weights = sparse.csr_matrix(
+            (
+                np.concatenate(data),
+                (np.concatenate(rows), np.concatenate(cols)),
+            ),
+            shape=(len(shapes), out_shape[0] * out_shape[1]),
+            dtype=np.float32,
+        )
+        units = pd.DataFrame(
+            [(iso3, pcode) for _, iso3, pcode in shapes],
+            columns=["iso3", "pcode"],
+        )
+        return cls(weights, units, out_shape)
+
+    @classmethod
+    def cached(cls, shapes_path, admin_level, cache_folder, oversample=10):
+        """
+        Load the weight matrix for a boundaries file from the cache, building
+        and caching it if the file has not been seen before.
+        """
+        fingerprint = file_fingerprint(shapes_path)[:16]
+        cache_path = (
+            Path(cache_folder).expanduser()
+            / f"weights_adm{admin_level}_{fingerprint}_x{oversample}.npz"
+        )
+        if cache_path.exists():
+            zonal_stats = cls.load(cache_path)
+        else:
+            logger.info(f"Building admin {admin_level} weight matrix")
+            zonal_stats = cls.from_shapes(
+                read_admin_shapes(shapes_path, admin_level),
+                oversample=oversample,
+            )
+            zonal_stats.save(cache_path)
+        zonal_stats.version = cache_path.stem
+        return zonal_stats
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            data=self.weights.data,
+            indices=self.cells[self.weights.indices],
+            indptr=self.weights.indptr,
+            shape=np.array(self.shape),
+            iso3=self.units["iso3"].to_numpy(dtype=str),
+            pcode=self.units["pcode"].to_numpy(dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            shape = tuple(npz["shape"])
+            weights = sparse.csr_matrix(
+                (npz["data"], npz["indices"], npz["indptr"]),
+                shape=(len(npz["iso3"]), shape[0] * shape[1]),
+            )
+            units = pd.DataFrame({"iso3": npz["iso3"], "pcode": npz["pcode"]})
+        return cls(weights, units, shape)
+
+    def means_cube(self, cube):
+        """
+        Area-weighted means of a stack of rasters, ignoring NaN cells.
+
+        Parameters
+        ----------
+        cube : numpy.ndarray
+            Rasters with shape (n_days, *shape).
+
+        Returns
+        -------
+        numpy.ndarray
+            Means with shape (n_days, n_units), NaN for units without valid
+            cells.
+        """
+        cube = np.asarray(cube)
+        if cube.shape[1:] != self.shape:
+            raise ValueError(
+                f"Raster shape {cube.shape[1:]} does not match the weight "
+                f"matrix grid {self.shape}"
+            )
+        values = cube.reshape(len(cube), -1)[:, self.cells].T.astype(
+            np.float64
+        )
+        valid = np.isfinite(values)
+        numerator = self.weights @ np.where(valid, values, 0)
+        denominator = self.weights @ valid.astype(np.float32)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (numerator / denominator).T
+
+    def means(self, values):
+        return self.means_cube(np.asarray(values)[np.newaxis])[0]
+
+    def to_frame(self, rasters, batch_size=8):
+        """
+        Zonal means of several days in the layout of `pg.fs_last_90_days`.
+
+        Parameters
+        ----------
+        rasters : dict
+            2D rasters (numpy or xarray) keyed by date.
+        batch_size : int, optional
+            Days stacked and multiplied with the weight matrix at once, which
+            bounds the memory used to a few full rasters. Default is 8.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns iso3, pcode, valid_date and value.
+        """
+        dates = sorted(rasters)
+        means = []
+        for start in range(0, len(dates), batch_size):
+            cube = np.stack(
+                [
+                    np.asarray(rasters[date])
+                    for date in dates[start : start + batch_size]
+                ]
+            )
+            means.append(self.means_cube(cube))
+        means = np.concatenate(means) if means else np.empty((0, 0))
+        return stats_frame(self.units, dates, means)
+
+
+class BaselineStats:
+    """
+    Admin zonal means of the day-of-year SFED baseline raster.
+
+    The baseline NetCDF holds one smoothed 10-year mean raster per day of
+    year. Its zonal means only change when the baseline or the boundaries do,
+    so they are computed once into a compact (admin unit x day of year)
+    float32 matrix and cached, and daily runs only index into it.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray
+        Baseline means with shape (n_units, n_doys).
+    units : pandas.DataFrame
+        iso3 and pcode of each unit, in row order.
+    doys : numpy.ndarray
+        Day of year of each column.
+    """
+
+    def __init__(self, matrix, units, doys):
+        self.matrix = matrix
+        self.units = units.reset_index(drop=True)
+        self.doys = np.asarray(doys)
+
+    @classmethod
+    def from_baseline(cls, engine, da_baseline, batch_size=31):
+        """
+        Zonal-average every day of year of the baseline raster.
+
+        Parameters
+        ----------
+        engine : ZonalStats or WeightedZonalStats
+            Engine holding the admin units on the FloodScan grid.
+        da_baseline : xarray.DataArray
+            SFED_BASELINE with dims dayofyear and y/x or lat/lon, on the
+            FloodScan grid.
+        batch_size : int, optional
+            Days of year loaded into memory at once. Default is 31.
+        """
+        # The label grid is north up
+        da_baseline = FLOODSCAN_GRID.snap(da_baseline, full=True)
+        da_baseline = da_baseline.transpose("dayofyear", "y", "x")
+        doys = da_baseline["dayofyear"].values
+        means = []
+        for start in range(0, len(doys), batch_size):
+            cube = da_baseline.isel(
+                dayofyear=slice(start, start + batch_size)
+            ).values
+            means.append(engine.means_cube(cube))
+        matrix = np.concatenate(means).T.astype(np.float32)
+        return cls(matrix, engine.units, doys)
+
+    @classmethod
+    def cached(
+        cls, engine, da_baseline, baseline_version, admin_level, cache_folder
+    ):
+        """
+        Load the baseline matrix for a baseline version and set of
+        boundaries from the cache, computing and caching it if not found.
+        """
+        cache_path = (
+            Path(cache_folder).expanduser()
+            / f"baseline_adm{admin_level}_{baseline_version}_{engine.version}.npz"  # noqa: E501
+        )
+        if cache_path.exists():
+            return cls.load(cache_path)
+        logger.info(
+            f"Computing admin {admin_level} zonal stats of {baseline_version}"
+        )
+        baseline_stats = cls.from_baseline(engine, da_baseline)
+        baseline_stats.save(cache_path)
+        return baseline_stats
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            matrix=self.matrix,
+            doys=self.doys,
+            iso3=self.units["iso3"].to_numpy(dtype=str),
+            pcode=self.units["pcode"].to_numpy(dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            units = pd.DataFrame({"iso3": npz["iso3"], "pcode": npz["pcode"]})
+            return cls(npz["matrix"], units, npz["doys"])
+
+    def lookup(self, doys=None):
+        """
+        Baseline per unit and day of year, in the layout of
+        `pg.fs_rolling_11_day_mean`.
+
+        Parameters
+        ----------
+        doys : list of int, optional
+            Days of year to return. Defaults to all. Days of year missing
+            from the baseline are left out with a warning.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns iso3, pcode, doy and sfed_baseline.
+        """
+        columns = np.arange(len(self.doys))
+        if doys is not None:
+            doys = np.unique(doys)
+            order = np.argsort(self.doys)
+            positions = np.searchsorted(self.doys, doys, sorter=order)
+            columns = order[np.minimum(positions, len(order) - 1)]
+            found = self.doys[columns] == doys
+            if not found.all():
+                logger.warning(
+                    f"Days of year {doys[~found].tolist()} are not in the "
+                    "baseline, leaving them out"
+                )
+            columns = columns[found]
+        df = pd.concat([self.units] * len(columns), ignore_index=True)
+        df["doy"] = np.repeat(self.doys[columns], len(self.units))
+        df["sfed_baseline"] = self.matrix[:, columns].T.ravel()
+        return df
@@ -0,0 +1,142 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import pytest
+
+import backfill
+from src.utils import checkpoints
+from src.utils.checkpoints import fingerprint
+from src.utils.ledger import DateLedger
+from src.utils.storage import MemoryStorage
+
+PREFIX = "floodscan/daily/v5/processed/aer_area_300s_v"
+SUFFIX = "_v05r01.tif"
+
+
+class SynchronousExecutor:
+    """Runs each submitted call straight away, in place of the process
+    pool."""
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+
+def days(start, n):
+    return [start + timedelta(days=i) for i in range(n)]
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    """Dates run by process_date, which fails for the 3rd of the month."""
+    dates = []
+
+    def process_date(date, blob):
+        if date.day == 3:
+            raise RuntimeError("corrupt blob")
+        dates.append(date)
+
+    monkeypatch.setattr(backfill, "process_date", process_date)
+    return dates
+
+
+def run(ledger, blobs, fingerprints, shard_days=2):
+    todo, shards = backfill.plan_shards(
+        blobs, fingerprints, ledger, shard_days
+    )
+    failed = backfill.run_shards(
+        SynchronousExecutor(), shards, ledger, fingerprints, blobs
+    )
+    return todo, shards, failed
+
+
+def test_shards_of_an_inclusive_range():
+    storage = MemoryStorage()
+    for date in days(datetime(2024, 1, 28), 10):
+        storage.write("floodscan", f"{PREFIX}{date:%Y-%m-%d}{SUFFIX}", b"")
+
+    blobs = backfill.list_blobs(
+        storage,
+        "floodscan",
+        PREFIX,
+        SUFFIX,
+        datetime(2024, 1, 30),
+        datetime(2024, 2, 3),
+    )
+    todo, shards = backfill.plan_shards(
+        blobs, {date: "fp" for date in blobs}, DateLedger("missing"), 2
+    )
+
+    assert todo == days(datetime(2024, 1, 30), 5)
+    assert [[date.day for date, _ in shard] for shard in shards] == [
+        [30, 31],
+        [1, 2],
+        [3],
+    ]
+    assert shards[0][0][1] == f"{PREFIX}2024-01-30{SUFFIX}"
+
+
+def test_second_run_skips_the_days_done(tmp_path, processed):
+    blobs = {date: f"{date:%Y%m%d}" for date in days(datetime(2024, 5, 1), 5)}
+    fingerprints = {date: "fp" for date in blobs}
+
+    _, _, failed = run(
+        DateLedger(tmp_path / "ledger.jsonl"), blobs, fingerprints
+    )
+    assert failed == {"2024-05-03": "RuntimeError: corrupt blob"}
+    assert [date.day for date in processed] == [1, 2, 4, 5]
+
+    processed.clear()
+    ledger = DateLedger(tmp_path / "ledger.jsonl")
+    todo, shards, failed = run(ledger, blobs, fingerprints)
+    # Only the failed day is tried again
+    assert todo == [datetime(2024, 5, 3)]
+    assert processed == []
+    assert len(ledger) == 4
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    ledger = DateLedger(path)
+    ledger.record(datetime(2024, 5, 1), "fp", blob="a")
+    ledger.record(datetime(2024, 5, 2), "fp", blob="b")
+    # A crash in the middle of writing the next line
+    with open(path, "a") as f:
+        f.write('{"date": "2024-05-03", "finger')
+
+    ledger = DateLedger(path)
+
+    assert len(ledger) == 2
+    assert ledger.done(datetime(2024, 5, 2), "fp")
+    assert not ledger.done(datetime(2024, 5, 3), "fp")
+    # New lines still append after the broken one
+    ledger.record(datetime(2024, 5, 3), "fp")
+    assert DateLedger(path).done(datetime(2024, 5, 3), "fp")
+
+
+def test_changed_inputs_run_again(tmp_path, processed, monkeypatch):
+    blobs = {date: f"{date:%Y%m%d}" for date in days(datetime(2024, 5, 4), 2)}
+    fingerprints = {
+        date: fingerprint(blob, '"etag1"') for date, blob in blobs.items()
+    }
+    run(DateLedger(tmp_path / "ledger.jsonl"), blobs, fingerprints)
+
+    # A new ETag for one blob
+    changed = dict(fingerprints)
+    changed[datetime(2024, 5, 5)] = fingerprint("20240505", '"etag2"')
+    todo, _, _ = run(DateLedger(tmp_path / "ledger.jsonl"), blobs, changed)
+    assert todo == [datetime(2024, 5, 5)]
+
+    # A new checkpoint version invalidates every day
+    monkeypatch.setattr(
+        checkpoints, "CHECKPOINT_VERSION", checkpoints.CHECKPOINT_VERSION + 1
+    )
+    bumped = {
+        date: fingerprint(blob, '"etag1"') for date, blob in blobs.items()
+    }
+    todo, _, _ = run(DateLedger(tmp_path / "ledger.jsonl"), blobs, bumped)
+    assert todo == sorted(blobs)
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+
+from src.utils.blob_catalogue import BlobCatalogue
+from src.utils.storage import MemoryStorage
+
+PREFIX = "floodscan/daily/v5/processed/aer_area_300s_v"
+SUFFIX = "_v05r01.tif"
+
+
+def blob_name(date):
+    return f"{PREFIX}{date:%Y-%m-%d}{SUFFIX}"
+
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    for day in (1, 2, 3):
+        storage.write("floodscan", blob_name(datetime(2024, 5, day)), b"")
+    return storage
+
+
+def catalogue(storage):
+    return BlobCatalogue(storage, "floodscan", PREFIX, SUFFIX)
+
+
+def test_only_exact_names_are_catalogued(storage):
+    storage.write(
+        "floodscan", blob_name(datetime(2024, 5, 3)) + ".aux.xml", b""
+    )
+    storage.write("floodscan", f"{PREFIX}2024-05-04_v06r01.tif", b"")
+    cat = catalogue(storage)
+    cat.refresh(end_date=datetime(2024, 5, 31))
+    assert cat.dates == [datetime(2024, 5, day) for day in (1, 2, 3)]
+    assert cat.blob_name(datetime(2024, 5, 3)) == blob_name(
+        datetime(2024, 5, 3)
+    )
+
+
+def test_saved_catalogue_picks_up_late_days_and_deletions(tmp_path, storage):
+    path = tmp_path / "catalogue.json"
+    cat = catalogue(storage)
+    cat.refresh(end_date=datetime(2024, 6, 30))
+    cat.save(path)
+
+    # A late day of an earlier month, a deleted day and a new day
+    storage.write("floodscan", blob_name(datetime(2024, 4, 30)), b"")
+    del storage.blobs[("floodscan", blob_name(datetime(2024, 5, 2)))]
+    storage.write("floodscan", blob_name(datetime(2024, 6, 1)), b"")
+
+    cat = catalogue(storage)
+    assert cat.load(path)
+    assert cat.refresh(end_date=datetime(2024, 6, 30)) == 2
+    assert cat.dates == [
+        datetime(2024, 4, 30),
+        datetime(2024, 5, 1),
+        datetime(2024, 5, 3),
+        datetime(2024, 6, 1),
+    ]
+
+
+def test_catalogue_of_another_suffix_is_not_loaded(tmp_path, storage):
+    path = tmp_path / "catalogue.json"
+    cat = catalogue(storage)
+    cat.refresh(end_date=datetime(2024, 5, 31))
+    cat.save(path)
+    assert not BlobCatalogue(storage, "floodscan", PREFIX, ".tif").load(path)
@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import hmac
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+import requests
+
+from src.utils.blob_download import BlobDownloadClient, shared_key_signature
+
+ACCOUNT = "testaccount"
+KEY = base64.b64encode(b"test key").decode()
+
+
+def string_to_sign(verb, headers, resource):
+    """SharedKey string-to-sign of a Blob Storage request, as documented."""
+    lines = [
+        verb,
+        headers.get("Content-Encoding", ""),
+        headers.get("Content-Language", ""),
+        headers.get("Content-Length", ""),
+        headers.get("Content-MD5", ""),
+        headers.get("Content-Type", ""),
+        headers.get("Date", ""),
+        headers.get("If-Modified-Since", ""),
+        headers.get("If-Match", ""),
+        headers.get("If-None-Match", ""),
+        headers.get("If-Unmodified-Since", ""),
+        headers.get("Range", ""),
+    ]
+    ms_headers = sorted(
+        (name.lower(), value)
+        for name, value in headers.items()
+        if name.lower().startswith("x-ms-")
+    )
+    lines += [f"{name}:{value}" for name, value in ms_headers]
+    return "\n".join(lines + [resource])
+
+
+def expected_authorization(verb, headers, resource):
+    digest = hmac.new(
+        base64.b64decode(KEY),
+        string_to_sign(verb, headers, resource).encode(),
+        hashlib.sha256,
+    ).digest()
+    return f"SharedKey {ACCOUNT}:{base64.b64encode(digest).decode()}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, headers=None, body=b""):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command == "GET":
+            self.wfile.write(body)
+
+    def _respond(self):
+        server = self.server
+        resource = f"/{ACCOUNT}{unquote(self.path)}"
+        headers = dict(self.headers.items())
+        if headers.get("Authorization") != expected_authorization(
+            self.command, headers, resource
+        ):
+            self._send(403)
+            return
+        with server.lock:
+            server.requests.append((self.command, headers))
+            data, etag = server.data, server.etag
+            if self.command == "GET" and server.on_get:
+                server.on_get(server)
+        if headers.get("If-Match", etag) != etag:
+            self._send(412)
+            return
+        if headers.get("If-None-Match") == etag:
+            self._send(304, {"ETag": etag})
+            return
+        response_headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        byte_range = headers.get("x-ms-range")
+        if byte_range:
+            first, last = byte_range.split("=")[1].split("-")
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+            response_headers["Content-Range"] = (
+                f"bytes {first}-{end}/{len(data)}"
+            )
+            self._send(206, response_headers, data[int(first) : end + 1])
+            return
+        response_headers["Content-MD5"] = server.content_md5 or (
+            base64.b64encode(hashlib.md5(data).digest()).decode()
+        )
+        if self.command == "HEAD":
+            # The size of the blob, without a body
+            self.send_response(200)
+            for name, value in response_headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            return
+        self._send(200, response_headers, data)
+
+    do_GET = do_HEAD = _respond
+
+
+class RangeServer(ThreadingHTTPServer):
+    """Blob service serving one blob, checking SharedKey signatures."""
+
+    daemon_threads = True
+
+    def __init__(self, data):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.data = data
+        self.etag = '"v1"'
+        self.content_md5 = None
+        self.on_get = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@pytest.fixture
+def data():
+    return bytes(range(256)) * 1000
+
+
+@pytest.fixture
+def server(data):
+    server = RangeServer(data)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    with BlobDownloadClient(
+        ACCOUNT, KEY, endpoint=server.url, max_workers=4, chunk_size=64_000
+    ) as client:
+        yield client
+
+
+def test_shared_key_signature():
+    headers = {
+        "If-Match": '"v1"',
+        "x-ms-version": "2018-03-28",
+        "x-ms-date": "Mon, 01 Jan 2024 00:00:00 GMT",
+        "x-ms-range": "bytes=0-9",
+    }
+    assert shared_key_signature(
+        KEY, ACCOUNT, "GET", "floodscan", "daily/a.tif", headers
+    ) == expected_authorization(
+        "GET", headers, f"/{ACCOUNT}/floodscan/daily/a.tif"
+    )
+
+
+def test_download_in_ranges(server, client, data, tmp_path):
+    path = tmp_path / "blob.tif"
+    properties = client.download("floodscan", "daily/a.tif", path)
+
+    assert path.read_bytes() == data
+    assert properties["etag"] == '"v1"'
+    ranges = sorted(
+        headers["x-ms-range"]
+        for verb, headers in server.requests
+        if verb == "GET"
+    )
+    assert len(ranges) == 4
+    assert all(
+        headers.get("If-Match") == '"v1"'
+        for verb, headers in server.requests
+        if verb == "GET"
+    )
+
+
+def test_small_blob_in_one_get(server, data, tmp_path):
+    with BlobDownloadClient(
+        ACCOUNT, KEY, endpoint=server.url, chunk_size=len(data)
+    ) as client:
+        client.download("floodscan", "daily/a.tif", tmp_path / "blob.tif")
+    gets = [headers for verb, headers in server.requests if verb == "GET"]
+    assert len(gets) == 1 and "x-ms-range" not in gets[0]
+
+
+def test_changed_blob_fails_the_if_match(server, client, tmp_path):
+    def change_blob(server):
+        server.data = server.data[::-1]
+        server.etag = '"v2"'
+
+    server.on_get = change_blob
+    path = tmp_path / "blob.tif"
+    with pytest.raises(requests.HTTPError) as err:
+        client.download("floodscan", "daily/a.tif", path)
+    assert err.value.response.status_code == 412
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_content_md5_mismatch(server, client, tmp_path):
+    server.content_md5 = base64.b64encode(hashlib.md5(b"").digest()).decode()
+    path = tmp_path / "blob.tif"
+    with pytest.raises(IOError, match="Content-MD5 mismatch"):
+        client.download("floodscan", "daily/a.tif", path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_not_modified_is_not_downloaded(server, client, tmp_path):
+    properties = client.download(
+        "floodscan", "daily/a.tif", tmp_path / "blob.tif", if_none_match='"v1"'
+    )
+    assert properties["not_modified"] and properties["path"] is None
+    assert [verb for verb, headers in server.requests] == ["HEAD"]
@@ -0,0 +1,104 @@
+import base64
+import io
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from src.utils.storage import BlockBlobWriter
+from src.utils.tabular_utils import write_parquet
+
+
+class FakeBlobClient:
+    """Records the staged blocks and the committed block list, staging
+    slowly so that blocks overlap."""
+
+    def __init__(self, delay=0.01, fail_block=None):
+        self.delay = delay
+        self.fail_block = fail_block
+        self.blocks = {}
+        self.committed = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def stage_block(self, block_id, data):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if len(self.blocks) == self.fail_block:
+                raise IOError("stage failed")
+            with self._lock:
+                self.blocks[block_id] = bytes(data)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def commit_block_list(self, block_ids):
+        self.committed = list(block_ids)
+
+    def content(self):
+        return b"".join(self.blocks[block_id] for block_id in self.committed)
+
+
+def test_blocks_are_committed_in_write_order():
+    client = FakeBlobClient()
+    writer = BlockBlobWriter(client, block_size=10, max_workers=3)
+    data = bytes(range(256)) * 2
+    for start in range(0, len(data), 7):
+        writer.write(data[start : start + 7])
+    writer.commit()
+
+    ids = client.committed
+    assert len(ids) == len(client.blocks) == 52
+    assert len(set(ids)) == len(ids)
+    assert len({len(block_id) for block_id in ids}) == 1
+    assert [int(base64.b64decode(block_id)) for block_id in ids] == list(
+        range(52)
+    )
+    assert client.content() == data
+    assert 1 < client.max_in_flight <= 3
+
+
+def test_empty_blob_commits_one_block():
+    client = FakeBlobClient()
+    BlockBlobWriter(client, block_size=10).commit()
+    assert client.content() == b""
+
+
+def test_failed_block_fails_the_commit():
+    client = FakeBlobClient(delay=0, fail_block=2)
+    writer = BlockBlobWriter(client, block_size=4, max_workers=1)
+    with pytest.raises(IOError, match="stage failed"):
+        writer.write(bytes(40))
+        writer.commit()
+    assert client.committed is None
+
+
+def test_parquet_streamed_through_blocks():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "iso3": rng.choice(["AFG", "SOM", "SSD"], 2500),
+            "pcode": [f"P{i:05d}" for i in range(2500)],
+            "valid_date": pd.date_range("2024-01-01", periods=2500, freq="h"),
+            "value": rng.random(2500),
+        }
+    )
+    client = FakeBlobClient(delay=0.001)
+    writer = BlockBlobWriter(client, block_size=4096, max_workers=4)
+
+    n_groups = write_parquet(df, writer, row_group_size=1000)
+    writer.commit()
+
+    assert n_groups == 3
+    assert len(client.committed) > 1
+    content = io.BytesIO(client.content())
+    assert pq.ParquetFile(content).num_row_groups == 3
+    content.seek(0)
+    pd.testing.assert_frame_equal(pd.read_parquet(content), df)
@@ -0,0 +1,58 @@
+from datetime import date
+
+from src.utils import checkpoints
+from src.utils.checkpoints import CheckpointStore, fingerprint
+
+
+def test_fingerprint_depends_on_inputs_and_version(monkeypatch):
+    inputs = ("blob.tif", '"etag"', date(2024, 5, 1), {"b": 1, "a": 2})
+    assert fingerprint(*inputs) == fingerprint(
+        "blob.tif", '"etag"', date(2024, 5, 1), {"a": 2, "b": 1}
+    )
+    assert fingerprint(*inputs) != fingerprint("blob.tif", '"other"')
+    before = fingerprint(*inputs)
+    monkeypatch.setattr(
+        checkpoints, "CHECKPOINT_VERSION", checkpoints.CHECKPOINT_VERSION + 1
+    )
+    assert fingerprint(*inputs) != before
+
+
+def test_checkpoint_is_only_used_with_its_fingerprint(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoints")
+    source = tmp_path / "day.tif"
+    source.write_bytes(b"merged day")
+
+    path = store.save("cog_2024-05-01", "abc", source)
+
+    assert store.lookup("cog_2024-05-01", "abc") == path
+    assert store.lookup("cog_2024-05-01", "def") is None
+    assert store.latest("cog_2024-05-01") == path
+    assert source.exists()
+
+    # A checkpoint cut short is not trusted
+    path.write_bytes(b"merged")
+    assert store.lookup("cog_2024-05-01", "abc") is None
+
+
+def test_prune_keeps_the_listed_checkpoints(tmp_path):
+    store = CheckpointStore(tmp_path)
+    source = tmp_path / "source"
+    for name in ("cog_1", "cog_2", "cog_3", "zip"):
+        source.write_bytes(name.encode())
+        store.save(name, name, source)
+
+    store.prune("cog_", keep=["cog_2"])
+
+    assert store.latest("cog_1") is None
+    assert store.latest("cog_3") is None
+    assert store.lookup("cog_2", "cog_2") is not None
+    assert store.lookup("zip", "zip") is not None
+
+
+def test_disabled_store(tmp_path):
+    store = CheckpointStore()
+    source = tmp_path / "source"
+    source.write_bytes(b"data")
+
+    assert store.save("zip", "abc", source) == source
+    assert store.lookup("zip", "abc") is None
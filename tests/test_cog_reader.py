@@ -0,0 +1,118 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+import rasterio
+from affine import Affine
+from rasterio.windows import Window
+
+from benchmarks.stand_ins import BlobServer
+from src.utils.cog_reader import CogReader, pixel_window
+
+# 64 x 128 cells of 1 degree, top left at (0, 64)
+TRANSFORM = Affine(1, 0, 0, 0, -1, 64)
+SHAPE = (64, 128)
+BANDS = ("SFED", "SFED_BASELINE", "SFED_RP")
+DATES = [datetime(2024, 5, day) for day in (1, 2, 3)]
+
+
+def band_values(date, band):
+    """Values of a band of a day: every cell is distinct."""
+    rows, cols = np.indices(SHAPE)
+    return (date.day * 1000 + band * 100 + rows + cols / 1000).astype(
+        np.float32
+    )
+
+
+def write_cog(path, date):
+    with rasterio.open(
+        path,
+        "w",
+        driver="COG",
+        height=SHAPE[0],
+        width=SHAPE[1],
+        count=len(BANDS),
+        dtype="float32",
+        crs="EPSG:4326",
+        transform=TRANSFORM,
+        blocksize=16,
+    ) as dst:
+        for i, name in enumerate(BANDS, start=1):
+            dst.write(band_values(date, i), i)
+            dst.set_band_description(i, name)
+
+
+@pytest.fixture(scope="module")
+def reader(tmp_path_factory):
+    root = tmp_path_factory.mktemp("blobs")
+    (root / "cogs").mkdir()
+    for date in DATES:
+        write_cog(root / "cogs" / f"{date:%Y-%m-%d}.tif", date)
+    with BlobServer(root) as server:
+        yield CogReader(
+            lambda date: f"/vsicurl/{server.url}/cogs/{date:%Y-%m-%d}.tif"
+        )
+
+
+def test_read_window_and_band(reader):
+    # Rows 14 to 19 and columns 10 to 15
+    da = reader.read(DATES[0], bbox=(10.2, 44.5, 15.5, 49.9), band=2)
+
+    assert da.sizes == {"band": 1, "y": 6, "x": 6}
+    assert da.attrs["long_name"] == ["SFED_BASELINE"]
+    np.testing.assert_array_equal(
+        da.values[0], band_values(DATES[0], 2)[14:20, 10:16]
+    )
+    np.testing.assert_array_equal(da["x"], np.arange(10, 16) + 0.5)
+    np.testing.assert_array_equal(da["y"], 64 - np.arange(14, 20) - 0.5)
+
+
+def test_read_many_bands_by_name(reader):
+    bbox = (100, 0, 128, 3)
+    da = reader.read_many(DATES[::-1], bbox=bbox, band=["SFED_RP", "SFED"])
+
+    assert da.dims == ("date", "band", "y", "x")
+    assert list(da["date"].values) == list(np.array(DATES, "datetime64[ns]"))
+    assert da["band"].values.tolist() == [3, 1]
+    for i, date in enumerate(DATES):
+        np.testing.assert_array_equal(
+            da.values[i, 0], band_values(date, 3)[61:64, 100:128]
+        )
+        np.testing.assert_array_equal(
+            da.values[i, 1], band_values(date, 1)[61:64, 100:128]
+        )
+
+
+def test_bbox_partly_outside_is_clipped(reader):
+    da = reader.read(DATES[0], bbox=(120.5, 60.5, 140, 80), band="SFED")
+
+    np.testing.assert_array_equal(
+        da.values[0], band_values(DATES[0], 1)[0:4, 120:128]
+    )
+
+
+def test_bbox_outside_the_raster(reader):
+    with pytest.raises(ValueError, match="outside the raster"):
+        reader.read(DATES[0], bbox=(-50, -50, -40, -40))
+
+
+def test_unknown_band(reader):
+    with pytest.raises(ValueError, match="Band SFED_MAX"):
+        reader.read(DATES[0], bbox=(0, 0, 1, 1), band="SFED_MAX")
+
+
+@pytest.mark.parametrize(
+    "bbox, window",
+    [
+        # Edges on cell boundaries take no extra cells
+        ((2, 60, 5, 62), Window(2, 2, 3, 2)),
+        # Partial cells are taken whole
+        ((2.5, 60.5, 4.5, 61.5), Window(2, 2, 3, 2)),
+        # Floating point noise on a boundary does not add a cell
+        ((2 + 1e-9, 60, 5 - 1e-9, 62), Window(2, 2, 3, 2)),
+        # Clipped to the raster
+        ((-3, 62, 2, 70), Window(0, 0, 2, 2)),
+    ],
+)
+def test_pixel_window_rounding(bbox, window):
+    assert pixel_window(bbox, TRANSFORM, *SHAPE[::-1]) == window
@@ -0,0 +1,45 @@
+import dask
+import dask.array as da
+import pytest
+
+from src.utils.dask_utils import dask_execution, dask_performance_report
+
+
+@pytest.mark.parametrize("scheduler", ["threads", "synchronous"])
+def test_local_schedulers(scheduler):
+    with dask_execution(scheduler, n_workers=2) as client:
+        assert client is None
+        assert dask.config.get("scheduler") == scheduler
+        assert dask.config.get("num_workers") == 2
+        assert da.ones(10, chunks=5).sum().compute() == 10
+        # Without a cluster there is no report to save
+        with dask_performance_report("report.html"):
+            pass
+
+
+def test_unknown_scheduler():
+    with pytest.raises(ValueError, match="Invalid dask scheduler"):
+        with dask_execution("cluster"):
+            pass
+
+
+def test_distributed_cluster():
+    pytest.importorskip("distributed")
+    with dask_execution(
+        "distributed", n_workers=1, threads_per_worker=2, memory_limit="1GB"
+    ) as client:
+        workers = client.scheduler_info()["workers"].values()
+        assert [w["nthreads"] for w in workers] == [2]
+        assert [w["memory_limit"] for w in workers] == [10**9]
+        assert da.ones(10, chunks=5).sum().compute() == 10
+
+
+def test_performance_report(tmp_path):
+    pytest.importorskip("distributed")
+    # The report is rendered with bokeh
+    pytest.importorskip("bokeh")
+    report = tmp_path / "report.html"
+    with dask_execution("distributed", n_workers=1, threads_per_worker=1):
+        with dask_performance_report(report):
+            assert da.ones(10, chunks=5).sum().compute() == 10
+    assert report.stat().st_size > 0
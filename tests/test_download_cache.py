@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from run import AzureBlobDownload
+from src.utils.download_cache import DownloadCache
+from src.utils.storage import LocalStorage
+
+
+def test_concurrent_downloads_of_a_blob_through_the_cache(tmp_path):
+    data = os.urandom(300_000)
+    (tmp_path / "blobs" / "raster").mkdir(parents=True)
+    (tmp_path / "blobs" / "raster" / "day.tif").write_bytes(data)
+    cache = DownloadCache(tmp_path / "cache")
+    storage = LocalStorage(tmp_path / "blobs")
+
+    downloader = AzureBlobDownload(
+        cache=cache, storage=storage, user_agent="test"
+    )
+
+    def download(i):
+        return downloader.download_file(
+            url="day.tif",
+            account="account",
+            container="raster",
+            key="key",
+            blob="day.tif",
+            path=tmp_path / "out" / f"{i}.tif",
+        )
+
+    with downloader, ThreadPoolExecutor(8) as executor:
+        paths = list(executor.map(download, range(16)))
+
+    assert all(open(path, "rb").read() == data for path in paths)
+    assert cache.lookup("raster", "day.tif")["path"].read_bytes() == data
+    assert list(cache.staging_folder.iterdir()) == []
+
+
+def test_staging_paths_are_unique(tmp_path):
+    cache = DownloadCache(tmp_path)
+    assert cache.staging_path("raster", "day.tif") != cache.staging_path(
+        "raster", "day.tif"
+    )
+
+
+def test_local_download_honours_if_modified_since(tmp_path):
+    (tmp_path / "raster").mkdir()
+    (tmp_path / "raster" / "day.tif").write_bytes(b"data")
+    storage = LocalStorage(tmp_path)
+    info = storage.stat("raster", "day.tif")
+
+    assert (
+        storage.download(
+            "raster",
+            "day.tif",
+            tmp_path / "out.tif",
+            if_modified_since=info.last_modified,
+        )
+        is None
+    )
+    assert not (tmp_path / "out.tif").exists()
+    assert storage.download(
+        "raster",
+        "day.tif",
+        tmp_path / "out.tif",
+        if_none_match='"other"',
+        if_modified_since=info.last_modified,
+    )
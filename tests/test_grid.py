@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import xarray as xr
+from affine import Affine
+
+from src.utils.grid import FloodscanGrid, GridMismatchError
+
+GRID = FloodscanGrid(
+    shape=(4, 8), transform=Affine(1, 0, 0, 0, -1, 4), chunks=(2, 4)
+)
+
+
+def raster(lat, lon):
+    return xr.DataArray(
+        np.arange(len(lat) * len(lon), dtype=np.float32).reshape(
+            len(lat), len(lon)
+        ),
+        coords={"lat": lat, "lon": lon},
+        dims=("lat", "lon"),
+    )
+
+
+def test_snap_puts_a_south_up_window_on_the_grid():
+    # Rows 1 and 2, columns 2 to 5, south up and off by a few last bits
+    da = raster([1.5 + 1e-9, 2.5], [2.5, 3.5 - 1e-9, 4.5, 5.5])
+
+    snapped = GRID.snap(da)
+
+    assert snapped.dims == ("y", "x")
+    np.testing.assert_array_equal(snapped["y"], GRID.y[1:3])
+    np.testing.assert_array_equal(snapped["x"], GRID.x[2:6])
+    np.testing.assert_array_equal(snapped.values, da.values[::-1])
+    assert snapped.rio.transform() == Affine(1, 0, 2, 0, -1, 3)
+
+
+def test_snapped_rasters_merge_exactly():
+    full = raster(GRID.y[::-1], GRID.x)
+    a = GRID.snap(full, full=True).rename("a")
+    b = GRID.snap(full.assign_coords(lon=GRID.x + 1e-9), full=True)
+
+    merged = xr.merge([a, b.rename("b")], join="exact")
+
+    assert merged.sizes == {"y": 4, "x": 8}
+
+
+@pytest.mark.parametrize(
+    "lat, lon",
+    [
+        ([1.5, 2.5], [2.0, 3.0]),  # cell edges, not centres
+        ([1.5, 3.5], [2.5, 3.5]),  # a missing row
+        ([1.5, 2.5], [7.5, 8.5]),  # beyond the grid
+    ],
+)
+def test_rasters_off_the_grid_are_rejected(lat, lon):
+    with pytest.raises(GridMismatchError):
+        GRID.snap(raster(lat, lon))
+
+
+def test_full_requires_the_whole_grid():
+    with pytest.raises(GridMismatchError, match="does not cover"):
+        GRID.snap(raster([1.5, 2.5], [2.5, 3.5]), full=True)
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from src.utils.instrumentation import Instrumentation
+
+
+def test_nested_stages_and_counts_are_written(tmp_path):
+    instrumentation = Instrumentation(sample_interval=0.01)
+    with instrumentation.stage("get_data", files=3) as outer:
+        with instrumentation.stage("zonal_stats_adm1") as inner:
+            inner.update(rows=120, units=40)
+        with instrumentation.stage("excel_write") as inner:
+            inner["rows"] = 200
+        outer.update(files=4, datasets=1)
+
+    path = instrumentation.write_json(tmp_path / "metrics" / "run.json")
+    summary = json.loads(path.read_text())
+
+    # stages are recorded as they end, so inner stages come first
+    stages = {record["stage"]: record for record in summary["stages"]}
+    assert [record["stage"] for record in summary["stages"]] == [
+        "zonal_stats_adm1",
+        "excel_write",
+        "get_data",
+    ]
+    assert stages["zonal_stats_adm1"]["rows"] == 120
+    assert stages["zonal_stats_adm1"]["units"] == 40
+    assert stages["excel_write"]["rows"] == 200
+    assert stages["get_data"]["files"] == 4
+    assert stages["get_data"]["datasets"] == 1
+
+    outer = stages["get_data"]
+    for name in ("zonal_stats_adm1", "excel_write"):
+        inner = stages[name]
+        assert inner["start_s"] >= outer["start_s"]
+        assert (
+            inner["start_s"] + inner["wall_s"]
+            <= outer["start_s"] + outer["wall_s"] + 0.001
+        )
+        assert inner["peak_rss_bytes"] > 0
+        assert "failed" not in inner
+    assert stages["excel_write"]["start_s"] >= (
+        stages["zonal_stats_adm1"]["start_s"]
+    )
+
+
+def test_failed_stage_is_recorded(tmp_path):
+    instrumentation = Instrumentation(sample_interval=0.01)
+    with pytest.raises(ValueError):
+        with instrumentation.stage("get_data"):
+            with instrumentation.stage("download") as stage:
+                stage.update(files=2)
+                raise ValueError("no blobs")
+
+    summary = json.loads(
+        instrumentation.write_json(tmp_path / "run.json").read_text()
+    )
+    assert [
+        (record["stage"], record["failed"], record.get("files"))
+        for record in summary["stages"]
+    ] == [("download", True, 2), ("get_data", True, None)]
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.utils import preflight
+from src.utils.storage import MemoryStorage
+
+CONFIGURATION = {
+    "account": "account",
+    "container": "floodscan",
+    "key": "key",
+    "daily_blob_prefix": "floodscan/daily/v5/processed/aer_area_300s_v",
+    "daily_blob_suffix": "_v05r01.tif",
+    "baseline_filename": "floodscan/daily/v5/raw/baseline_v05r01.nc4",
+}
+
+
+def add_day(storage, date):
+    blob = (
+        f"{CONFIGURATION['daily_blob_prefix']}{date:%Y-%m-%d}"
+        f"{CONFIGURATION['daily_blob_suffix']}"
+    )
+    storage.write("floodscan", blob, b"")
+
+
+@pytest.fixture
+def configuration(tmp_path, monkeypatch):
+    for name in ("STORAGE_ACCOUNT", "CONTAINER", "KEY"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.delenv("FLOODSCAN_PUBLISH_STATE", raising=False)
+    return {
+        **CONFIGURATION,
+        "publish_state": {"file": str(tmp_path / "state.json")},
+    }
+
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    today = datetime.today()
+    for days in (3, 2):
+        add_day(storage, today - timedelta(days=days))
+    storage.write("floodscan", CONFIGURATION["baseline_filename"], b"v1")
+    return storage
+
+
+def publish(configuration, storage):
+    new_data, versions = preflight.check(configuration, storage)
+    preflight.save_state(preflight.state_file(configuration), versions)
+    return new_data
+
+
+def test_nothing_new_after_a_publish(configuration, storage):
+    assert publish(configuration, storage)
+    assert preflight.check(configuration, storage)[0] is False
+
+
+def test_a_new_day_is_new_data(configuration, storage):
+    publish(configuration, storage)
+    add_day(storage, datetime.today() - timedelta(days=1))
+
+    new_data, versions = preflight.check(configuration, storage)
+
+    assert new_data
+    assert versions["latest_date"] == (
+        datetime.today() - timedelta(days=1)
+    ).strftime("%Y-%m-%d")
+
+
+def test_a_new_baseline_is_new_data(configuration, storage):
+    publish(configuration, storage)
+    storage.write("floodscan", CONFIGURATION["baseline_filename"], b"v2")
+
+    assert preflight.check(configuration, storage)[0]
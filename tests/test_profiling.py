@@ -0,0 +1,41 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils.profiling import Profiler
+
+
+def busy(n=20_000):
+    return sum(i * i for i in range(n))
+
+
+@pytest.mark.parametrize("mode", ["cprofile", "both"])
+def test_threaded_stages_run_under_an_outer_stage(tmp_path, mode):
+    profiler = Profiler(mode, tmp_path, interval=0.001)
+    wrapped = profiler.wrap(busy, "zonal")
+    start = threading.Barrier(2)
+
+    def call():
+        start.wait()
+        return wrapped()
+
+    with profiler.stage("get_data"):
+        with ThreadPoolExecutor(2) as pool:
+            results = [f.result() for f in [pool.submit(call) for _ in "ab"]]
+
+    assert results == [busy()] * 2
+    assert (tmp_path / "get_data.prof").exists()
+    # get_data owns cProfile, so the threaded stages are only sampled, each
+    # to its own file
+    zonal = sorted(p.name for p in tmp_path.iterdir() if "zonal" in p.name)
+    if mode == "both":
+        assert zonal == ["zonal.collapsed", "zonal_2.collapsed"]
+    else:
+        assert zonal == []
+    assert len(profiler.files) == len(set(profiler.files))
+
+    # cProfile is free again once the outer stage has ended
+    with profiler.stage("after"):
+        busy()
+    assert (tmp_path / "after.prof").exists()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from src.utils.quantize import Quantizer, load_quantizer
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16"])
+def test_encode_decode_round_trip(dtype):
+    quantizer = Quantizer(dtype)
+    values = np.linspace(0, 1, 1001, dtype=np.float32)
+    values[::100] = np.nan
+    da = xr.DataArray(values)
+
+    stored = quantizer.encode(da)
+    decoded = quantizer.decode(stored)
+
+    assert stored.dtype == np.dtype(dtype)
+    assert (stored.values[::100] == quantizer.nodata).all()
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(np.isnan(decoded), np.isnan(values))
+    valid = ~np.isnan(values)
+    assert np.abs(decoded - values)[valid].max() <= quantizer.max_error * 1.01
+
+
+def test_out_of_range_values_are_clipped():
+    quantizer = Quantizer("uint8")
+    stored = quantizer.encode(xr.DataArray([-0.5, 1.5]))
+
+    assert stored.values.tolist() == [0, quantizer.nodata - 1]
+    assert quantizer.decode(stored).values.tolist() == [0.0, 1.0]
+
+
+def test_classes_keep_their_values():
+    quantizer = Quantizer("uint8")
+    stored = quantizer.encode_classes(xr.DataArray([1.0, 8.0, np.nan]))
+
+    assert stored.values.tolist() == [1, 8, quantizer.nodata]
+    assert stored.attrs["scale_factor"] == 1.0
+
+
+def test_no_quantizer_without_a_dtype():
+    assert load_quantizer({"quantize": {"dtype": None}}) is None
+    assert load_quantizer({}) is None
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+from scipy.interpolate import interp1d
+
+from src.utils.return_periods import empirical_rp
+from src.utils.rp_raster import empirical_rp_grid
+
+
+def reference_rp(maxima, value):
+    """Return period of a value the way fs_add_rp computes it for one
+    admin unit: empirical_rp of the maxima, then interp1d."""
+    df_rps = empirical_rp(pd.DataFrame({"value": maxima}))
+    interp = interp1d(
+        df_rps["value"],
+        df_rps["RP"],
+        bounds_error=False,
+        fill_value=(1, np.inf),
+    )
+    return float(interp(value))
+
+
+def test_empirical_rp_grid_matches_empirical_rp():
+    rng = np.random.default_rng(42)
+    n_years, shape = 15, (4, 5)
+    maxima = rng.random((n_years, *shape))
+    # Values between, below, above and on the maxima of their pixel
+    values = rng.uniform(-0.1, 1.1, shape)
+    values[0, :] = maxima[3, 0, :]
+    values[1, 0] = maxima.min(axis=0)[1, 0]
+    values[1, 1] = maxima.max(axis=0)[1, 1]
+
+    rp = empirical_rp_grid(np.sort(maxima, axis=0), values)
+
+    expected = np.array(
+        [
+            [reference_rp(maxima[:, i, j], values[i, j]) for j in range(5)]
+            for i in range(4)
+        ]
+    )
+    np.testing.assert_allclose(rp, expected)
+
+
+def test_empirical_rp_grid_missing_values():
+    maxima = np.sort(np.random.default_rng(0).random((10, 2, 2)), axis=0)
+    maxima[:, 0, 0] = np.nan
+    values = np.full((2, 2), 0.5)
+    values[1, 1] = np.nan
+
+    rp = empirical_rp_grid(maxima, values)
+
+    assert np.isnan(rp[0, 0]) and np.isnan(rp[1, 1])
+    assert np.isfinite(rp[0, 1]) and np.isfinite(rp[1, 0])
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from src.utils.stage_dag import StageDAG
+
+
+class Errors:
+    def __init__(self):
+        self.messages = []
+
+    def add(self, message, category=""):
+        self.messages.append((category, message))
+
+
+def fail():
+    raise RuntimeError("no data")
+
+
+def test_failed_stage_skips_its_dependants():
+    errors = Errors()
+    stages = StageDAG(errors, category="get_data")
+    stages.add("listing", lambda: "blobs")
+    stages.add("download", fail, after=["listing"])
+    stages.add("merge", lambda: "merged", after=["download"])
+    stages.add("zip", lambda: "zip", after=["merge"])
+    stages.add("stats", lambda: "stats", after=["listing"])
+
+    results = stages.run()
+
+    assert results == {"listing": "blobs", "stats": "stats"}
+    assert list(stages.failed) == ["download"]
+    assert stages.skipped == {"merge", "zip"}
+    assert errors.messages == [("get_data", "Stage download failed: no data")]
+
+
+def test_failure_is_raised_without_errors():
+    stages = StageDAG()
+    stages.add("download", fail)
+    stages.add("stats", lambda: "stats")
+
+    with pytest.raises(RuntimeError, match="no data"):
+        stages.run()
+    assert stages.results == {"stats": "stats"}
+
+
+def test_independent_stages_overlap():
+    both_started = threading.Barrier(2, timeout=5)
+    stages = StageDAG()
+    stages.add("rasters", both_started.wait)
+    stages.add("stats", both_started.wait)
+
+    assert set(stages.run()) == {"rasters", "stats"}
+
+
+def test_circular_dependencies_are_rejected():
+    stages = StageDAG()
+    stages.add("a", lambda: None, after=["b"])
+    stages.add("b", lambda: None, after=["a"])
+
+    with pytest.raises(ValueError, match="circular"):
+        stages.run()
@@ -0,0 +1,83 @@
+import itertools
+import threading
+
+import pytest
+
+from src.utils.stream_pipeline import StreamPipeline
+
+
+def run_with_timeout(pipeline, items, sink=None, timeout=10):
+    """Run the pipeline on a thread, failing the test if it hangs."""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = pipeline.run(items, sink)
+        except BaseException as err:
+            outcome["error"] = err
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline hung"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def test_items_go_through_every_stage():
+    done = []
+    pipeline = StreamPipeline("test")
+    pipeline.add("double", lambda x: 2 * x, workers=3)
+    pipeline.add("add", lambda x: x + 1, on_done=lambda: done.append("add"))
+    out = []
+
+    assert run_with_timeout(pipeline, range(20), out.append) == 20
+    assert sorted(out) == [2 * x + 1 for x in range(20)]
+    assert done == ["add"]
+    assert pipeline.items == {"double": 20, "add": 20}
+
+
+def test_failing_sink_stops_the_producer():
+    fed = []
+
+    def produce():
+        for i in itertools.count():
+            fed.append(i)
+            yield i
+
+    def sink(item):
+        raise ValueError("disk full")
+
+    pipeline = StreamPipeline("test")
+    pipeline.add("copy", lambda x: x, workers=2, queue_size=2)
+
+    with pytest.raises(ValueError, match="disk full"):
+        run_with_timeout(pipeline, produce(), sink)
+    assert len(fed) < 100
+
+
+def test_failing_stage_stops_the_producer():
+    def merge(x):
+        if x == 3:
+            raise RuntimeError("bad raster")
+        return x
+
+    pipeline = StreamPipeline("test")
+    pipeline.add("merge", merge, workers=2)
+    pipeline.add("encode", lambda x: x)
+
+    with pytest.raises(RuntimeError, match="bad raster"):
+        run_with_timeout(pipeline, itertools.count())
+
+
+def test_failing_on_done_does_not_hang():
+    def on_done():
+        raise OSError("cannot close")
+
+    pipeline = StreamPipeline("test")
+    pipeline.add("download", lambda x: x, on_done=on_done)
+    pipeline.add("merge", lambda x: x)
+
+    with pytest.raises(OSError, match="cannot close"):
+        run_with_timeout(pipeline, range(5))
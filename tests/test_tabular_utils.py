@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+from src.utils.tabular_utils import iter_chunk_rows, write_xlsx_sheets
+
+
+def stats(n_rows):
+    return pd.DataFrame(
+        {
+            "iso3": ["AFG", "ETH", "SSD"] * (n_rows // 3),
+            "valid_date": "2024-06-01",
+            "SFED": np.linspace(0, 1, n_rows // 3 * 3),
+            "RP": [1.5, np.nan, 10.0] * (n_rows // 3),
+        }
+    )
+
+
+def write_readme(path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Readme"
+    sheet["A1"] = "FloodScan"
+    sheet["A1"].font = Font(bold=True)
+    sheet["A2"] = "Daily flood extent"
+    sheet.column_dimensions["A"].width = 120
+    workbook.save(path)
+
+
+def test_chunks_cover_every_row_and_blank_missing_values():
+    df = stats(30)
+    rows = list(iter_chunk_rows(df, chunk_size=7))
+    assert len(rows) == 30
+    assert rows[0] == ("AFG", "2024-06-01", 0.0, 1.5)
+    assert rows[1][3] is None
+
+
+def test_sheets_are_written_after_the_readme(tmp_path):
+    path = tmp_path / "floodscan_readme.xlsx"
+    write_readme(path)
+    admin1, admin2 = stats(9), stats(30)
+
+    n_rows = write_xlsx_sheets(
+        path, {"admin1": admin1, "admin2": admin2}, template=path, chunk_size=4
+    )
+    # writing again replaces the sheets instead of adding more
+    write_xlsx_sheets(
+        path, {"admin1": admin1, "admin2": admin2}, template=path, chunk_size=4
+    )
+
+    assert n_rows == 39
+    workbook = load_workbook(path)
+    assert workbook.sheetnames == ["Readme", "admin1", "admin2"]
+    readme = workbook["Readme"]
+    assert readme["A1"].value == "FloodScan"
+    assert readme["A1"].font.b
+    assert readme.column_dimensions["A"].width == 120
+    assert workbook["admin2"]["A1"].font.b
+
+    for name, df in [("admin1", admin1), ("admin2", admin2)]:
+        pd.testing.assert_frame_equal(pd.read_excel(path, sheet_name=name), df)
+
+
+def test_no_template(tmp_path):
+    path = tmp_path / "stats.xlsx"
+    assert write_xlsx_sheets(path, {"admin1": stats(3)}) == 3
+    assert load_workbook(path).sheetnames == ["admin1"]
@@ -0,0 +1,95 @@
+import os
+from zipfile import ZipFile
+
+import pytest
+
+from src.utils.zip_manifest import ManifestZip, copy_zip, read_manifest
+
+
+@pytest.fixture
+def members(tmp_path):
+    paths = {}
+    for i in range(3):
+        path = tmp_path / f"day{i}.tif"
+        path.write_bytes(os.urandom(1000) + bytes(50_000) * (i + 1))
+        paths[f"day{i}.tif"] = path
+    return paths
+
+
+def build(path, members, previous=None, fingerprints=None):
+    fingerprints = fingerprints or {name: name for name in members}
+    manifest = f"{path}.manifest.json"
+    previous_manifest = f"{previous}.manifest.json" if previous else None
+    with ManifestZip(path, manifest, previous, previous_manifest) as zipf:
+        for name, member in members.items():
+            if not zipf.reuse(name, fingerprints[name]):
+                zipf.write(member, name, fingerprints[name])
+    return zipf
+
+
+def test_manifest_is_kept_out_of_the_zip(tmp_path, members):
+    path = tmp_path / "out.zip"
+    build(path, members)
+    with ZipFile(path) as zipf:
+        assert zipf.namelist() == list(members)
+    assert set(read_manifest(f"{path}.manifest.json")) == set(members)
+
+
+def test_rebuild_reuses_unchanged_members(tmp_path, members):
+    path = tmp_path / "out.zip"
+    build(path, members)
+    previous = tmp_path / "previous.zip"
+    copy_zip(path, previous)
+    copy_zip(f"{path}.manifest.json", f"{previous}.manifest.json")
+
+    fingerprints = {name: name for name in members}
+    fingerprints["day1.tif"] = "changed"
+    zipf = build(path, members, previous, fingerprints)
+
+    assert zipf.reused == 2
+    with ZipFile(path) as out:
+        assert out.testzip() is None
+        for name, member in members.items():
+            assert out.read(name) == member.read_bytes()
+
+
+def test_rebuild_over_a_link_to_the_previous_zip(tmp_path, members):
+    # The published zip can be a link to the checkpoint it is rebuilt from
+    previous = tmp_path / "checkpoint.zip"
+    build(previous, members)
+    before = previous.read_bytes()
+    path = tmp_path / "out.zip"
+    os.link(previous, path)
+
+    zipf = build(path, members, previous)
+
+    assert zipf.reused == len(members)
+    assert previous.read_bytes() == before
+    with ZipFile(path) as out:
+        assert out.testzip() is None
+        for name, member in members.items():
+            assert out.read(name) == member.read_bytes()
+
+
+def test_stale_manifest_is_not_trusted(tmp_path, members):
+    previous = tmp_path / "previous.zip"
+    build(previous, members)
+    (tmp_path / "day0.tif").write_bytes(b"other content")
+    with ZipFile(previous, "w") as zipf:
+        zipf.write(tmp_path / "day0.tif", "day0.tif")
+
+    zipf = build(tmp_path / "out.zip", members, previous)
+
+    assert zipf.reused == 0
+
+
+def test_failed_build_leaves_the_zip(tmp_path, members):
+    path = tmp_path / "out.zip"
+    build(path, members)
+    before = path.read_bytes()
+    with pytest.raises(RuntimeError):
+        with ManifestZip(path, f"{path}.manifest.json", path) as zipf:
+            zipf.write(members["day0.tif"], "day0.tif")
+            raise RuntimeError
+    assert path.read_bytes() == before
+    assert [p.name for p in tmp_path.glob("*.part")] == []
@@ -0,0 +1,53 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.utils.zonal_stats import BaselineStats, WeightedZonalStats
+
+UNITS = pd.DataFrame({"iso3": ["AAA", "BBB"], "pcode": ["AA01", "BB01"]})
+
+
+def test_weighted_to_frame_in_batches_matches_one_stack():
+    rng = np.random.default_rng(0)
+    shape = (3, 4)
+    weights = sparse.csr_matrix(
+        rng.random((2, 12)) * (rng.random((2, 12)) > 0.5)
+    )
+    engine = WeightedZonalStats(weights, UNITS, shape)
+    rasters = {
+        date(2024, 1, day): rng.random(shape).astype(np.float32)
+        for day in range(1, 6)
+    }
+    rasters[date(2024, 1, 3)][0, 0] = np.nan
+
+    df = engine.to_frame(rasters, batch_size=2)
+
+    dates = sorted(rasters)
+    expected = engine.means_cube(np.stack([rasters[d] for d in dates]))
+    assert list(df["valid_date"].unique()) == dates
+    np.testing.assert_allclose(df["value"], expected.ravel())
+
+
+def test_baseline_lookup_leaves_out_missing_doys(caplog):
+    doys = np.arange(1, 366)
+    matrix = np.tile(doys.astype(np.float32), (2, 1)) / 10
+    baseline_stats = BaselineStats(matrix, UNITS, doys)
+
+    df = baseline_stats.lookup([365, 2, 366, 2])
+
+    assert list(df["doy"].unique()) == [2, 365]
+    np.testing.assert_allclose(df["sfed_baseline"], [0.2, 0.2, 36.5, 36.5])
+    assert "[366]" in caplog.text
+
+
+def test_baseline_lookup_of_unsorted_doys():
+    baseline_stats = BaselineStats(
+        np.array([[3.0, 1.0, 2.0]], dtype=np.float32), UNITS[:1], [3, 1, 2]
+    )
+
+    df = baseline_stats.lookup([2, 3])
+
+    assert df["doy"].tolist() == [2, 3]
+    assert df["sfed_baseline"].tolist() == [2.0, 3.0]
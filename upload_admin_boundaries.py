@@ -0,0 +1,95 @@
+#!/usr/bin/python
+"""
+Upload the admin boundaries the raster zonal stats are computed from.
+
+The zonal stats are normally read from the Postgres database. When it is
+unavailable or lagging, or with zonal_stats source "raster", they are
+computed from the SFED rasters over the admin 1 and 2 boundaries in the
+configured zonal_stats boundaries_container, as boundaries_blob. Those
+blobs are not written by any other step: export the boundaries the database
+stats are computed over (the CODAB polygons of the HRP countries) to one
+GeoJSON FeatureCollection per admin level, with ISO3 and ADM{level}_PCODE
+properties matching admin_lookup.parquet, then check and upload them:
+
+    python upload_admin_boundaries.py --adm1 adm1.geojson --adm2 adm2.geojson
+
+Uploading new boundaries changes their fingerprint, so the cached label
+grids and weight matrices are built again on the next run.
+"""
+
+import argparse
+import logging
+import sys
+
+from src.utils.preflight import CONFIG_FILE, read_configuration
+
+logger = logging.getLogger(__name__)
+
+GEOMETRY_TYPES = ("Polygon", "MultiPolygon")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--adm1", help="GeoJSON of the admin 1 boundaries")
+    parser.add_argument("--adm2", help="GeoJSON of the admin 2 boundaries")
+    parser.add_argument("--config", default=CONFIG_FILE)
+    return parser.parse_args()
+
+
+def check_boundaries(path, admin_level):
+    """
+    Check that a GeoJSON file can be read as admin boundaries.
+
+    Returns:
+        int: Number of admin units
+
+    Raises:
+        ValueError: If a feature is not a polygon, lacks the ISO3 or
+            ADM{level}_PCODE property, or a P-code is repeated
+    """
+    # Imported here so that --help stays fast
+    from src.utils.zonal_stats import read_admin_shapes
+
+    try:
+        shapes = read_admin_shapes(path, admin_level)
+    except KeyError as err:
+        raise ValueError(f"{path}: feature without a {err} property") from err
+    pcodes = set()
+    for geometry, _, pcode in shapes:
+        if geometry is None or geometry["type"] not in GEOMETRY_TYPES:
+            raise ValueError(f"{path}: {pcode} is not a polygon")
+        if pcode in pcodes:
+            raise ValueError(f"{path}: {pcode} is repeated")
+        pcodes.add(pcode)
+    return len(shapes)
+
+
+def main():
+    args = parse_args()
+    configuration = read_configuration(args.config)
+    config = configuration["zonal_stats"]
+    paths = {1: args.adm1, 2: args.adm2}
+    paths = {level: path for level, path in paths.items() if path}
+    if not paths:
+        logger.error("Nothing to upload, pass --adm1 and/or --adm2")
+        return 1
+    for admin_level, path in paths.items():
+        n_units = check_boundaries(path, admin_level)
+        logger.info(f"{path}: {n_units} admin {admin_level} units")
+
+    from src.utils.storage import storage_from_configuration
+
+    with storage_from_configuration(configuration) as storage:
+        for admin_level, path in paths.items():
+            blob = config["boundaries_blob"].format(admin_level=admin_level)
+            with open(path, "rb") as f:
+                storage.write(config["boundaries_container"], blob, f)
+            logger.info(
+                f"Uploaded {path} to {config['boundaries_container']}/{blob}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())